@@ -1,7 +1,13 @@
 import math
 
+import numpy as np
 from midiutil.MidiFile import MIDIFile
 
+from bass import render_bass
+from comping import render_comping
+from drums import TWELVE_EIGHT_BACKBEAT, TWELVE_EIGHT_HIHAT, render_drums
+from events import EventRecorder, write_events
+from groove import apply_groove
 from utils import save_midi_file
 
 
@@ -46,7 +52,7 @@ def create_angels_progression():
     return verse_progression, chorus_progression
 
 
-def create_angels_template():
+def create_angels_template(target=None):
     """Create MIDI arrangement of Jag trodde änglarna fans"""
     midi_file = MIDIFile(7, adjust_origin=False, deinterleave=False)
     setup_track_names(midi_file)
@@ -69,63 +75,53 @@ def create_angels_template():
 
     verse_prog, chorus_prog = create_angels_progression()
 
-    # Create full song structure following sheet music
+    # Create full song structure following sheet music. Everything is
+    # written on a straight grid and swung into 12/8 in one pass at the end.
+    song = EventRecorder()
     current_bar = 0
 
     # First verse
-    create_verse_section(midi_file, current_bar, verse_prog, "first")
+    create_verse_section(song, current_bar, verse_prog, "first")
     current_bar += VERSE_LENGTH
 
     # Chorus
-    create_chorus_section(midi_file, current_bar, chorus_prog, "first")
+    create_chorus_section(song, current_bar, chorus_prog, "first")
     current_bar += CHORUS_LENGTH
 
     # Second verse
-    create_verse_section(midi_file, current_bar, verse_prog, "second")
+    create_verse_section(song, current_bar, verse_prog, "second")
     current_bar += VERSE_LENGTH
 
     # Final Chorus
-    create_chorus_section(midi_file, current_bar, chorus_prog, "final")
+    create_chorus_section(song, current_bar, chorus_prog, "final")
 
-    save_midi_file(midi_file, "jag_trodde_anglarna_fans_2.mid")
+    write_events(midi_file, apply_groove(song.events(), "twelve_eight"))
+
+    return save_midi_file(midi_file, "jag_trodde_anglarna_fans_2.mid", target=target)
 
 
 def create_verse_section(midi_file, start_bar, progression, verse_type):
     """Create verse arrangement with correct 12/8 timing"""
-    for bar_pair in range(len(progression)):
-        chord_pair = progression[bar_pair]
-        for i in range(2):
-            current_bar = start_bar + (bar_pair * 2) + i
-            current_chord = chord_pair[i]
-            next_chord = (
-                chord_pair[1]
-                if i == 0
-                else progression[(bar_pair + 1) % len(progression)][0]
-            )
-
-            # In 12/8, each bar is divided into 4 main beats, each with 3 subdivisions
-            create_full_12_8_bar(
-                midi_file, current_chord, next_chord, current_bar, f"verse_{verse_type}"
-            )
+    create_full_12_8_section(
+        midi_file, start_bar, *section_chords(progression), f"verse_{verse_type}"
+    )
+
+
+def section_chords(progression):
+    """Current and next chord of every bar of a section built from chord pairs"""
+    chords = []
+    next_chords = []
+    for bar_pair, chord_pair in enumerate(progression):
+        chords.extend(chord_pair)
+        next_chords.append(chord_pair[1])
+        next_chords.append(progression[(bar_pair + 1) % len(progression)][0])
+    return chords, next_chords
 
 
 def create_rhythm_section_12_8(midi_file, chord, next_chord, bar, section_type):
     """Create rhythm section patterns in 12/8"""
-    # Bass pattern: Quarter note + eighth note pattern
-    root = chord[0] - 24
-    fifth = chord[2] - 24
-
-    bass_pattern = [
-        (root, 1.0, 100),  # Quarter note
-        (fifth, 0.5, 85),  # Eighth note
-        (root, 1.0, 90),  # Quarter note
-        (fifth, 0.5, 85),  # Eighth note
-    ]
-
-    time = bar * 4
-    for note, duration, velocity in bass_pattern:
-        midi_file.addNote(2, 0, note, time, duration, velocity)
-        time += duration
+    # Bass pattern: Quarter note + eighth note pattern, root and fifth
+    write_events(midi_file, render_comping(2, [bar], [chord], "root_fifth_bass"))
 
 
 def create_melody_12_8(midi_file, chord, bar, section_type):
@@ -217,130 +213,69 @@ def get_instrument(track):
 
 def create_chorus_section(midi_file, start_bar, progression, chorus_type):
     """Create chorus arrangement with proper phrasing"""
-    for bar_pair in range(len(progression)):
-        chord_pair = progression[bar_pair]
-        for i in range(2):
-            current_bar = start_bar + (bar_pair * 2) + i
-            current_chord = chord_pair[i]
-            next_chord = (
-                chord_pair[1]
-                if i == 0
-                else progression[(bar_pair + 1) % len(progression)][0]
-            )
-
-            create_full_12_8_bar(
-                midi_file,
-                current_chord,
-                next_chord,
-                current_bar,
-                f"chorus_{chorus_type}",
-                intensity=1.1 if chorus_type == "final" else 1.0,
-            )
-
-
-def create_full_12_8_bar(
-    midi_file, chord, next_chord, bar, section_type, intensity=1.0
-):
-    """Create a full bar arrangement in 12/8 time"""
-    # Base timing for 12/8
-    beat_duration = 1.0
-    triplet_duration = beat_duration / 3.0
+    create_full_12_8_section(
+        midi_file,
+        start_bar,
+        *section_chords(progression),
+        f"chorus_{chorus_type}",
+        intensity=1.1 if chorus_type == "final" else 1.0,
+    )
 
-    # Create individual instrument patterns
-    create_bass_pattern_12_8(midi_file, chord, next_chord, bar, intensity)
-    create_guitar_pattern_12_8(midi_file, chord, bar, intensity)
-    create_drums_12_8(midi_file, bar, section_type, intensity)
-    create_accordion_pattern_12_8(midi_file, chord, bar, section_type, intensity)
-
-    if section_type.startswith("chorus"):
-        create_chorus_melody(midi_file, chord, bar, section_type)
-        create_sax_chorus_pattern(midi_file, chord, bar, intensity)
 
+def create_full_12_8_section(
+    midi_file, start_bar, chords, next_chords, section_type, intensity=1.0
+):
+    """
+    Create a section's arrangement in 12/8 time.
 
-def create_bass_pattern_12_8(midi_file, chord, next_chord, bar, intensity=1.0):
-    """Create bass pattern with proper 12/8 walking line"""
-    root = chord[0] - 24
-    fifth = chord[2] - 24
-    next_root = next_chord[0] - 24
-    base_velocity = int(95 * intensity)
-
-    # Main pattern (following sheet music rhythm)
-    pattern = [
-        (root, 1.0, base_velocity),  # Beat 1: root (quarter note)
-        (fifth, 0.5, base_velocity - 10),  # Beat 1+: fifth (eighth note)
-        (root, 1.0, base_velocity - 5),  # Beat 2: root (quarter note)
-        (fifth, 0.5, base_velocity - 10),  # Beat 2+: fifth (eighth note)
-        (root, 0.5, base_velocity - 5),  # Beat 3: walking pattern to next chord
-        (root + 2, 0.5, base_velocity - 10),
-    ]
+    The rhythm section and accordion are rendered over all the section's
+    bars at once, only the chorus melody and saxes go bar by bar.
+    """
+    bars = np.arange(start_bar, start_bar + len(chords))
 
-    time = bar * 4
-    for note, duration, velocity in pattern:
-        midi_file.addNote(2, 0, note, time, duration, velocity)
-        time += duration
+    create_bass_pattern_12_8(midi_file, chords, next_chords, bars, intensity)
+    create_guitar_pattern(midi_file, chords, bars, intensity)
+    create_drums_12_8(midi_file, bars, section_type, intensity)
+    create_accordion_pattern_12_8(midi_file, chords, bars, section_type, intensity)
 
+    if section_type.startswith("chorus"):
+        for bar, chord in zip(bars.tolist(), chords):
+            create_chorus_melody(midi_file, chord, bar, section_type)
+            create_sax_chorus_pattern(midi_file, chord, bar, intensity)
 
-def create_guitar_pattern_12_8(midi_file, chord, bar, intensity=1.0):
-    """Create rhythm guitar pattern with proper 12/8 strumming"""
-    base_velocity = int(85 * intensity)
 
-    # Typical dansband guitar pattern in 12/8
-    for beat in range(4):
-        time = bar * 4 + beat
+def create_bass_pattern_12_8(midi_file, chords, next_chords, bars, intensity=1.0):
+    """Create bass pattern with proper 12/8 walking line"""
+    events = render_bass(
+        2, bars, chords, next_chords, "twelve_eight", intensity=intensity
+    )
+    write_events(midi_file, events)
 
-        # Down strum on the beat
-        for note in chord:
-            midi_file.addNote(3, 0, note, time, 0.3, base_velocity)
 
-        # Up strum on the off-beat
-        for note in chord:
-            midi_file.addNote(3, 0, note, time + 0.5, 0.2, base_velocity - 10)
+def create_guitar_pattern(midi_file, chords, bars, intensity=1.0):
+    """Create rhythm guitar pattern on straight eighths (the groove makes it 12/8)"""
+    # Typical dansband guitar pattern: down strum on the beat, up on the off-beat
+    events = render_comping(3, bars, chords, "twelve_eight_guitar", intensity)
+    write_events(midi_file, events)
 
 
-def create_drums_12_8(midi_file, bar, section_type, intensity=1.0):
+def create_drums_12_8(midi_file, bars, section_type, intensity=1.0):
     """Create drum pattern with proper 12/8 feel"""
-    kick = 36
-    snare = 38
-    hihat = 42
-    crash = 49
-
-    base_velocity = int(90 * intensity)
-
-    # Basic pattern
-    time = bar * 4
-
-    # Kick drum pattern
-    midi_file.addNote(4, 9, kick, time, 0.5, base_velocity)
-    midi_file.addNote(4, 9, kick, time + 2, 0.5, base_velocity - 5)
-
-    # Snare on 2 and 4
-    midi_file.addNote(4, 9, snare, time + 1, 0.5, base_velocity)
-    midi_file.addNote(4, 9, snare, time + 3, 0.5, base_velocity)
-
-    # Hi-hat pattern (12/8 triplet feel)
-    for i in range(12):
-        midi_file.addNote(4, 9, hihat, time + (i * 0.333), 0.3, base_velocity - 20)
+    # Kick on 1 and 3, snare on 2 and 4, hi-hat on every triplet eighth
+    events = render_drums(
+        4,
+        bars,
+        [(TWELVE_EIGHT_BACKBEAT, True, 0), (TWELVE_EIGHT_HIHAT, True, 0)],
+        intensity,
+    )
+    write_events(midi_file, events)
 
 
-def create_accordion_pattern_12_8(midi_file, chord, bar, section_type, intensity=1.0):
+def create_accordion_pattern_12_8(midi_file, chords, bars, section_type, intensity=1.0):
     """Create accordion pattern with characteristic 12/8 feel"""
-    base_velocity = int(90 * intensity)
-
-    # Main chord pattern
-    time = bar * 4
-    for beat in range(4):
-        # Full chord on the beat
-        for note in chord:
-            midi_file.addNote(1, 0, note, time + beat, 0.75, base_velocity)
-
-        # Upper voices on off-beats for fill
-        if beat % 2 == 1:
-            midi_file.addNote(
-                1, 0, chord[1], time + beat + 0.5, 0.25, base_velocity - 15
-            )
-            midi_file.addNote(
-                1, 0, chord[2], time + beat + 0.5, 0.25, base_velocity - 15
-            )
+    # Full chord on the beat, upper voices on the off-beats of 2 and 4
+    events = render_comping(1, bars, chords, "twelve_eight_accordion", intensity)
+    write_events(midi_file, events)
 
 
 def create_chorus_melody(midi_file, chord, bar, section_type):
@@ -0,0 +1,142 @@
+import fcntl
+import json
+import mmap
+import os
+import sys
+import time
+
+
+class SongArchive:
+    """
+    Append-only archive of MIDI files: one data file with the files' bytes
+    back to back, and an index (JSON lines) of every file's name, offset,
+    length, spec hash and metadata next to it.
+
+    Appends take an exclusive flock on the data file, so worker processes
+    can append to the same archive at once. A file's bytes are written
+    before its index line, so the index only ever points at complete files.
+    Readers map the data file and slice files out of the map. Appending a
+    name again replaces it for readers, the old bytes stay in the archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.index"
+        self._entries = None
+        self._map = None
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, name, data, spec_hash="", metadata=None):
+        """
+        Add a MIDI file's contents to the archive.
+
+        Args:
+            name: Name the file is read back by
+            data: The file contents
+            spec_hash: Hash of the spec the file was rendered from
+            metadata: Anything JSON can hold, e.g. tempo and bars
+
+        Returns:
+            dict: The file's index entry
+        """
+        with open(self.path, "ab") as data_file:
+            fcntl.flock(data_file, fcntl.LOCK_EX)
+            try:
+                offset = data_file.seek(0, os.SEEK_END)
+                data_file.write(data)
+                data_file.flush()
+                entry = {
+                    "name": name,
+                    "offset": offset,
+                    "length": len(data),
+                    "spec_hash": spec_hash,
+                    "added": time.time(),
+                    "metadata": metadata or {},
+                }
+                with open(self.index_path, "a") as index_file:
+                    index_file.write(json.dumps(entry) + "\n")
+            finally:
+                fcntl.flock(data_file, fcntl.LOCK_UN)
+        # The map ends where the data file ended, so it is mapped again
+        self.close()
+        return entry
+
+    def refresh(self):
+        """Pick up files appended since the archive was opened"""
+        self.close()
+
+    def close(self):
+        """Unmap the data file"""
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._map = self._file = self._entries = None
+
+    def _mapped(self):
+        if self._map is None:
+            # An empty or missing data file cannot be mapped
+            self._map = b""
+            if os.path.exists(self.path) and os.path.getsize(self.path):
+                self._file = open(self.path, "rb")
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def entries(self):
+        """Index entries of the archived files by name (the last append of a name wins)"""
+        if self._entries is None:
+            size = len(self._mapped())
+            self._entries = {}
+            try:
+                with open(self.index_path) as index_file:
+                    for line in index_file:
+                        # A line still being appended is not there yet
+                        if not line.endswith("\n"):
+                            break
+                        entry = json.loads(line)
+                        if entry["offset"] + entry["length"] <= size:
+                            self._entries[entry["name"]] = entry
+            except FileNotFoundError:
+                pass
+        return self._entries
+
+    def names(self):
+        """Names of the files in the archive, in the order they were added"""
+        return list(self.entries())
+
+    def read(self, name):
+        """
+        Contents of a file in the archive, for smf.load_midi or smf.read_smf.
+
+        Raises:
+            KeyError: When no file has that name
+        """
+        entry = self.entries()[name]
+        return bytes(
+            self._mapped()[entry["offset"] : entry["offset"] + entry["length"]]
+        )
+
+
+def pack(archive_path, midi_paths):
+    """Append MIDI files to an archive under their file names"""
+    with SongArchive(archive_path) as archive:
+        for midi_path in midi_paths:
+            with open(midi_path, "rb") as midi_file:
+                archive.append(os.path.basename(midi_path), midi_file.read())
+
+
+if __name__ == "__main__":
+    # archive.py songs.dbar a.mid b.mid appends files, archive.py songs.dbar lists them
+    archive_path, *midi_paths = sys.argv[1:]
+    if midi_paths:
+        pack(archive_path, midi_paths)
+    else:
+        with SongArchive(archive_path) as archive:
+            for entry in archive.entries().values():
+                print(f"{entry['name']}\t{entry['length']}\t{entry['spec_hash']}")
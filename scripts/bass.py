@@ -0,0 +1,194 @@
+from functools import lru_cache
+
+import numpy as np
+
+from events import EVENT_DTYPE, NOTE
+
+# Bass lines sit two octaves below the chord voicings
+OCTAVES_DOWN = 24
+
+# Range of bass roots covered by the transition tables
+BASS_LOW = 12
+BASS_HIGH = 71
+
+# Chord tones a pattern note can be built on
+ROOT = 0
+THIRD = 1
+FIFTH = 2
+
+# Approach line variants, every style has one of each per chord pair
+VARIANTS = ("scale", "chromatic", "enclosure")
+
+
+def walking_lines(start, end):
+    """Four-slot approach lines (one per variant) from start towards end"""
+    direction = 1 if end >= start else -1
+
+    # Scale walk in whole steps, or straight to the target when it is close
+    if abs(end - start) <= 3:
+        scale = [start, end]
+    else:
+        scale = [start, start + 2 * direction, start + 4 * direction, end]
+
+    chromatic = [start, end - 2 * direction, end - direction, end]
+    enclosure = [start, end + 1, end - 1, end]
+    return [scale, chromatic, enclosure]
+
+
+def two_step_lines(start, end):
+    """Two-slot approach lines (one per variant) leading into end"""
+    direction = 1 if end >= start else -1
+    scale = [start, start + 2]
+    chromatic = [end - 2 * direction, end - direction]
+    enclosure = [end + 1, end - 1]
+    return [scale, chromatic, enclosure]
+
+
+# pattern: the chord-tone part of the bar as
+#     (beat, duration, chord tone, interval, base velocity, velocity offset)
+# slots: the approach part as (beat, duration, base velocity, velocity offset)
+# approach_from: interval above the root the approach line starts from
+# lines: builds the approach lines of every variant for a (start, end) pair
+#
+# Velocities are int(base * intensity) - offset, like the drum patterns.
+BASS_STYLES = {
+    # Ole Ivars walking bass (hav_full_v3): root, fifth, octave-fifth and a
+    # sixteenth-note walk into the next chord
+    "ole_ivars": {
+        "pattern": [
+            (0, 1, ROOT, 0, 100, 0),
+            (1, 1, FIFTH, 0, 85, 0),
+            (2, 1, ROOT, 7, 90, 0),
+        ],
+        "slots": [(3 + i * 0.25, 0.25, 85, 0) for i in range(4)],
+        "approach_from": 7,
+        "lines": walking_lines,
+    },
+    # DansebandSong bass (library): eighth notes through the chord
+    "danseband": {
+        "pattern": [
+            (0, 0.5, ROOT, 0, 100, 0),
+            (0.5, 0.5, ROOT, 7, 85, 0),
+            (1, 0.5, THIRD, 0, 90, 0),
+            (1.5, 0.5, FIFTH, 0, 85, 0),
+            (2, 0.5, ROOT, 0, 95, 0),
+            (2.5, 0.5, ROOT, 5, 85, 0),
+        ],
+        "slots": [(3, 0.5, 85, 0), (3.5, 0.5, 85, 0)],
+        "approach_from": 3,
+        "lines": two_step_lines,
+    },
+    # 12/8 bass (angels): quarter + eighth figures, walking on the last beat
+    "twelve_eight": {
+        "pattern": [
+            (0, 1.0, ROOT, 0, 95, 0),
+            (1.0, 0.5, FIFTH, 0, 95, 10),
+            (1.5, 1.0, ROOT, 0, 95, 5),
+            (2.5, 0.5, FIFTH, 0, 95, 10),
+        ],
+        "slots": [(3.0, 0.5, 95, 5), (3.5, 0.5, 95, 10)],
+        "approach_from": 0,
+        "lines": two_step_lines,
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def compile_style(style):
+    """
+    Compile a bass style into pattern arrays and its transition table.
+
+    The table holds the approach line of every variant for every pair of
+    roots in BASS_LOW..BASS_HIGH, indexed [from_root, to_root, variant, slot]
+    (roots relative to BASS_LOW). Lines shorter than the number of slots are
+    padded and masked out through "valid".
+    """
+    spec = BASS_STYLES[style]
+    pattern = np.array(spec["pattern"], dtype=np.float64)
+    slots = np.array(spec["slots"], dtype=np.float64)
+
+    size = BASS_HIGH - BASS_LOW + 1
+    pitches = np.zeros((size, size, len(VARIANTS), len(slots)), dtype=np.int16)
+    valid = np.zeros(pitches.shape, dtype=bool)
+    for start in range(size):
+        for end in range(size):
+            lines = spec["lines"](
+                BASS_LOW + start + spec["approach_from"], BASS_LOW + end
+            )
+            for variant, line in enumerate(lines):
+                pitches[start, end, variant, : len(line)] = line
+                valid[start, end, variant, : len(line)] = True
+
+    return {
+        "beats": np.concatenate([pattern[:, 0], slots[:, 0]]),
+        "durations": np.concatenate([pattern[:, 1], slots[:, 1]]),
+        "tones": pattern[:, 2].astype(np.intp),
+        "intervals": pattern[:, 3].astype(np.int16),
+        "bases": np.concatenate([pattern[:, 4], slots[:, 2]]),
+        "offsets": np.concatenate([pattern[:, 5], slots[:, 3]]).astype(np.int32),
+        "pitches": pitches,
+        "valid": valid,
+    }
+
+
+def render_bass(
+    track,
+    bars,
+    chords,
+    next_chords,
+    style,
+    variant=0,
+    intensity=1.0,
+    beats_per_bar=4,
+):
+    """
+    Render a bass line for many bars with one table lookup per bar.
+
+    Args:
+        track: Track the notes are written to (channel 0)
+        bars: Absolute bar numbers
+        chords: Chord voicing (root, third, fifth) of every bar
+        next_chords: Chord the approach line of every bar leads into
+        style: Key of BASS_STYLES
+        variant: Index into VARIANTS, a single value or one per bar
+        intensity: Velocity scaling, a single value or one per bar
+        beats_per_bar: Length of a bar in beats
+
+    Returns:
+        numpy.ndarray: Note events (EVENT_DTYPE) ordered by bar
+    """
+    compiled = compile_style(style)
+    bars = np.asarray(bars)
+    if len(bars) == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    tones = np.asarray(chords, dtype=np.int16)[:, :3] - OCTAVES_DOWN
+    next_roots = np.asarray(next_chords, dtype=np.int16)[:, 0] - OCTAVES_DOWN
+    variant = np.broadcast_to(variant, bars.shape)
+    intensity = np.broadcast_to(np.asarray(intensity, dtype=np.float64), bars.shape)
+
+    roots = tones[:, ROOT]
+    for root in (roots, next_roots):
+        if root.size and (root.min() < BASS_LOW or root.max() > BASS_HIGH):
+            raise ValueError(
+                f"Bass roots {root.min()}-{root.max()} outside the transition "
+                f"table range {BASS_LOW}-{BASS_HIGH}"
+            )
+
+    # Chord-tone part from the chord table, approach part from the table
+    chord_part = tones[:, compiled["tones"]] + compiled["intervals"]
+    line = (roots - BASS_LOW, next_roots - BASS_LOW, variant)
+    pitches = np.concatenate([chord_part, compiled["pitches"][line]], axis=1)
+    valid = np.concatenate(
+        [np.ones(chord_part.shape, dtype=bool), compiled["valid"][line]], axis=1
+    )
+
+    events = np.zeros(pitches.shape, dtype=EVENT_DTYPE)
+    events["kind"] = NOTE
+    events["track"] = track
+    events["time"] = bars[:, None] * beats_per_bar + compiled["beats"]
+    events["duration"] = compiled["durations"]
+    events["data1"] = pitches
+    events["data2"] = (compiled["bases"] * intensity[:, None]).astype(
+        np.int32
+    ) - compiled["offsets"]
+    return events[valid]
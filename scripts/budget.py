@@ -0,0 +1,87 @@
+# Rough serialized sizes in bytes, including the delta time in front of
+# every event. Curves are dense, so most deltas fit in a single byte.
+NOTE_BYTES = 9  # Note on + note off, usually with a two byte delta
+CHANNEL_EVENT_BYTES = 4  # Controller, pitch wheel or program change
+TRACK_OVERHEAD_BYTES = 40  # Chunk header, name, tempo and end of track
+HEADER_BYTES = 14
+
+
+class BudgetExceededError(ValueError):
+    """Raised when a song would produce more events or bytes than allowed"""
+
+
+def estimate_midi_bytes(counts, num_tracks):
+    """
+    Estimate the size of the written MIDI file from event counts.
+
+    Args:
+        counts: Mapping with notes, controller_events, pitch_wheel_events and
+            program_changes
+        num_tracks: Number of tracks in the file (the tempo track is added)
+
+    Returns:
+        int: Approximate file size in bytes
+    """
+    channel_events = (
+        counts["controller_events"]
+        + counts["pitch_wheel_events"]
+        + counts["program_changes"]
+    )
+    return (
+        HEADER_BYTES
+        + (num_tracks + 1) * TRACK_OVERHEAD_BYTES
+        + counts["notes"] * NOTE_BYTES
+        + channel_events * CHANNEL_EVENT_BYTES
+    )
+
+
+class RenderBudget:
+    """
+    Upper limits for a single render.
+
+    A song over budget first gets its expression curves thinned out, one
+    density at a time. If even the lowest density is too big, the render is
+    rejected before anything is produced.
+    """
+
+    def __init__(
+        self,
+        max_events=None,
+        max_bytes=None,
+        curve_densities=(1.0, 0.5, 0.25, 0.125),
+    ):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.curve_densities = curve_densities
+
+    def violations(self, estimate):
+        """Return a description of every limit the estimate goes over"""
+        problems = []
+        if self.max_events is not None and estimate["events"] > self.max_events:
+            problems.append(f"{estimate['events']} events > {self.max_events}")
+        if self.max_bytes is not None and estimate["bytes"] > self.max_bytes:
+            problems.append(f"{estimate['bytes']} bytes > {self.max_bytes}")
+        return problems
+
+    def fit(self, estimate_at):
+        """
+        Find the highest curve density that keeps a render within budget.
+
+        Args:
+            estimate_at: Function taking a curve density and returning an
+                estimate with "events" and "bytes"
+
+        Returns:
+            float: The curve density to render with
+
+        Raises:
+            BudgetExceededError: If no curve density fits
+        """
+        for density in self.curve_densities:
+            problems = self.violations(estimate_at(density))
+            if not problems:
+                return density
+
+        raise BudgetExceededError(
+            f"Render over budget at curve density {density}: {', '.join(problems)}"
+        )
@@ -0,0 +1,184 @@
+import ast
+import hashlib
+import json
+import os
+import runpy
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version
+
+from utils import BUILD_DIR_VARIABLE, get_generated_path
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The scripts that render the bundled arrangements
+ARRANGEMENTS = (
+    "angels",
+    "dansband",
+    "hav",
+    "hav_full",
+    "hav_full_v2",
+    "hav_full_v3",
+    "himmelen",
+    "library",
+    "library_example",
+    "main",
+)
+
+# Packages whose version changes what the scripts write
+PACKAGES = ("midiutil", "numpy")
+
+MANIFEST = "build_manifest.json"
+
+
+def local_imports(name):
+    """Names of the modules in the scripts directory that a module imports"""
+    with open(os.path.join(SCRIPTS_DIR, f"{name}.py")) as source:
+        tree = ast.parse(source.read())
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    return {
+        module
+        for module in names
+        if os.path.exists(os.path.join(SCRIPTS_DIR, f"{module}.py"))
+    }
+
+
+def source_hash(name):
+    """
+    Hash everything a script's outputs are made from.
+
+    That is the script, every local module it imports (directly or through
+    other modules) and the versions of PACKAGES.
+    """
+    modules = set()
+    pending = [name]
+    while pending:
+        module = pending.pop()
+        if module not in modules:
+            modules.add(module)
+            pending.extend(local_imports(module))
+
+    digest = hashlib.sha256()
+    for module in sorted(modules):
+        with open(os.path.join(SCRIPTS_DIR, f"{module}.py"), "rb") as source:
+            digest.update(module.encode() + b"\0" + source.read() + b"\0")
+    for package in PACKAGES:
+        digest.update(f"{package}=={version(package)}\0".encode())
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    """The last build's hash and outputs of every script, empty before a build"""
+    try:
+        with open(path) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(path, manifest):
+    """Replace the manifest in one step, so an interrupted build leaves the old one"""
+    partial = f"{path}.partial"
+    with open(partial, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(partial, path)
+
+
+def up_to_date(entry, digest):
+    """Check a manifest entry against a script's hash and its outputs on disk"""
+    return (
+        entry is not None
+        and entry["hash"] == digest
+        and all(os.path.exists(get_generated_path(f)) for f in entry["outputs"])
+    )
+
+
+def build_script(name):
+    """
+    Run a script in this (worker) process and move what it saved into the
+    generated directory, replacing the previous build's files.
+
+    Returns:
+        tuple: (outputs, seconds) with the names of the files written
+    """
+    started = time.perf_counter()
+    # A private directory per build, on the same filesystem as the outputs
+    with tempfile.TemporaryDirectory(
+        dir=os.path.dirname(get_generated_path(""))
+    ) as build_dir:
+        os.environ[BUILD_DIR_VARIABLE] = build_dir
+        try:
+            runpy.run_path(os.path.join(SCRIPTS_DIR, f"{name}.py"), run_name="__main__")
+        finally:
+            del os.environ[BUILD_DIR_VARIABLE]
+
+        outputs = sorted(os.listdir(build_dir))
+        for output in outputs:
+            os.replace(os.path.join(build_dir, output), get_generated_path(output))
+    return outputs, time.perf_counter() - started
+
+
+def build(names=ARRANGEMENTS, force=False, workers=None):
+    """
+    Render the bundled arrangements that changed since the last build.
+
+    Every script runs in a worker process. A script is skipped when its hash
+    (see source_hash) matches the manifest and its outputs are still there.
+
+    Args:
+        names: Scripts to build
+        force: Build every script, changed or not
+        workers: Maximum number of worker processes (None uses every core)
+
+    Returns:
+        bool: Whether every script built
+    """
+    manifest_path = get_generated_path(MANIFEST)
+    manifest = read_manifest(manifest_path)
+    digests = {name: source_hash(name) for name in names}
+    stale = [
+        name
+        for name in names
+        if force or not up_to_date(manifest.get(name), digests[name])
+    ]
+    for name in names:
+        if name not in stale:
+            print(f"{name}: up to date")
+    if not stale:
+        return True
+
+    succeeded = True
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(build_script, name) for name in stale}
+        for name, future in futures.items():
+            try:
+                outputs, seconds = future.result()
+            except Exception as error:
+                print(f"{name}: failed ({type(error).__name__}: {error})")
+                manifest.pop(name, None)
+                succeeded = False
+                continue
+            print(f"{name}: {', '.join(outputs)} in {seconds:.1f}s")
+            manifest[name] = {"hash": digests[name], "outputs": outputs}
+
+    write_manifest(manifest_path, manifest)
+    return succeeded
+
+
+if __name__ == "__main__":
+    # build.py [--force] [script ...] builds everything (changed) by default
+    arguments = sys.argv[1:]
+    force = "--force" in arguments
+    names = [argument for argument in arguments if argument != "--force"]
+    unknown = sorted(set(names) - set(ARRANGEMENTS))
+    if unknown:
+        sys.exit(f"Unknown arrangements: {', '.join(unknown)}")
+    sys.exit(0 if build(names or ARRANGEMENTS, force) else 1)
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+
+from spec import DEFAULT_NAME, read_spec, song_from_spec
+from utils import get_generated_path
+
+# How often a watched spec is checked, and how long it has to stay
+# unchanged before it is rendered (editors often save in several writes)
+POLL_SECONDS = 0.1
+DEBOUNCE_SECONDS = 0.3
+
+USAGE = """usage: cli.py render spec.json [output.mid | -]
+       cli.py watch spec.json [output.mid]"""
+
+
+def output_path(spec, output=None):
+    """Where a spec is rendered to, by default a fixed file named after the song"""
+    return output or get_generated_path(spec.get("name", DEFAULT_NAME))
+
+
+def render_spec(spec_path, output=None, previous=None):
+    """
+    Render a spec file.
+
+    Args:
+        spec_path: The JSON song spec
+        output: Path to save to (see output_path), "-" streams the file to
+            standard output
+        previous: Song rendered from an earlier version of the spec, whose
+            unchanged sections are reused
+
+    Returns:
+        tuple: (song, seconds) with the rendered song and the time from
+            reading the spec to the saved file
+    """
+    started = time.perf_counter()
+    spec = read_spec(spec_path)
+    song, progressions = song_from_spec(spec, previous)
+    if output == "-":
+        song.output_path = output
+        song.generate_song(progressions, target="-")
+    else:
+        song.output_path = output_path(spec, output)
+        song.generate_song(progressions)
+    return song, time.perf_counter() - started
+
+
+def report(song, seconds, file=None):
+    """Print what a render did and how long it took"""
+    rendered = ", ".join(song.rendered_sections) or "nothing"
+    print(
+        f"{time.strftime('%H:%M:%S')} {song.output_path}: rendered {rendered} "
+        f"({len(song.rendered_sections)} of {len(song.section_cache)} sections) "
+        f"in {seconds * 1000:.0f} ms",
+        file=file,
+        flush=True,
+    )
+
+
+def file_state(path):
+    """Modification time and size of a file, None while it does not exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def settled_state(path, poll=POLL_SECONDS, debounce=DEBOUNCE_SECONDS):
+    """Wait until a file has not changed for debounce seconds and return its state"""
+    state = file_state(path)
+    quiet_since = time.monotonic()
+    while time.monotonic() - quiet_since < debounce:
+        time.sleep(poll)
+        current = file_state(path)
+        if current != state:
+            state = current
+            quiet_since = time.monotonic()
+    return state
+
+
+def watch(spec_path, output=None, poll=POLL_SECONDS, debounce=DEBOUNCE_SECONDS):
+    """
+    Render a spec file, then render it again whenever it changes.
+
+    The song stays in this process between renders, so every render after
+    the first only renders the sections whose inputs changed, and all of
+    them are saved to the same file. A spec that cannot be read or does not
+    make a song is reported and the watch goes on with the next save.
+    Runs until interrupted.
+    """
+    song = None
+    rendered_state = None
+    print(f"Watching {spec_path} (Ctrl+C to stop)", flush=True)
+    while True:
+        if file_state(spec_path) not in (None, rendered_state):
+            rendered_state = settled_state(spec_path, poll, debounce)
+            try:
+                song, seconds = render_spec(spec_path, output, song)
+            except (OSError, ValueError) as error:
+                print(f"{time.strftime('%H:%M:%S')} {error}", file=sys.stderr)
+            else:
+                report(song, seconds)
+        time.sleep(poll)
+
+
+def main(arguments):
+    if len(arguments) not in (2, 3) or arguments[0] not in ("render", "watch"):
+        sys.exit(USAGE)
+    command, spec_path, *output = arguments
+    output = output[0] if output else None
+
+    if command == "render":
+        # A song streamed to standard output is reported on standard error
+        report(*render_spec(spec_path, output), sys.stderr if output == "-" else None)
+    elif output == "-":
+        sys.exit(USAGE)
+    else:
+        try:
+            watch(spec_path, output)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,163 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from events import CONTROLLER, EVENT_DTYPE, NOTE
+
+# Chord tones a pattern note can be built on
+ROOT = 0
+THIRD = 1
+FIFTH = 2
+
+# Every tone of the chord, in voicing order
+ALL = None
+
+# notes: (tones, hits) groups, each hit played on every tone of its group
+#     before the group's next tone, as (beat, duration, interval, base
+#     velocity, velocity offset). tones is a tuple of chord tones or ALL.
+# curve: optional (controller, values) spread evenly over the bar after
+#     the notes
+#
+# Velocities are int(base * intensity) - offset, like the drum patterns.
+COMPING_STYLES = {
+    # Ole Ivars boom-chick guitar (hav_full_v3): bass note and a muted stroke
+    # on 1 and 3, upstroke and mute on 2 and 4
+    "ole_ivars_guitar": {
+        "notes": [
+            group
+            for beat in range(0, 4, 2)
+            for group in (
+                ((ROOT,), [(beat, 0.45, -12, 95, 0)]),
+                (ALL, [(beat + 0.45, 0.05, 0, 75, 20)]),
+                (ALL, [(beat + 1, 0.4, 0, 95, 0), (beat + 1.4, 0.1, 0, 75, 15)]),
+            )
+        ],
+    },
+    # Ole Ivars accordion (hav_full_v3): chords on 1 and 3, the octave above
+    # on the off-beats of 2 and 4, and a bellows swell on expression
+    "ole_ivars_accordion": {
+        "notes": [
+            group
+            for beat in range(0, 4, 2)
+            for group in (
+                (ALL, [(beat, 0.75, 0, 90, 0)]),
+                (ALL, [(beat + 1.5, 0.5, 12, 90, 10)]),
+            )
+        ],
+        "curve": (11, [100 + int(math.sin(i * math.pi / 8) * 25) for i in range(32)]),
+    },
+    # 12/8 guitar (angels): down strum on the beat, up strum on the off-beat
+    "twelve_eight_guitar": {
+        "notes": [
+            group
+            for beat in range(4)
+            for group in (
+                (ALL, [(beat, 0.3, 0, 85, 0)]),
+                (ALL, [(beat + 0.5, 0.2, 0, 85, 10)]),
+            )
+        ],
+    },
+    # 12/8 accordion (angels): chord on every beat, third and fifth filling
+    # the off-beats of 2 and 4
+    "twelve_eight_accordion": {
+        "notes": [
+            group
+            for beat in range(4)
+            for group in (
+                [(ALL, [(beat, 0.75, 0, 90, 0)])]
+                + (
+                    [((THIRD, FIFTH), [(beat + 0.5, 0.25, 0, 90, 15)])]
+                    if beat % 2
+                    else []
+                )
+            )
+        ],
+    },
+    # Root-fifth bass (angels): quarter and eighth figures two octaves down
+    "root_fifth_bass": {
+        "notes": [
+            ((ROOT,), [(0, 1.0, -24, 100, 0)]),
+            ((FIFTH,), [(1.0, 0.5, -24, 85, 0)]),
+            ((ROOT,), [(1.5, 1.0, -24, 90, 0)]),
+            ((FIFTH,), [(2.5, 0.5, -24, 85, 0)]),
+        ],
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def compile_comping(style, voices=3, beats_per_bar=4):
+    """
+    Compile a comping style into one bar's template for chords of some size.
+
+    Returns:
+        dict: Per note the beat, duration, chord tone, interval, base velocity
+            and offset, plus the curve's controller, beats and values
+    """
+    spec = COMPING_STYLES[style]
+    hits = []
+    for tones, group in spec["notes"]:
+        for tone in range(voices) if tones is ALL else tones:
+            for beat, duration, interval, base, offset in group:
+                hits.append((beat, duration, tone, interval, base, offset))
+    hits = np.array(hits, dtype=np.float64)
+
+    controller, values = spec.get("curve", (0, []))
+    return {
+        "beats": hits[:, 0],
+        "durations": hits[:, 1],
+        "tones": hits[:, 2].astype(np.intp),
+        "intervals": hits[:, 3].astype(np.int16),
+        "bases": hits[:, 4],
+        "offsets": hits[:, 5].astype(np.int32),
+        "controller": controller,
+        "curve_beats": np.arange(len(values)) / len(values) * beats_per_bar,
+        "curve_values": np.array(values, dtype=np.int32),
+    }
+
+
+def render_comping(track, bars, chords, style, intensity=1.0, beats_per_bar=4):
+    """
+    Render a comping pattern for many bars in one pass.
+
+    The bar's template is broadcast against the bars, with every note's
+    pitch looked up in a table of the bars' chords.
+
+    Args:
+        track: Track the events are written to (channel 0)
+        bars: Absolute bar numbers
+        chords: Chord voicing of every bar, all with the same number of notes
+        style: Key of COMPING_STYLES
+        intensity: Velocity scaling, a single value or one per bar
+        beats_per_bar: Length of a bar in beats
+
+    Returns:
+        numpy.ndarray: Events (EVENT_DTYPE) ordered by bar, the notes of
+            every bar before its curve
+    """
+    bars = np.asarray(bars)
+    if len(bars) == 0:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    chords = np.asarray(chords, dtype=np.int16).reshape(len(bars), -1)
+    compiled = compile_comping(style, chords.shape[1], beats_per_bar)
+    intensity = np.broadcast_to(np.asarray(intensity, dtype=np.float64), bars.shape)
+
+    notes = np.zeros((len(bars), len(compiled["beats"])), dtype=EVENT_DTYPE)
+    notes["kind"] = NOTE
+    notes["time"] = bars[:, None] * beats_per_bar + compiled["beats"]
+    notes["duration"] = compiled["durations"]
+    notes["data1"] = chords[:, compiled["tones"]] + compiled["intervals"]
+    notes["data2"] = (compiled["bases"] * intensity[:, None]).astype(
+        np.int32
+    ) - compiled["offsets"]
+
+    curve = np.zeros((len(bars), len(compiled["curve_beats"])), dtype=EVENT_DTYPE)
+    curve["kind"] = CONTROLLER
+    curve["time"] = bars[:, None] * beats_per_bar + compiled["curve_beats"]
+    curve["data1"] = compiled["controller"]
+    curve["data2"] = compiled["curve_values"]
+
+    events = np.concatenate([notes, curve], axis=1).ravel()
+    events["track"] = track
+    return events
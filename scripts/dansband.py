@@ -5,7 +5,7 @@ from midiutil.MidiFile import MIDIFile
 from utils import save_midi_file
 
 
-def create_danseband_template():
+def create_danseband_template(target=None):
     # Create MIDI object with 6 tracks (adding vocal track)
     midi_file = MIDIFile(6, adjust_origin=False, deinterleave=False)
 
@@ -32,7 +32,7 @@ def create_danseband_template():
     create_drum_pattern(midi_file, 4)
     create_vocal_melody(midi_file, 5, chords)
 
-    save_midi_file(midi_file, "danseband.mid")
+    return save_midi_file(midi_file, "danseband.mid", target=target)
 
 
 def get_instrument(track):
@@ -0,0 +1,151 @@
+import numpy as np
+
+from events import DRUM_CHANNEL, EVENT_DTYPE, NOTE
+
+# General MIDI drum notes
+KICK = 36
+SNARE = 38
+HIHAT = 42
+LOW_TOM = 45
+MID_TOM = 47
+CRASH = 49
+HIGH_TOM = 50
+RIDE = 51
+
+# One row per hit of a compiled pattern
+HIT_DTYPE = np.dtype(
+    [
+        ("time", np.float64),  # Beats from the start of the pattern
+        ("duration", np.float64),
+        ("note", np.int16),
+        ("base", np.float64),  # Velocity before intensity scaling
+        ("offset", np.int32),  # Subtracted after intensity scaling
+    ]
+)
+
+
+def compile_pattern(steps, lines, beats=4):
+    """
+    Compile a step grid into an array of hits.
+
+    Args:
+        steps: Number of steps in the grid
+        lines: One (note, mask, base_velocity, offsets, duration) per drum.
+            The mask reads left to right like the grid, so with 8 steps
+            0b1000_1000 hits steps 0 and 4. The velocity of a hit is
+            int(base_velocity * intensity) - offset, with offsets repeated
+            over the hits, so (5, 15) alternates and 0 applies to all.
+        beats: Length of the grid in beats
+
+    Returns:
+        numpy.ndarray: The hits (HIT_DTYPE), in line order
+    """
+    hits = []
+    for note, mask, base, offsets, duration in lines:
+        on = [step for step in range(steps) if mask >> (steps - 1 - step) & 1]
+        for step, offset in zip(on, np.resize(offsets, len(on)).tolist()):
+            hits.append((step * beats / steps, duration, note, base, offset))
+    return np.array(hits, dtype=HIT_DTYPE)
+
+
+def render_drums(track, bars, layers, intensity=1.0, beats_per_bar=4):
+    """
+    Render drum patterns over many bars in one pass.
+
+    Args:
+        track: Track the hits are written to (always on channel 9)
+        bars: Absolute bar numbers to render
+        layers: (pattern, bar_mask, offset_beats) per layer. bar_mask selects
+            the bars a layer plays in (True for all of them) and offset_beats
+            moves the pattern inside the bar, e.g. a fill starting on beat 4.
+        intensity: Velocity scaling, a single value or one per bar
+        beats_per_bar: Length of a bar in beats
+
+    Returns:
+        numpy.ndarray: Note events (EVENT_DTYPE) ordered by bar, then layer
+    """
+    bars = np.asarray(bars)
+    intensity = np.broadcast_to(np.asarray(intensity, dtype=np.float64), bars.shape)
+
+    blocks = []
+    bar_keys = []
+    layer_keys = []
+    for layer, (pattern, mask, offset) in enumerate(layers):
+        mask = np.broadcast_to(mask, bars.shape)
+        layer_bars = bars[mask]
+
+        # (bars, hits) grid broadcast from the pattern and the bar numbers
+        block = np.zeros((len(layer_bars), len(pattern)), dtype=EVENT_DTYPE)
+        block["kind"] = NOTE
+        block["track"] = track
+        block["channel"] = DRUM_CHANNEL
+        block["time"] = (
+            layer_bars[:, None] * beats_per_bar + offset + pattern["time"][None, :]
+        )
+        block["duration"] = pattern["duration"]
+        block["data1"] = pattern["note"]
+        block["data2"] = (pattern["base"][None, :] * intensity[mask][:, None]).astype(
+            np.int32
+        ) - pattern["offset"]
+
+        blocks.append(block.ravel())
+        bar_keys.append(np.repeat(layer_bars, len(pattern)))
+        layer_keys.append(np.full(block.size, layer))
+
+    events = np.concatenate(blocks)
+    # Stable sort so every bar keeps its layers in order, like a per-bar loop
+    order = np.lexsort((np.concatenate(layer_keys), np.concatenate(bar_keys)))
+    return events[order]
+
+
+# Crash accent on the one, shared by every 4/4 kit
+DOWNBEAT_CRASH = compile_pattern(8, [(CRASH, 0b1000_0000, 100, 0, 1)])
+
+# Ole Ivars style kit (hav_full_v2 / hav_full_v3), eight steps per bar
+OLE_IVARS_BACKBEAT = compile_pattern(
+    8,
+    [
+        (KICK, 0b1000_1000, 100, (0, 5), 1),
+        (SNARE, 0b0010_0010, 95, 0, 1),  # Strong backbeat on 2 and 4
+    ],
+)
+OLE_IVARS_HIHAT = compile_pattern(8, [(HIHAT, 0b1111_1111, 75, (5, 15), 0.5)])
+OLE_IVARS_CHORUS_HIHAT = compile_pattern(8, [(HIHAT, 0b1111_1111, 75, (0, 10), 0.5)])
+OLE_IVARS_RIDE = compile_pattern(8, [(RIDE, 0b1111_1111, 75, 5, 0.5)])
+
+# Descending toms on the last beat, crash on the next downbeat. Sixteenth
+# steps over two beats, placed at beat 4 of the bar.
+OLE_IVARS_FILL = compile_pattern(
+    8,
+    [
+        (HIGH_TOM, 0b1000_0000, 90, 0, 0.25),
+        (MID_TOM, 0b0100_0000, 90, 0, 0.25),
+        (LOW_TOM, 0b0010_0000, 90, 0, 0.25),
+        (CRASH, 0b0000_1000, 100, 0, 1),
+    ],
+    beats=2,
+)
+
+# DansebandSong kit (library), a slightly softer snare and hi-hat
+DANSEBAND_BACKBEAT = compile_pattern(
+    8,
+    [
+        (KICK, 0b1000_1000, 100, (0, 5), 1),
+        (SNARE, 0b0010_0010, 90, 0, 1),
+    ],
+)
+DANSEBAND_HIHAT = compile_pattern(8, [(HIHAT, 0b1111_1111, 70, (5, 15), 0.5)])
+DANSEBAND_CHORUS_HIHAT = compile_pattern(8, [(HIHAT, 0b1111_1111, 70, (0, 10), 0.5)])
+DANSEBAND_RIDE = compile_pattern(8, [(RIDE, 0b1111_1111, 70, 5, 0.5)])
+
+# 12/8 kit (angels): four dotted-quarter beats. The hi-hats play the first
+# three sixteenths of every beat, which the twelve_eight groove turns into
+# triplet eighths.
+TWELVE_EIGHT_BACKBEAT = compile_pattern(
+    4,
+    [
+        (KICK, 0b1010, 90, (0, 5), 0.5),
+        (SNARE, 0b0101, 90, 0, 0.5),
+    ],
+)
+TWELVE_EIGHT_HIHAT = compile_pattern(16, [(HIHAT, 0b1110_1110_1110_1110, 90, 20, 0.25)])
@@ -0,0 +1,89 @@
+import numpy as np
+
+from events import CONTROLLER, NOTE
+
+# Expression controller, scaled along with the velocities
+EXPRESSION = 11
+
+# Level of every section type, relative to a verse
+SECTION_LEVELS = {
+    "intro": 1.0,
+    "verse": 1.0,
+    "chorus": 1.2,
+    "bridge": 1.1,
+    "outro": 1.0,
+}
+
+# Bars before a chorus that build up into it
+CRESCENDO_BARS = 2
+
+# Level the outro fades down to by its last beat
+FADE_TO = 0.5
+
+
+def song_envelope(sections, levels=None, beats_per_bar=4):
+    """
+    Compute the dynamics of a whole song, one level per beat.
+
+    Every section plays at its level, the bars before a chorus crescendo
+    from the level they are at into the chorus, and the outro fades from
+    its level down to FADE_TO.
+
+    Args:
+        sections: (section_type, length_in_bars) for every section in order.
+            Types are matched on their prefix, so "chorus_final" is a chorus.
+        levels: Overrides for SECTION_LEVELS
+        beats_per_bar: Length of a bar in beats
+
+    Returns:
+        numpy.ndarray: Level of every beat of the song
+    """
+    levels = {**SECTION_LEVELS, **(levels or {})}
+    kinds = [section_type.split("_")[0] for section_type, _ in sections]
+    lengths = [length * beats_per_bar for _, length in sections]
+    envelope = np.repeat([levels[kind] for kind in kinds], lengths).astype(np.float64)
+    starts = np.cumsum([0] + lengths[:-1])
+
+    for kind, start, length in zip(kinds, starts, lengths):
+        if kind == "chorus" and start:
+            ramp = min(CRESCENDO_BARS * beats_per_bar, start)
+            envelope[start - ramp : start] = np.linspace(
+                envelope[start - ramp], levels["chorus"], ramp, endpoint=False
+            )
+        elif kind == "outro":
+            envelope[start : start + length] = np.linspace(
+                levels["outro"], FADE_TO, length
+            )
+    return envelope
+
+
+def apply_dynamics(events, envelope):
+    """
+    Return a copy of the events with velocities and expression (CC11) scaled.
+
+    Args:
+        events: Event block (EVENT_DTYPE) rendered at full level
+        envelope: Level per beat from song_envelope. Events past its end
+            use the last level.
+
+    Returns:
+        numpy.ndarray: The scaled events
+    """
+    events = events.copy()
+    beat = np.clip(events["time"].astype(np.int64), 0, len(envelope) - 1)
+    level = envelope[beat]
+
+    notes = events["kind"] == NOTE
+    events["data2"][notes] = np.clip(
+        np.rint(events["data2"][notes] * level[notes]), 1, 127
+    )
+
+    # Expression curves already sit near the top of their range, so they
+    # only follow the envelope down (fades) and boosts go to velocity alone
+    expression = (events["kind"] == CONTROLLER) & (events["data1"] == EXPRESSION)
+    events["data2"][expression] = np.clip(
+        np.rint(events["data2"][expression] * np.minimum(level[expression], 1.0)),
+        0,
+        127,
+    )
+    return events
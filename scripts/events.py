@@ -0,0 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Event kinds stored in the "kind" column
+NOTE = 0
+CONTROLLER = 1
+PITCH_WHEEL = 2
+PROGRAM_CHANGE = 3
+
+DRUM_CHANNEL = 9
+
+# One row per channel event. Times and durations are in beats, like the
+# MIDIFile API the generators are written against.
+EVENT_DTYPE = np.dtype(
+    [
+        ("kind", np.uint8),
+        ("track", np.uint8),
+        ("channel", np.uint8),
+        ("time", np.float64),
+        ("duration", np.float64),
+        ("data1", np.int16),  # Pitch, controller number or program
+        ("data2", np.int32),  # Velocity, controller value or pitch wheel value
+    ]
+)
+
+
+class EventRecorder:
+    """
+    Drop-in replacement for MIDIFile that records channel events into rows.
+
+    Every generator only calls addNote, addControllerEvent, addPitchWheelEvent
+    and addProgramChange on the midi_file it is handed, so any of them can
+    render into a recorder and the result can be cached, moved and replayed.
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def addNote(self, track, channel, pitch, time, duration, volume, annotation=None):
+        self.rows.append((NOTE, track, channel, time, duration, pitch, volume))
+
+    def addControllerEvent(self, track, channel, time, controller_number, parameter):
+        self.rows.append(
+            (CONTROLLER, track, channel, time, 0, controller_number, parameter)
+        )
+
+    def addPitchWheelEvent(self, track, channel, time, pitchWheelValue):
+        self.rows.append((PITCH_WHEEL, track, channel, time, 0, 0, pitchWheelValue))
+
+    def addProgramChange(self, tracknum, channel, time, program):
+        self.rows.append((PROGRAM_CHANGE, tracknum, channel, time, 0, program, 0))
+
+    def add_events(self, events):
+        """Append an already rendered event block"""
+        self.rows.extend(events.tolist())
+
+    def events(self):
+        """Return everything recorded so far as an event array"""
+        return np.array(self.rows, dtype=EVENT_DTYPE)
+
+
+def render_block(generator, *args, **kwargs):
+    """
+    Run a generator against a recorder and return the events it produced.
+
+    Args:
+        generator: Any function taking a midi_file as its first argument
+        *args, **kwargs: Passed on to the generator after the recorder
+
+    Returns:
+        numpy.ndarray: The recorded events (EVENT_DTYPE)
+    """
+    recorder = EventRecorder()
+    generator(recorder, *args, **kwargs)
+    return recorder.events()
+
+
+def shift_events(events, beats):
+    """Return a copy of the events moved by a number of beats"""
+    shifted = events.copy()
+    shifted["time"] += beats
+    return shifted
+
+
+def transpose_events(events, semitones, low=0, high=127):
+    """
+    Return a copy of the events with every pitched note moved by semitones.
+
+    Drums on channel 9 are left alone since their note numbers select the
+    instrument, and transposed notes are clamped to the low/high range.
+    """
+    transposed = events.copy()
+    pitched = (transposed["kind"] == NOTE) & (transposed["channel"] != DRUM_CHANNEL)
+    transposed["data1"][pitched] = np.clip(
+        transposed["data1"][pitched] + semitones, low, high
+    )
+    return transposed
+
+
+def write_events(midi_file, events):
+    """Replay an event block into a MIDIFile (or another recorder)"""
+    if isinstance(midi_file, EventRecorder):
+        midi_file.add_events(events)
+        return
+
+    for kind, track, channel, time, duration, data1, data2 in events.tolist():
+        if kind == NOTE:
+            midi_file.addNote(track, channel, data1, time, duration, data2)
+        elif kind == CONTROLLER:
+            midi_file.addControllerEvent(track, channel, time, data1, data2)
+        elif kind == PITCH_WHEEL:
+            midi_file.addPitchWheelEvent(track, channel, time, data2)
+        elif kind == PROGRAM_CHANGE:
+            midi_file.addProgramChange(track, channel, time, data1)
+
+
+def render_blocks_parallel(render_track, names, workers=None):
+    """
+    Render independent tracks in worker processes.
+
+    Args:
+        render_track: Picklable function taking a name and returning an event block
+        names: The names to render, one worker task each
+        workers: Maximum number of worker processes (None uses every core)
+
+    Returns:
+        list: The event blocks in the same order as names
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(render_track, names))
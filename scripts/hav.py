@@ -5,7 +5,7 @@ from midiutil.MidiFile import MIDIFile
 from utils import save_midi_file
 
 
-def create_danseband_template():
+def create_danseband_template(target=None):
     midi_file = MIDIFile(6, adjust_origin=False, deinterleave=False)
 
     # Global settings
@@ -35,7 +35,7 @@ def create_danseband_template():
     create_rhythm_guitar(midi_file, 3, chords)
     create_drum_pattern(midi_file, 4)
 
-    save_midi_file(midi_file, "danseband_db_major.mid")
+    return save_midi_file(midi_file, "danseband_db_major.mid", target=target)
 
 
 def get_instrument(track):
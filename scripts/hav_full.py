@@ -21,7 +21,7 @@ def setup_track_names(midi_file):
         midi_file.addTrackName(track, 0, name)
 
 
-def create_danseband_template():
+def create_danseband_template(target=None):
     # Create MIDI object with 6 tracks
     midi_file = MIDIFile(6, adjust_origin=False, deinterleave=False)
 
@@ -120,7 +120,7 @@ def create_danseband_template():
     # Outro
     create_outro_section(midi_file, current_bar, base_chords, OUTRO_LENGTH)
 
-    save_midi_file(midi_file, "danseband_full_arrangement.mid")
+    return save_midi_file(midi_file, "danseband_full_arrangement.mid", target=target)
 
 
 def get_initial_volume(track):
@@ -1,7 +1,10 @@
 import math
 
+import numpy as np
 from midiutil.MidiFile import MIDIFile
 
+from drums import OLE_IVARS_BACKBEAT, OLE_IVARS_FILL, OLE_IVARS_HIHAT, render_drums
+from events import write_events
 from utils import save_midi_file
 
 
@@ -21,7 +24,7 @@ def setup_track_names(midi_file):
         midi_file.addTrackName(track, 0, name)
 
 
-def create_danseband_template():
+def create_danseband_template(target=None):
     # Create MIDI object with 7 tracks (added Alto Sax)
     midi_file = MIDIFile(7, adjust_origin=False, deinterleave=False)
 
@@ -119,7 +122,7 @@ def create_danseband_template():
     # Outro
     create_outro_section(midi_file, current_bar, base_chords, OUTRO_LENGTH)
 
-    save_midi_file(midi_file, "danseband_full_arrangement_v2.mid")
+    return save_midi_file(midi_file, "danseband_full_arrangement_v2.mid", target=target)
 
 
 def get_initial_volume(track):
@@ -197,12 +200,20 @@ def create_intro_section(midi_file, start_bar, chords, length):
                 midi_file, [chords[chord_idx]], bar + start_bar, "intro"
             )
 
+    # Drums join with the full arrangement
+    create_drum_section(
+        midi_file, 4, np.arange(start_bar + 2, start_bar + length), "intro"
+    )
+
 
 def create_verse_section(midi_file, start_bar, chords, verse_type):
     for bar in range(len(chords)):
         create_full_bar_arrangement(
             midi_file, [chords[bar]], bar + start_bar, f"verse_{verse_type}"
         )
+    create_drum_section(
+        midi_file, 4, start_bar + np.arange(len(chords)), f"verse_{verse_type}"
+    )
 
 
 def create_chorus_section(midi_file, start_bar, chords, chorus_type):
@@ -215,6 +226,13 @@ def create_chorus_section(midi_file, start_bar, chords, chorus_type):
             f"chorus_{chorus_type}",
             intensity=1.2,  # Increase velocity for chorus
         )
+    create_drum_section(
+        midi_file,
+        4,
+        start_bar + np.arange(len(chords)),
+        f"chorus_{chorus_type}",
+        intensity=1.2,
+    )
 
 
 def create_bridge_section(midi_file, start_bar, chords):
@@ -222,6 +240,9 @@ def create_bridge_section(midi_file, start_bar, chords):
         create_full_bar_arrangement(
             midi_file, [chords[bar]], bar + start_bar, "bridge", intensity=1.1
         )
+    create_drum_section(
+        midi_file, 4, start_bar + np.arange(len(chords)), "bridge", intensity=1.1
+    )
 
 
 def create_outro_section(midi_file, start_bar, chords, length):
@@ -234,22 +255,21 @@ def create_outro_section(midi_file, start_bar, chords, length):
             "outro",
             intensity=0.9,  # Slightly softer for outro
         )
+    create_drum_section(
+        midi_file, 4, start_bar + np.arange(length), "outro", intensity=0.9
+    )
 
 
 def create_full_bar_arrangement(midi_file, chords, bar, section_type, intensity=1.0):
-    """Creates a full bar arrangement with all instruments"""
-    velocity_mult = intensity
-    if section_type.startswith("chorus"):
-        velocity_mult *= 1.1
-    elif section_type == "bridge":
-        velocity_mult *= 1.05
-    elif section_type == "outro":
-        velocity_mult *= max(0.9, 1.0 - (bar * 0.05))  # Gradual fadeout
+    """
+    Creates a full bar arrangement with all instruments but the drums, which
+    are rendered per section (see create_drum_section)
+    """
+    velocity_mult = section_velocity(section_type, bar, intensity)
 
     # Create patterns for each instrument
     create_bass_pattern(midi_file, 2, chords, bar, velocity_mult)
     create_rhythm_guitar(midi_file, 3, chords, bar, velocity_mult)
-    create_drum_pattern(midi_file, 4, bar, section_type, velocity_mult)
     create_accordion_part(midi_file, 1, chords, bar, section_type)
 
     if section_type != "intro":
@@ -260,6 +280,18 @@ def create_full_bar_arrangement(midi_file, chords, bar, section_type, intensity=
         )  # Alto sax
 
 
+def section_velocity(section_type, bar, intensity=1.0):
+    """Velocity scaling of a bar (or an array of bars) in a section"""
+    velocity_mult = intensity
+    if section_type.startswith("chorus"):
+        velocity_mult *= 1.1
+    elif section_type == "bridge":
+        velocity_mult *= 1.05
+    elif section_type == "outro":
+        velocity_mult *= np.maximum(0.9, 1.0 - (bar * 0.05))  # Gradual fadeout
+    return velocity_mult
+
+
 def create_bass_pattern(midi_file, track, chords, bar, intensity=1.0):
     """Enhanced bass pattern with intensity control"""
     root = chords[0][0] - 24
@@ -490,51 +522,25 @@ def add_vocal_note_with_fall(midi_file, track, start_time, note, duration):
         midi_file.addPitchWheelEvent(track, 0, time, value)
 
 
-def create_drum_pattern(midi_file, track, bar, section_type, intensity=1.0):
-    """Enhanced drum pattern with more characteristic dansband feels"""
-    kick = 36
-    snare = 38
-    hihat = 42
-    crash = 49
-    ride = 51
-
-    # Typical dansband drum pattern with stronger backbeat
-    kick_vel = int(100 * intensity)
-    snare_vel = int(95 * intensity)  # Stronger backbeat
-    hihat_vel = int(75 * intensity)
-
-    # Basic pattern
-    midi_file.addNote(track, 9, kick, bar * 4, 1, kick_vel)
-    midi_file.addNote(track, 9, kick, bar * 4 + 2, 1, kick_vel - 5)
-
-    # Strong backbeat on 2 and 4
-    midi_file.addNote(track, 9, snare, bar * 4 + 1, 1, snare_vel)
-    midi_file.addNote(track, 9, snare, bar * 4 + 3, 1, snare_vel)
-
-    # Add fills at phrase endings
-    if (bar + 1) % 4 == 0:  # End of 4-bar phrase
-        create_dansband_drum_fill(midi_file, track, bar * 4 + 3, intensity)
-    else:
-        # Regular hi-hat pattern
-        for eighth in range(8):
-            vel = hihat_vel - (5 if eighth % 2 == 0 else 15)
-            midi_file.addNote(track, 9, hihat, bar * 4 + eighth * 0.5, 0.5, vel)
-
-
-def create_dansband_drum_fill(midi_file, track, start_time, intensity):
-    """Creates characteristic dansband drum fills"""
-    toms = [45, 47, 50]  # Low, mid, high toms
-    snare = 38
-    crash = 49
-
-    # Simple descending tom fill
-    for i, tom in enumerate(reversed(toms)):
-        midi_file.addNote(
-            track, 9, tom, start_time + i * 0.25, 0.25, int(90 * intensity)
-        )
-
-    # End with crash on the 1
-    midi_file.addNote(track, 9, crash, start_time + 1, 1, int(100 * intensity))
+def create_drum_section(midi_file, track, bars, section_type, intensity=1.0):
+    """
+    Enhanced drum pattern with more characteristic dansband feels, for a
+    run of bars rendered in one pass
+    """
+    # Fills at phrase endings take over from the hi-hat
+    fill = (bars + 1) % 4 == 0  # End of 4-bar phrase
+
+    events = render_drums(
+        track,
+        bars,
+        [
+            (OLE_IVARS_BACKBEAT, True, 0),  # Strong backbeat on 2 and 4
+            (OLE_IVARS_HIHAT, ~fill, 0),  # Regular hi-hat pattern
+            (OLE_IVARS_FILL, fill, 3),  # Descending toms into a crash
+        ],
+        section_velocity(section_type, bars, intensity),
+    )
+    write_events(midi_file, events)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,100 @@
 import math
+import sys
+from time import perf_counter
 
+import numpy as np
 from midiutil.MidiFile import MIDIFile
 
-from utils import save_midi_file
+from bass import compile_style, render_bass
+from comping import render_comping
+from drums import (
+    OLE_IVARS_BACKBEAT,
+    OLE_IVARS_CHORUS_HIHAT,
+    DOWNBEAT_CRASH,
+    OLE_IVARS_FILL,
+    OLE_IVARS_HIHAT,
+    OLE_IVARS_RIDE,
+    render_drums,
+)
+from dynamics import apply_dynamics, song_envelope
+from events import (
+    EventRecorder,
+    render_block,
+    render_blocks_parallel,
+    shift_events,
+    transpose_events,
+    write_events,
+)
+from humanize import humanize
+from memprofile import AllocationProfile, profiled
+from metrics import RenderMetrics, curve_seconds, curve_timer, timed
+from phrases import compiled_phrase, place_phrase
+from synth import render_mixdown
+from utils import get_generated_path, get_unique_timestamp, save_midi_file
+
+TEMPO = 126  # Typical Ole Ivars tempo
+
+TRACK_NAMES = {
+    0: "Tenor Sax",
+    1: "Accordion",
+    2: "Bass",
+    3: "Rhythm Guitar",
+    4: "Drums",
+    5: "Lead Vocal",
+    6: "Alto Sax",
+}
+
+# The final chorus is the regular chorus moved up a whole step
+KEY_CHANGE = 2
+
+# Instruments that can be rendered on their own (each owns one track)
+INSTRUMENTS = (
+    "rhythm_guitar",
+    "bass",
+    "drums",
+    "accordion",
+    "vocal",
+    "tenor_sax",
+    "alto_sax",
+)
+
+# Song structure (in bars)
+INTRO_LENGTH = 8
+VERSE_LENGTH = 14  # 7 progression pairs
+CHORUS_LENGTH = 14
+BRIDGE_LENGTH = 8
+OUTRO_LENGTH = 8
+
+# Intro bars played by the rhythm section alone
+INTRO_RHYTHM_BARS = 4
+
+# Section order, for the song's dynamics envelope
+SONG_SECTIONS = (
+    ("intro", INTRO_LENGTH),
+    ("verse", VERSE_LENGTH),
+    ("chorus", CHORUS_LENGTH),
+    ("verse", VERSE_LENGTH),
+    ("chorus", CHORUS_LENGTH),
+    ("bridge", BRIDGE_LENGTH),
+    ("chorus", CHORUS_LENGTH),
+    ("outro", OUTRO_LENGTH),
+)
+
+# Humanization feel of every track (keys of humanize.FEELS)
+TRACK_FEELS = {
+    0: "sax",
+    1: "accordion",
+    2: "bass",
+    3: "rhythm_guitar",
+    4: "drums",
+    5: "vocal",
+    6: "sax",
+}
 
 
 def setup_track_names(midi_file):
     """Setup proper track names for better MIDI organization"""
-    track_names = {
-        0: "Tenor Sax",
-        1: "Accordion",
-        2: "Bass",
-        3: "Rhythm Guitar",
-        4: "Drums",
-        5: "Lead Vocal",
-        6: "Alto Sax",
-    }
-
-    for track, name in track_names.items():
+    for track, name in TRACK_NAMES.items():
         midi_file.addTrackName(track, 0, name)
 
 
@@ -109,43 +186,228 @@ def create_classic_dansband_progression():
     ]
 
     # They often modulate up a step for the final chorus
-    final_chorus_progression = [
-        [(69, 73, 76), (74, 78, 81)],  # A   D
-        [(76, 80, 83), (76, 80, 83)],  # E   E
-        [(74, 78, 81), (72, 75, 79)],  # D   Dm
-        [(76, 80, 83), (76, 80, 83)],  # E   E
-        [(69, 73, 76), (66, 69, 73)],  # A   F#m
-        [(74, 78, 81), (76, 80, 83)],  # D   E
-        [(69, 73, 76), (69, 73, 76)],  # A   A
-    ]
+    final_chorus_progression = transpose_progression(chorus_progression, KEY_CHANGE)
 
     return verse_progression, chorus_progression, final_chorus_progression
 
 
-def create_danseband_template():
-    # Create MIDI object with 7 tracks
-    midi_file = MIDIFile(7, adjust_origin=False, deinterleave=False)
+def transpose_progression(progression, semitones):
+    """Move every chord of a pair progression by a number of semitones"""
+    return [
+        [tuple(note + semitones for note in chord) for chord in chord_pair]
+        for chord_pair in progression
+    ]
+
+
+def create_danseband_template(
+    workers=None,
+    humanize_seed=0,
+    compact=False,
+    single_track=False,
+    metrics_path=None,
+    memory_profile_path=None,
+    target=None,
+):
+    """
+    Render the full arrangement and save it.
+
+    Args:
+        workers: Render each instrument's track in its own worker process
+            (None renders everything serially in this process)
+        humanize_seed: Seed of the humanized timing and velocities (None
+            keeps every note on the grid)
+        compact: Write the file with running status (see save_midi_file)
+        single_track: Write a format-0 file with every track merged
+        metrics_path: Write render metrics here, in the Prometheus text
+            format for a .prom file or as a JSON line otherwise
+        memory_profile_path: Trace allocations per section and instrument,
+            logging them here as JSON lines and printing a report (the
+            instruments then render serially)
+        target: bytes, "-" or a file object to send the file to instead of
+            saving it (see save_midi_file)
+
+    Returns:
+        The saved file's path, or what save_midi_file returns for target
+    """
+    metrics = None
+    if metrics_path:
+        metrics = RenderMetrics(
+            "danseband_full_arrangement_v3",
+            sum(length for _, length in SONG_SECTIONS),
+        )
+    profile = None
+    if memory_profile_path:
+        profile = AllocationProfile(memory_profile_path)
+        profile.start()
 
-    # Add track names first
-    setup_track_names(midi_file)
+    try:
+        # Create MIDI object with 7 tracks
+        midi_file = MIDIFile(7, adjust_origin=False, deinterleave=False)
 
-    # Global settings
-    tempo = 126  # Typical Ole Ivars tempo
-    time = 0
+        # Add track names first
+        setup_track_names(midi_file)
 
-    # Song structure (in bars)
-    INTRO_LENGTH = 8
-    VERSE_LENGTH = 14  # 7 progression pairs
-    CHORUS_LENGTH = 14
-    BRIDGE_LENGTH = 8
-    OUTRO_LENGTH = 8
+        # Global settings
+        time = 0
 
-    # Initialize all tracks
-    for track in range(7):
-        midi_file.addTempo(track, time, tempo)
-        midi_file.addControllerEvent(track, 0, 0, 7, get_initial_volume(track))
-        midi_file.addControllerEvent(track, 0, 0, 10, get_pan_position(track))
-        midi_file.addProgramChange(track, 0, time, get_instrument(track))
+        # Initialize all tracks
+        for track in range(7):
+            midi_file.addTempo(track, time, TEMPO)
+            midi_file.addControllerEvent(track, 0, 0, 7, get_initial_volume(track))
+            midi_file.addControllerEvent(track, 0, 0, 10, get_pan_position(track))
+            midi_file.addProgramChange(track, 0, time, get_instrument(track))
+
+        for block in render_arrangement(workers, humanize_seed, metrics, profile):
+            write_events(midi_file, block)
+
+        with profiled(profile, "save"):
+            saved = save_midi_file(
+                midi_file,
+                "danseband_full_arrangement_v3.mid",
+                compact,
+                single_track,
+                metrics,
+                target=target,
+            )
+        if metrics:
+            metrics.write(metrics_path)
+    finally:
+        if profile:
+            profile.stop()
+    if profile:
+        print(profile.report(), file=sys.stderr if target == "-" else sys.stdout)
+    return saved
+
+
+def create_danseband_audio(workers=None, humanize_seed=0, stems=False):
+    """
+    Render the full arrangement to audio with the built-in synth.
+
+    Every track renders in its own worker process and the tracks are mixed
+    with the get_initial_volume and get_pan_position tables.
+
+    Args:
+        workers: Worker processes for the arrangement and the audio (None
+            renders the arrangement serially and the audio on every core)
+        humanize_seed: Seed of the humanized timing and velocities (None
+            keeps every note on the grid)
+        stems: Also write every track on its own, placed like in the mix
+
+    Returns:
+        str: Path of the mix
+    """
+    song = EventRecorder()
+    for track in TRACK_NAMES:
+        song.addProgramChange(track, 0, 0, get_instrument(track))
+    for block in render_arrangement(workers, humanize_seed):
+        song.add_events(block)
+
+    base = f"{get_unique_timestamp()}_danseband_full_arrangement_v3"
+    stem_paths = None
+    if stems:
+        stem_paths = {
+            track: get_generated_path(f"{base}_{name.lower().replace(' ', '_')}.wav")
+            for track, name in TRACK_NAMES.items()
+        }
+
+    wav_path = get_generated_path(f"{base}.wav")
+    render_mixdown(
+        song.events(),
+        TEMPO,
+        {track: get_initial_volume(track) for track in TRACK_NAMES},
+        {track: get_pan_position(track) for track in TRACK_NAMES},
+        wav_path,
+        stem_paths,
+        workers,
+    )
+    return wav_path
+
+
+def render_arrangement(workers=None, humanize_seed=0, metrics=None, profile=None):
+    """
+    Render every track of the song with its dynamics and humanization.
+
+    Args:
+        workers: Render each instrument's track in its own worker process
+        humanize_seed: Seed of the humanized timing and velocities
+        metrics: RenderMetrics that get the stage timings, the event counts
+            and the use of the bass style and phrase caches (caches of
+            worker processes are not seen)
+        profile: AllocationProfile traced per section and instrument, the
+            instruments then render serially whatever the workers
+
+    Returns:
+        list: Event blocks ready to be written or played
+    """
+    if metrics:
+        metrics.watch_cache("bass_styles", compile_style)
+        metrics.watch_cache("phrases", compiled_phrase)
+
+    with timed(metrics, "plan"):
+        envelope = song_envelope(SONG_SECTIONS)
+
+    if workers or metrics or profile:
+        # Every instrument plays the whole song on its own track, so the
+        # blocks can be rendered (and measured) independently and merged
+        # track by track
+        if workers and not profile:
+            rendered = render_blocks_parallel(
+                render_timed_instrument_track, INSTRUMENTS, workers
+            )
+        else:
+            rendered = [
+                render_timed_instrument_track(instrument, profile)
+                for instrument in INSTRUMENTS
+            ]
+        blocks = []
+        for instrument, (block, seconds, curves) in zip(INSTRUMENTS, rendered):
+            if metrics:
+                metrics.add_stage("render", seconds, instrument)
+                metrics.add_stage("curves", curves, instrument)
+                metrics.count_events(block, instrument)
+            blocks.append(block)
+    else:
+        blocks = [render_block(create_song)]
+
+    # Crescendos into the choruses and the outro fade, over every track
+    with profiled(profile, "dynamics"):
+        for index, block in enumerate(blocks):
+            with timed(metrics, "dynamics"):
+                block = apply_dynamics(block, envelope)
+            if humanize_seed is not None:
+                with timed(metrics, "humanize"):
+                    block = humanize(block, TEMPO, TRACK_FEELS, humanize_seed)
+            blocks[index] = block
+    return blocks
+
+
+def render_instrument_track(instrument, profile=None):
+    """Render the whole song for a single instrument into an event block"""
+    return render_block(create_song, instruments=(instrument,), profile=profile)
+
+
+def render_timed_instrument_track(instrument, profile=None):
+    """
+    Render a single instrument's track, also returning the seconds it took
+    apart from its curves, and the seconds its curves took
+    """
+    started = perf_counter()
+    curves = curve_seconds()
+    block = render_instrument_track(instrument, profile)
+    curves = curve_seconds() - curves
+    return block, perf_counter() - started - curves, curves
+
+
+def create_song(midi_file, instruments=None, profile=None):
+    """
+    Create the full song structure.
+
+    Args:
+        midi_file: MIDIFile (or EventRecorder) to render into
+        instruments: Names from INSTRUMENTS to render (None renders all)
+        profile: AllocationProfile that traces every section
+    """
+    tracks = ",".join(instruments) if instruments else "all"
 
     # Get chord progressions
     verse_prog, chorus_prog, final_chorus_prog = create_classic_dansband_progression()
@@ -154,37 +416,117 @@ def create_danseband_template():
     current_bar = 0
 
     # Intro
-    create_intro_section(midi_file, current_bar, verse_prog[:4], INTRO_LENGTH)
+    with profiled(profile, "intro", tracks):
+        create_intro_section(
+            midi_file, current_bar, verse_prog[:4], INTRO_LENGTH, instruments
+        )
     current_bar += INTRO_LENGTH
 
     # First Verse
-    create_verse_section(midi_file, current_bar, verse_prog, "first")
+    with profiled(profile, "verse_first", tracks):
+        create_verse_section(midi_file, current_bar, verse_prog, "first", instruments)
     current_bar += VERSE_LENGTH
 
-    # First Chorus
-    create_chorus_section(midi_file, current_bar, chorus_prog, "first")
+    # First Chorus (rendered once, the later choruses reuse its events)
+    chorus_start = current_bar
+    with profiled(profile, "chorus_first", tracks):
+        chorus_block = render_block(
+            create_chorus_section, current_bar, chorus_prog, "first", instruments
+        )
+        write_events(midi_file, chorus_block)
     current_bar += CHORUS_LENGTH
 
     # Second Verse
-    create_verse_section(midi_file, current_bar, verse_prog, "second")
+    with profiled(profile, "verse_second", tracks):
+        create_verse_section(midi_file, current_bar, verse_prog, "second", instruments)
     current_bar += VERSE_LENGTH
 
     # Second Chorus
-    create_chorus_section(midi_file, current_bar, chorus_prog, "second")
+    with profiled(profile, "chorus_second", tracks):
+        write_events(
+            midi_file, shift_events(chorus_block, (current_bar - chorus_start) * 4)
+        )
     current_bar += CHORUS_LENGTH
 
     # Bridge (using first half of verse progression)
-    create_bridge_section(midi_file, current_bar, verse_prog[:4])
+    with profiled(profile, "bridge", tracks):
+        create_bridge_section(midi_file, current_bar, verse_prog[:4], instruments)
     current_bar += BRIDGE_LENGTH
 
-    # Final Chorus (modulated)
-    create_chorus_section(midi_file, current_bar, final_chorus_prog, "final")
+    # Final Chorus (first chorus moved up by the key change)
+    with profiled(profile, "chorus_final", tracks):
+        final_chorus_block = transpose_events(
+            shift_events(chorus_block, (current_bar - chorus_start) * 4), KEY_CHANGE
+        )
+        write_events(midi_file, final_chorus_block)
     current_bar += CHORUS_LENGTH
 
     # Outro (using last part of final chorus progression)
-    create_outro_section(midi_file, current_bar, final_chorus_prog[-4:], OUTRO_LENGTH)
+    with profiled(profile, "outro", tracks):
+        create_outro_section(
+            midi_file, current_bar, final_chorus_prog[-4:], instruments
+        )
+
+
+def plays(instruments, name):
+    """Check whether an instrument is part of the render (None means all)"""
+    return instruments is None or name in instruments
+
+
+def without(instruments, *names):
+    """The instrument selection with some instruments taken out"""
+    return tuple(i for i in (instruments or INSTRUMENTS) if i not in names)
+
+
+def create_section_rhythm(
+    midi_file,
+    bars,
+    chords,
+    next_chords,
+    section_type,
+    instruments=None,
+    accordion_from=0,
+):
+    """
+    Render a section's drums, bass, rhythm guitar and accordion, each in one pass.
+
+    Args:
+        bars: Absolute bar numbers of the section
+        chords, next_chords: Current and next chord of every bar
+        section_type: Section name passed on to the drums
+        instruments: Names from INSTRUMENTS to render (None renders all)
+        accordion_from: Bars into the section the accordion comes in
+
+    Returns:
+        tuple: The instruments left to render bar by bar
+    """
+    if plays(instruments, "drums"):
+        create_drum_section_ole_ivars(midi_file, 4, bars, section_type)
+    if plays(instruments, "bass"):
+        create_bass_section_ole_ivars(midi_file, 2, bars, chords, next_chords)
+    if plays(instruments, "rhythm_guitar"):
+        create_rhythm_guitar_section_ole_ivars(midi_file, 3, bars, chords)
+    if plays(instruments, "accordion"):
+        create_accordion_section_ole_ivars(
+            midi_file, 1, bars[accordion_from:], chords[accordion_from:]
+        )
+    return without(instruments, "drums", "bass", "rhythm_guitar", "accordion")
 
-    save_midi_file(midi_file, "danseband_full_arrangement_v3.mid")
+
+def section_bars(start_bar, progression):
+    """Absolute bar numbers of a section built from chord pairs"""
+    return np.arange(start_bar, start_bar + len(progression) * 2)
+
+
+def section_chords(progression, length=None):
+    """Current and next chord of every bar of a section built from chord pairs"""
+    chords = []
+    next_chords = []
+    for bar in range(length or len(progression) * 2):
+        chord_pair = progression[bar // 2 % len(progression)]
+        chords.append(chord_pair[bar % 2])
+        next_chords.append(chord_pair[1 - bar % 2])
+    return chords, next_chords
 
 
 def get_initial_volume(track):
@@ -229,31 +571,46 @@ def get_instrument(track):
     return instruments.get(track, 0)
 
 
-def create_intro_section(midi_file, start_bar, chords, length):
+def create_intro_section(midi_file, start_bar, chords, length, instruments=None):
     """Create intro section with gradual instrument entry"""
-    for bar in range(length):
+    bars = np.arange(start_bar, start_bar + length)
+    instruments = create_section_rhythm(
+        midi_file,
+        bars,
+        *section_chords(chords, length),
+        "intro",
+        instruments,
+        accordion_from=INTRO_RHYTHM_BARS,
+    )
+
+    # Just the rhythm section at first, the full arrangement for the rest
+    for bar in range(INTRO_RHYTHM_BARS, length):
         chord_pair = chords[bar // 2 % len(chords)]
         current_chord = chord_pair[bar % 2]
         next_chord = chord_pair[1] if bar % 2 == 0 else chord_pair[0]
 
-        # Start with just rhythm section
-        if bar < 4:
-            create_rhythm_guitar_ole_ivars(midi_file, 3, current_chord, bar + start_bar)
-            create_walking_bass_ole_ivars(
-                midi_file, 2, current_chord, next_chord, bar + start_bar
-            )
-            create_drums_ole_ivars(
-                midi_file, 4, bar + start_bar, "intro"
-            )  # Added "intro" as section_type
-        else:
-            # Add full arrangement for latter half
-            create_full_bar_arrangement(
-                midi_file, current_chord, next_chord, bar + start_bar, "intro"
-            )
+        create_full_bar_arrangement(
+            midi_file,
+            current_chord,
+            next_chord,
+            bar + start_bar,
+            "intro",
+            instruments=instruments,
+        )
 
 
-def create_verse_section(midi_file, start_bar, progression, verse_type):
+def create_verse_section(
+    midi_file, start_bar, progression, verse_type, instruments=None
+):
     """Create verse section with Ole Ivars style arrangement"""
+    instruments = create_section_rhythm(
+        midi_file,
+        section_bars(start_bar, progression),
+        *section_chords(progression),
+        f"verse_{verse_type}",
+        instruments,
+    )
+
     for bar_pair in range(len(progression)):
         chord_pair = progression[bar_pair]
         for i in range(2):  # Each pair has 2 bars
@@ -262,12 +619,27 @@ def create_verse_section(midi_file, start_bar, progression, verse_type):
             next_chord = chord_pair[1] if i == 0 else chord_pair[0]
 
             create_full_bar_arrangement(
-                midi_file, current_chord, next_chord, current_bar, f"verse_{verse_type}"
+                midi_file,
+                current_chord,
+                next_chord,
+                current_bar,
+                f"verse_{verse_type}",
+                instruments=instruments,
             )
 
 
-def create_chorus_section(midi_file, start_bar, progression, chorus_type):
-    """Create chorus section with increased intensity"""
+def create_chorus_section(
+    midi_file, start_bar, progression, chorus_type, instruments=None
+):
+    """Create chorus section (louder through the song's dynamics)"""
+    instruments = create_section_rhythm(
+        midi_file,
+        section_bars(start_bar, progression),
+        *section_chords(progression),
+        f"chorus_{chorus_type}",
+        instruments,
+    )
+
     for bar_pair in range(len(progression)):
         chord_pair = progression[bar_pair]
         for i in range(2):
@@ -281,12 +653,20 @@ def create_chorus_section(midi_file, start_bar, progression, chorus_type):
                 next_chord,
                 current_bar,
                 f"chorus_{chorus_type}",
-                intensity=1.2,
+                instruments=instruments,
             )
 
 
-def create_bridge_section(midi_file, start_bar, progression):
+def create_bridge_section(midi_file, start_bar, progression, instruments=None):
     """Create bridge section"""
+    instruments = create_section_rhythm(
+        midi_file,
+        section_bars(start_bar, progression),
+        *section_chords(progression),
+        "bridge",
+        instruments,
+    )
+
     for bar_pair in range(len(progression)):
         chord_pair = progression[bar_pair]
         for i in range(2):
@@ -300,12 +680,17 @@ def create_bridge_section(midi_file, start_bar, progression):
                 next_chord,
                 current_bar,
                 "bridge",
-                intensity=1.1,
+                instruments=instruments,
             )
 
 
-def create_outro_section(midi_file, start_bar, progression, length):
-    """Create outro section with gradual fade"""
+def create_outro_section(midi_file, start_bar, progression, instruments=None):
+    """Create outro section (faded out by the song's dynamics)"""
+    bars = section_bars(start_bar, progression)
+    instruments = create_section_rhythm(
+        midi_file, bars, *section_chords(progression), "outro", instruments
+    )
+
     for bar_pair in range(len(progression)):
         chord_pair = progression[bar_pair]
         for i in range(2):
@@ -313,251 +698,129 @@ def create_outro_section(midi_file, start_bar, progression, length):
             current_chord = chord_pair[i]
             next_chord = chord_pair[1] if i == 0 else chord_pair[0]
 
-            fade_intensity = max(0.5, 1.0 - (bar_pair * 2 + i) / length)
             create_full_bar_arrangement(
                 midi_file,
                 current_chord,
                 next_chord,
                 current_bar,
                 "outro",
-                intensity=fade_intensity,
+                instruments=instruments,
             )
 
 
 def create_full_bar_arrangement(
-    midi_file, current_chord, next_chord, bar, section_type, intensity=1.0
+    midi_file,
+    current_chord,
+    next_chord,
+    bar,
+    section_type,
+    instruments=None,
 ):
-    """Creates a full bar arrangement with all instruments"""
+    """Creates a full bar arrangement with all (or the selected) instruments"""
     # Rhythm section
-    create_rhythm_guitar_ole_ivars(midi_file, 3, current_chord, bar, intensity)
-    create_walking_bass_ole_ivars(midi_file, 2, current_chord, next_chord, bar)
-    create_drums_ole_ivars(midi_file, 4, bar, section_type, intensity)
+    if plays(instruments, "rhythm_guitar"):
+        create_rhythm_guitar_ole_ivars(midi_file, 3, current_chord, bar)
+    if plays(instruments, "bass"):
+        create_walking_bass_ole_ivars(midi_file, 2, current_chord, next_chord, bar)
+    if plays(instruments, "drums"):
+        create_drums_ole_ivars(midi_file, 4, bar, section_type)
 
     # Accordion
-    create_accordion_ole_ivars(midi_file, 1, current_chord, bar, section_type)
+    if plays(instruments, "accordion"):
+        create_accordion_ole_ivars(midi_file, 1, current_chord, bar, section_type)
 
     if section_type != "intro":
         # Melody instruments
-        create_vocal_melody_ole_ivars(midi_file, 5, current_chord, bar, section_type)
-        create_saxophone_arrangement(
-            midi_file, 0, current_chord, bar, section_type
-        )  # Tenor
-        create_saxophone_arrangement(
-            midi_file, 6, current_chord, bar, section_type, is_alto=True
-        )  # Alto
+        if plays(instruments, "vocal"):
+            create_vocal_melody_ole_ivars(
+                midi_file, 5, current_chord, bar, section_type
+            )
+        if plays(instruments, "tenor_sax"):
+            create_saxophone_arrangement(midi_file, 0, current_chord, bar, section_type)
+        if plays(instruments, "alto_sax"):
+            create_saxophone_arrangement(
+                midi_file, 6, current_chord, bar, section_type, is_alto=True
+            )
 
 
-def create_rhythm_guitar_ole_ivars(midi_file, track, chord, bar, intensity=1.0):
+def create_rhythm_guitar_ole_ivars(midi_file, track, chord, bar):
     """Classic Ole Ivars rhythm guitar pattern"""
-    base_velocity = int(75 * intensity)
-    accent_velocity = int(95 * intensity)
-
-    # Characteristic boom-chick pattern
-    for beat in range(4):
-        time = bar * 4 + beat
-
-        # Strong bass note on 1 and 3
-        if beat in [0, 2]:
-            midi_file.addNote(track, 0, chord[0] - 12, time, 0.45, accent_velocity)
+    create_rhythm_guitar_section_ole_ivars(midi_file, track, [bar], [chord])
 
-            # Add muted stroke right after
-            for note in chord:
-                midi_file.addNote(track, 0, note, time + 0.45, 0.05, base_velocity - 20)
 
-        # Upstroke on 2 and 4 with characteristic muting
-        if beat in [1, 3]:
-            for note in chord:
-                midi_file.addNote(track, 0, note, time, 0.4, accent_velocity)
-                midi_file.addNote(track, 0, note, time + 0.4, 0.1, base_velocity - 15)
+def create_rhythm_guitar_section_ole_ivars(midi_file, track, bars, chords):
+    """Classic Ole Ivars boom-chick guitar for a run of bars, rendered in one pass"""
+    write_events(midi_file, render_comping(track, bars, chords, "ole_ivars_guitar"))
 
 
 def create_accordion_ole_ivars(midi_file, track, chord, bar, section_type):
     """Classic Ole Ivars accordion style"""
-    base_velocity = 90
+    create_accordion_section_ole_ivars(midi_file, track, [bar], [chord])
 
-    # Basic chord pattern with characteristic off-beats
-    for beat in range(4):
-        time = bar * 4 + beat
 
-        # Main chord hits
-        if beat in [0, 2]:
-            for note in chord:
-                midi_file.addNote(track, 0, note, time, 0.75, base_velocity)
-
-        # Off-beat accents typical of Ole Ivars style
-        if beat in [1, 3]:
-            for note in chord:
-                midi_file.addNote(
-                    track, 0, note + 12, time + 0.5, 0.5, base_velocity - 10
-                )
-
-    # Add characteristic bellows effect
-    steps = 32
-    for i in range(steps):
-        time = bar * 4 + (i / steps * 4)
-        value = 100 + int(math.sin(i * math.pi / 8) * 25)  # Deeper bellows movement
-        midi_file.addControllerEvent(track, 0, time, 11, value)
+def create_accordion_section_ole_ivars(midi_file, track, bars, chords):
+    """Classic Ole Ivars accordion and bellows for a run of bars, rendered in one pass"""
+    write_events(midi_file, render_comping(track, bars, chords, "ole_ivars_accordion"))
 
 
 def create_walking_bass_ole_ivars(midi_file, track, chord, next_chord, bar):
     """Classic Ole Ivars walking bass pattern"""
-    root = chord[0] - 24
-    fifth = chord[2] - 24
-    next_root = next_chord[0] - 24 if next_chord else root
-
-    velocities = [100, 85, 90, 85]
-
-    # Basic pattern
-    midi_file.addNote(track, 0, root, bar * 4, 1, velocities[0])
-    midi_file.addNote(track, 0, fifth, bar * 4 + 1, 1, velocities[1])
-    midi_file.addNote(track, 0, root + 7, bar * 4 + 2, 1, velocities[2])
-
-    # Create walking line to next chord
-    if next_chord:
-        steps = create_walking_steps(root + 7, next_root)
-        for i, note in enumerate(steps):
-            midi_file.addNote(
-                track, 0, note, bar * 4 + 3 + (i * 0.25), 0.25, velocities[3]
-            )
+    create_bass_section_ole_ivars(
+        midi_file, track, [bar], [chord], [next_chord or chord]
+    )
 
 
-def create_walking_steps(start_note, end_note):
-    """Creates smooth walking bass lines between chords"""
-    if abs(end_note - start_note) <= 3:
-        return [start_note, end_note]
-    elif end_note > start_note:
-        return [start_note, start_note + 2, start_note + 4, end_note]
-    else:
-        return [start_note, start_note - 2, start_note - 4, end_note]
+def create_bass_section_ole_ivars(midi_file, track, bars, chords, next_chords):
+    """Classic Ole Ivars walking bass for a run of bars, from the transition table"""
+    write_events(midi_file, render_bass(track, bars, chords, next_chords, "ole_ivars"))
 
 
-def create_drums_ole_ivars(midi_file, track, bar, section_type, intensity=1.0):
+def create_drums_ole_ivars(midi_file, track, bar, section_type):
     """Classic Ole Ivars drum pattern"""
-    kick = 36
-    snare = 38
-    hihat = 42
-    crash = 49
-    ride = 51
-
-    # Base velocities adjusted for intensity
-    kick_vel = int(100 * intensity)
-    snare_vel = int(95 * intensity)
-    hihat_vel = int(75 * intensity)
+    create_drum_section_ole_ivars(midi_file, track, [bar], section_type)
 
-    # Basic pattern for all sections
-    midi_file.addNote(track, 9, kick, bar * 4, 1, kick_vel)
-    midi_file.addNote(track, 9, kick, bar * 4 + 2, 1, kick_vel - 5)
 
-    # Strong backbeat on 2 and 4 (characteristic of Ole Ivars)
-    midi_file.addNote(track, 9, snare, bar * 4 + 1, 1, snare_vel)
-    midi_file.addNote(track, 9, snare, bar * 4 + 3, 1, snare_vel)
+def create_drum_section_ole_ivars(midi_file, track, bars, section_type):
+    """Classic Ole Ivars drums for a run of bars, rendered in one pass"""
+    bars = np.asarray(bars)
 
     # Hi-hat pattern varies by section
     if section_type.startswith("chorus"):
-        # More energetic hi-hat in chorus
-        for eighth in range(8):
-            vel = hihat_vel if eighth % 2 == 0 else hihat_vel - 10
-            midi_file.addNote(track, 9, hihat, bar * 4 + eighth * 0.5, 0.5, vel)
-
-        # Add crash accents in chorus
-        if bar % 4 == 0:  # Every 4 bars
-            midi_file.addNote(track, 9, crash, bar * 4, 1, kick_vel)
-
+        # More energetic hi-hat in chorus, crash accents every 4 bars
+        cymbals = OLE_IVARS_CHORUS_HIHAT
+        crash = bars % 4 == 0
     elif section_type == "bridge":
         # Ride cymbal in bridge
-        for eighth in range(8):
-            midi_file.addNote(
-                track, 9, ride, bar * 4 + eighth * 0.5, 0.5, hihat_vel - 5
-            )
-
+        cymbals = OLE_IVARS_RIDE
+        crash = False
     else:
         # Standard hi-hat pattern
-        for eighth in range(8):
-            vel = hihat_vel - (5 if eighth % 2 == 0 else 15)
-            midi_file.addNote(track, 9, hihat, bar * 4 + eighth * 0.5, 0.5, vel)
-
-    # Add fills at appropriate places
-    if (bar + 1) % 4 == 0:  # End of 4-bar phrase
-        create_ole_ivars_drum_fill(midi_file, track, bar * 4 + 3, intensity)
+        cymbals = OLE_IVARS_HIHAT
+        crash = False
 
+    # Fills at the end of every 4-bar phrase
+    fill = (bars + 1) % 4 == 0
 
-def create_ole_ivars_drum_fill(midi_file, track, start_time, intensity):
-    """Creates characteristic Ole Ivars style drum fills"""
-    toms = [45, 47, 50]  # Low, mid, high toms
-    snare = 38
-    crash = 49
-
-    fill_velocity = int(90 * intensity)
-
-    # Simple descending tom fill (very characteristic of dansband)
-    for i, tom in enumerate(reversed(toms)):
-        midi_file.addNote(track, 9, tom, start_time + i * 0.25, 0.25, fill_velocity)
-
-    # End with crash on the 1
-    midi_file.addNote(track, 9, crash, start_time + 1, 1, int(100 * intensity))
+    events = render_drums(
+        track,
+        bars,
+        [
+            (OLE_IVARS_BACKBEAT, True, 0),
+            (cymbals, True, 0),
+            (DOWNBEAT_CRASH, crash, 0),
+            (OLE_IVARS_FILL, fill, 3),
+        ],
+    )
+    write_events(midi_file, events)
 
 
 def create_vocal_melody_ole_ivars(midi_file, track, chord, bar, section_type):
     """Classic Ole Ivars vocal melody from Jag trodde änglarna fanns"""
-    base_velocity = 100  # Make vocals more prominent
-
-    if section_type.startswith("verse"):
-        # Actual verse melody notes from the song
-        # "Jag trodde änglarna fanns bara i himlen..."
-        melody_sequence = [
-            (74, 1),  # D (quarter note)
-            (72, 1),  # C
-            (71, 1),  # B
-            (69, 1),  # A
-            (67, 2),  # G (half note)
-            (69, 2),  # A
-        ]
-
-        for i, (note, duration) in enumerate(melody_sequence):
-            time = bar * 4 + sum(d for _, d in melody_sequence[:i])
-            add_vocal_note_with_vibrato(
-                midi_file, track, time, note, duration, base_velocity
-            )
-
-    elif section_type.startswith("chorus"):
-        # Actual chorus melody
-        # "För jag har mött dig..."
-        melody_sequence = [
-            (74, 1),  # D
-            (76, 1),  # E
-            (77, 2),  # F
-            (76, 1),  # E
-            (74, 1),  # D
-            (72, 2),  # C
-        ]
-
-        for i, (note, duration) in enumerate(melody_sequence):
-            time = bar * 4 + sum(d for _, d in melody_sequence[:i])
-            add_vocal_note_with_vibrato(
-                midi_file, track, time, note, duration, base_velocity
-            )
-
-
-def add_vocal_note_with_vibrato(midi_file, track, start_time, note, duration, velocity):
-    """Enhanced vibrato for more expressive vocals"""
-    midi_file.addNote(track, 0, note, start_time, duration, velocity)
-
-    steps = int(duration * 32)
-    vibrato_speed = 5.5  # Slightly slower, more emotional vibrato
-    depth = 25  # Deeper vibrato
-
-    # Add slight pitch bend at start (characteristic of Ole Ivars vocals)
-    initial_bend_steps = 8
-    for i in range(initial_bend_steps):
-        time = start_time + (i * 0.1 / initial_bend_steps)
-        value = 8192 + int((1.0 - i / initial_bend_steps) * 1024)
-        midi_file.addPitchWheelEvent(track, 0, time, value)
-
-    # Add vibrato
-    for i in range(steps):
-        time = start_time + 0.1 + (i * duration / steps)
-        value = 64 + int(math.sin(2 * math.pi * vibrato_speed * i / steps) * depth)
-        midi_file.addControllerEvent(track, 0, time, 1, value)
+    # Verse: "Jag trodde änglarna fanns bara i himlen..."
+    # Chorus: "För jag har mött dig..."
+    for section in ("verse", "chorus"):
+        if section_type.startswith(section):
+            place_phrase(midi_file, track, f"ole_ivars_{section}", bar * 4)
 
 
 def create_saxophone_arrangement(
@@ -604,10 +867,11 @@ def add_vocal_note_with_fall(midi_file, track, start_time, note, duration):
 
     fall_start = start_time + duration - 0.2
     steps = 32
-    for i in range(steps):
-        time = fall_start + (i * 0.2 / steps)
-        value = 8192 - int((i / steps) * 2048)
-        midi_file.addPitchWheelEvent(track, 0, time, value)
+    with curve_timer():
+        for i in range(steps):
+            time = fall_start + (i * 0.2 / steps)
+            value = 8192 - int((i / steps) * 2048)
+            midi_file.addPitchWheelEvent(track, 0, time, value)
 
 
 def add_sax_note_with_vibrato(midi_file, track, note, start_time, duration, velocity):
@@ -618,10 +882,11 @@ def add_sax_note_with_vibrato(midi_file, track, note, start_time, duration, velo
     vibrato_speed = 6.0
     depth = 20
 
-    for i in range(steps):
-        time = start_time + (i * duration / steps)
-        value = 64 + int(math.sin(2 * math.pi * vibrato_speed * i / steps) * depth)
-        midi_file.addControllerEvent(track, 0, time, 1, value)
+    with curve_timer():
+        for i in range(steps):
+            time = start_time + (i * duration / steps)
+            value = 64 + int(math.sin(2 * math.pi * vibrato_speed * i / steps) * depth)
+            midi_file.addControllerEvent(track, 0, time, 1, value)
 
 
 def add_sax_note_with_fall(midi_file, track, note, start_time, duration, velocity):
@@ -630,10 +895,11 @@ def add_sax_note_with_fall(midi_file, track, note, start_time, duration, velocit
 
     fall_start = start_time + duration - 0.15
     steps = 24
-    for i in range(steps):
-        time = fall_start + (i * 0.15 / steps)
-        value = 8192 - int((i / steps) * 1536)
-        midi_file.addPitchWheelEvent(track, 0, time, value)
+    with curve_timer():
+        for i in range(steps):
+            time = fall_start + (i * 0.15 / steps)
+            value = 8192 - int((i / steps) * 1536)
+            midi_file.addPitchWheelEvent(track, 0, time, value)
 
 
 if __name__ == "__main__":
@@ -1,9 +1,18 @@
-import math
-
 from midiutil.MidiFile import MIDIFile
 
+from phrases import place_phrase
 from utils import save_midi_file
 
+# Phrase sung in a bar by section type, keyed by bar % 4 (the vocal rests
+# through the other sections)
+VOCAL_PHRASES = {
+    "intro": {},
+    "verse": {0: "angels_verse_1", 1: "angels_verse_2"},
+    "chorus": {0: "angels_chorus"},
+    "bridge": {},
+    "outro": {},
+}
+
 
 def setup_track_names(midi_file):
     """Setup proper track names for better MIDI organization"""
@@ -37,7 +46,7 @@ def create_angels_progression():
     return verse_progression, chorus_progression
 
 
-def create_angels_template():
+def create_angels_template(target=None):
     """Create MIDI file with focus on vocal melody"""
     # Create MIDI file with 2 tracks (vocal + minimal backing)
     midi_file = MIDIFile(2)
@@ -68,7 +77,7 @@ def create_angels_template():
 
     create_chorus(midi_file, current_bar, chorus_prog, "final")
 
-    save_midi_file(midi_file, "jag_trodde_anglarna_vocal.mid")
+    return save_midi_file(midi_file, "jag_trodde_anglarna_vocal.mid", target=target)
 
 
 def create_verse(midi_file, start_bar, progression, verse_type):
@@ -97,97 +106,11 @@ def create_chorus(midi_file, start_bar, progression, chorus_type):
 
 def create_vocal_melody_ole_ivars(midi_file, track, chord, bar, section_type):
     """Create exact vocal melody from Jag trodde änglarna fans"""
-    base_velocity = 100
-
-    if section_type.startswith("verse"):
-        # First phrase: "jag trodde änglarna fans"
-        if bar % 4 == 0:
-            # Starting with pickup note
-            add_vocal_note(
-                midi_file, track, 67, bar * 4 - 0.5, 0.5, base_velocity
-            )  # G (pickup "jag")
-            add_vocal_note(
-                midi_file, track, 71, bar * 4, 0.5, base_velocity
-            )  # B ("trod")
-            add_vocal_note(
-                midi_file, track, 71, bar * 4 + 0.5, 0.5, base_velocity
-            )  # B ("de")
-            add_vocal_note(
-                midi_file, track, 71, bar * 4 + 1.0, 0.5, base_velocity
-            )  # B ("äng")
-            add_vocal_note(
-                midi_file, track, 69, bar * 4 + 1.5, 0.5, base_velocity
-            )  # A ("lar")
-            add_vocal_note(
-                midi_file, track, 67, bar * 4 + 2.0, 0.5, base_velocity
-            )  # G ("na")
-            add_vocal_note(
-                midi_file, track, 69, bar * 4 + 2.5, 0.5, base_velocity
-            )  # A ("fans")
-
-        # Second phrase: "bara bara i himmelen"
-        elif bar % 4 == 1:
-            add_vocal_note(
-                midi_file, track, 71, bar * 4, 0.5, base_velocity
-            )  # B ("ba")
-            add_vocal_note(
-                midi_file, track, 72, bar * 4 + 0.5, 0.5, base_velocity
-            )  # C ("ra")
-            add_vocal_note(
-                midi_file, track, 74, bar * 4 + 1.0, 1.0, base_velocity
-            )  # D ("ba")
-            add_vocal_note(
-                midi_file, track, 71, bar * 4 + 2.0, 0.5, base_velocity
-            )  # B ("ra")
-            add_vocal_note(
-                midi_file, track, 69, bar * 4 + 2.5, 0.5, base_velocity
-            )  # A ("i")
-            add_vocal_note(
-                midi_file, track, 67, bar * 4 + 3.0, 1.0, base_velocity
-            )  # G ("him-me-len")
-
-    elif section_type.startswith("chorus"):
-        # "nu har jag en ängel här"
-        if bar % 4 == 0:
-            add_vocal_note(
-                midi_file, track, 74, bar * 4, 0.5, base_velocity
-            )  # D ("nu")
-            add_vocal_note(
-                midi_file, track, 72, bar * 4 + 0.5, 0.5, base_velocity
-            )  # C ("har")
-            add_vocal_note(
-                midi_file, track, 71, bar * 4 + 1.0, 0.5, base_velocity
-            )  # B ("jag")
-            add_vocal_note(
-                midi_file, track, 69, bar * 4 + 1.5, 0.5, base_velocity
-            )  # A ("en")
-            add_vocal_note(
-                midi_file, track, 67, bar * 4 + 2.0, 1.0, base_velocity
-            )  # G ("äng")
-            add_vocal_note(
-                midi_file, track, 69, bar * 4 + 3.0, 1.0, base_velocity
-            )  # A ("el")
-
-
-def add_vocal_note(midi_file, track, note, start_time, duration, velocity):
-    """Add vocal note with characteristic Ole Ivars style"""
-    midi_file.addNote(track, 0, note, start_time, duration, velocity)
-
-    # Add slight pitch bend at start of longer notes
-    if duration >= 1.0:
-        steps = 8
-        for i in range(steps):
-            time = start_time + (i * 0.1 / steps)
-            value = 8192 + int((1.0 - i / steps) * 512)
-            midi_file.addPitchWheelEvent(track, 0, time, value)
-
-    # Add vibrato on held notes
-    if duration > 0.5:
-        steps = int(duration * 32)
-        for i in range(steps):
-            time = start_time + (i * duration / steps)
-            value = 64 + int(math.sin(i * math.pi / 4) * 20)
-            midi_file.addControllerEvent(track, 0, time, 1, value)
+    phrases = VOCAL_PHRASES.get(section_type.split("_")[0])
+    if phrases is None:
+        raise ValueError(f"No vocal phrases for section {section_type!r}")
+    if bar % 4 in phrases:
+        place_phrase(midi_file, track, phrases[bar % 4], bar * 4)
 
 
 def create_minimal_backing(midi_file, track, chord, bar):
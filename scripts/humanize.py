@@ -0,0 +1,86 @@
+import numpy as np
+
+from events import NOTE
+
+# Per-instrument feel, all times in milliseconds so they mean the same at
+# any tempo:
+#     timing: spread of note starts around the grid
+#     push: constant offset from the grid (positive lays back behind the beat)
+#     velocity: spread of note velocities
+#     length: how much earlier than written notes may end
+FEELS = {
+    "drums": {"timing": 4, "push": 0, "velocity": 5, "length": 0},
+    "bass": {"timing": 6, "push": 3, "velocity": 5, "length": 15},
+    "rhythm_guitar": {"timing": 8, "push": -2, "velocity": 8, "length": 20},
+    "accordion": {"timing": 8, "push": 0, "velocity": 6, "length": 25},
+    "steel_guitar": {"timing": 12, "push": 5, "velocity": 8, "length": 30},
+    "sax": {"timing": 12, "push": 4, "velocity": 8, "length": 30},
+    "vocal": {"timing": 15, "push": 8, "velocity": 6, "length": 30},
+}
+
+# No note moves further than this from where it was written
+MAX_SHIFT_MS = 30
+
+# Shortest note after humanizing, one tick at MIDIUtil's 960 per quarter
+MIN_DURATION = 1 / 960
+
+
+def ms_to_beats(ms, tempo):
+    """Convert milliseconds to beats at a tempo in BPM"""
+    return ms * tempo / 60000
+
+
+def humanize(events, tempo, feels, seed=0):
+    """
+    Return a copy of the events with human timing and velocity.
+
+    Every track gets its own random stream seeded from (seed, track), so a
+    track comes out the same whether it is humanized alone (a parallel
+    render) or together with the rest of the song. Start shifts are capped
+    at MAX_SHIFT_MS and a quarter of the note, so notes keep their order and
+    every note-off stays after its note-on. Controller and pitch wheel
+    events stay where they are.
+
+    Args:
+        events: Event block (EVENT_DTYPE)
+        tempo: Tempo in BPM, used to turn the feel's milliseconds into beats
+        feels: Feel name (key of FEELS) or profile dict for each track number.
+            Tracks without a feel are left alone.
+        seed: Seed of the random streams
+
+    Returns:
+        numpy.ndarray: The humanized events
+    """
+    events = events.copy()
+    notes = events["kind"] == NOTE
+    for track, feel in feels.items():
+        if isinstance(feel, str):
+            feel = FEELS[feel]
+        rows = np.flatnonzero(notes & (events["track"] == track))
+        if not len(rows):
+            continue
+
+        rng = np.random.default_rng([seed, track])
+        time = events["time"][rows]
+        duration = events["duration"][rows]
+
+        # Start shift, bounded in time and by the note's own length
+        limit = np.minimum(ms_to_beats(MAX_SHIFT_MS, tempo), duration / 4)
+        shift = ms_to_beats(
+            feel["push"] + rng.normal(0, feel["timing"], len(rows)), tempo
+        )
+        shift = np.clip(shift, -limit, limit)
+        start = np.maximum(time + shift, 0)
+
+        # Ends only come earlier, so a note never runs into the next one,
+        # and never before the new start
+        trim = np.minimum(
+            np.abs(rng.normal(0, feel["length"], len(rows))), MAX_SHIFT_MS
+        )
+        end = time + duration - ms_to_beats(trim, tempo)
+        events["time"][rows] = start
+        events["duration"][rows] = np.maximum(end - start, MIN_DURATION)
+
+        velocity = events["data2"][rows] + rng.normal(0, feel["velocity"], len(rows))
+        events["data2"][rows] = np.clip(np.rint(velocity), 1, 127)
+    return events
@@ -0,0 +1,109 @@
+import fcntl
+import hashlib
+import itertools
+import json
+import os
+import time
+
+from utils import get_generated_path, spec_hash
+
+# Directory levels of two hex digits each: 65536 directories hold millions
+# of files with a few dozen per directory
+SHARD_LEVELS = 2
+
+MANIFEST = "manifest.jsonl"
+
+# Names of files saved by this process: a worker id and a counter
+_counter = itertools.count()
+_worker = f"{int(time.time()):x}-{os.getpid()}"
+
+
+def _reset_worker():
+    global _counter, _worker
+    _counter = itertools.count()
+    _worker = f"{int(time.time()):x}-{os.getpid()}"
+
+
+# A forked worker must not carry on with its parent's names
+os.register_at_fork(after_in_child=_reset_worker)
+
+
+class ShardedLayout:
+    """
+    Output layout for large batches of renders.
+
+    Files are named from the spec they were rendered from (so the same
+    spec always lands on the same file) or, without a spec, from a worker
+    id and a per-process counter, so parallel workers never collide.
+    They are spread over directories by a hash of the name ("hash") or by
+    day and then hash ("date"), and every saved file gets a line in the
+    manifest mapping its name to its path and spec.
+    """
+
+    def __init__(self, root=None, shard_by="hash"):
+        if shard_by not in ("hash", "date"):
+            raise ValueError(f"Unknown sharding {shard_by!r}")
+        self.root = root or get_generated_path("songs")
+        self.shard_by = shard_by
+        self.manifest_path = os.path.join(self.root, MANIFEST)
+        self._paths = None
+
+    def new_name(self, base_filename, spec=None):
+        """A collision-free name for a file"""
+        prefix = spec_hash(spec)[:16] if spec is not None else None
+        if prefix is None:
+            prefix = f"{_worker}-{next(_counter)}"
+        return f"{prefix}_{base_filename}"
+
+    def shard(self, name):
+        """Directory of a file, relative to the root"""
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        parts = [digest[2 * level : 2 * level + 2] for level in range(SHARD_LEVELS)]
+        if self.shard_by == "date":
+            parts = [time.strftime("%Y-%m-%d"), *parts[:1]]
+        return os.path.join(*parts)
+
+    def new_path(self, base_filename, spec=None):
+        """Path to save a new file to, with its directory created"""
+        name = self.new_name(base_filename, spec)
+        directory = os.path.join(self.root, self.shard(name))
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def record(self, path, spec=None):
+        """Add a saved file to the manifest"""
+        entry = {
+            "name": os.path.basename(path),
+            "path": os.path.relpath(path, self.root),
+            "spec_hash": spec_hash(spec) if spec is not None else None,
+            "spec": spec,
+        }
+        # One locked append per line, so parallel workers never interleave
+        with open(self.manifest_path, "a") as manifest_file:
+            fcntl.flock(manifest_file, fcntl.LOCK_EX)
+            manifest_file.write(json.dumps(entry) + "\n")
+        if self._paths is not None:
+            self._paths[entry["name"]] = entry["path"]
+
+    def manifest(self):
+        """Every manifest entry, oldest first"""
+        try:
+            with open(self.manifest_path) as manifest_file:
+                return [
+                    json.loads(line) for line in manifest_file if line.endswith("\n")
+                ]
+        except FileNotFoundError:
+            return []
+
+    def lookup(self, name):
+        """
+        Path of a saved file.
+
+        Hash-sharded paths follow from the name alone, date-sharded ones are
+        looked up in the manifest (read once).
+        """
+        if self.shard_by == "hash":
+            return os.path.join(self.root, self.shard(name), name)
+        if self._paths is None:
+            self._paths = {entry["name"]: entry["path"] for entry in self.manifest()}
+        return os.path.join(self.root, self._paths[name])
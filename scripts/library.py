@@ -1,6 +1,28 @@
 import math
+import sys
+from collections import Counter
+from functools import partial
+from time import perf_counter
 
+import numpy as np
 from midiutil.MidiFile import MIDIFile
+
+from bass import compile_style, render_bass
+from budget import estimate_midi_bytes
+from dynamics import apply_dynamics, song_envelope
+from drums import (
+    DANSEBAND_BACKBEAT,
+    DANSEBAND_CHORUS_HIHAT,
+    DANSEBAND_HIHAT,
+    DANSEBAND_RIDE,
+    DOWNBEAT_CRASH,
+    render_drums,
+)
+from events import EventRecorder, render_blocks_parallel, write_events
+from humanize import humanize
+from memprofile import AllocationProfile, profiled
+from metrics import RenderMetrics, curve_seconds, curve_timer, timed
+from plan import SECTION_TYPES, compile_plan, section_spans
 from utils import save_midi_file
 
 
@@ -9,7 +31,12 @@ class DansebandSong:
         self.name = name
         self.tempo = tempo
         self.midi_file = None
-        self.current_bar = 0
+
+        # Track names being rendered, None renders every track
+        self.active_tracks = None
+
+        # Fraction of the points kept in expression curves (CC and pitch wheel)
+        self.curve_density = 1.0
 
         # Default song structure
         self.structure = {"intro": 4, "verse": 8, "chorus": 8, "bridge": 4, "outro": 4}
@@ -24,6 +51,68 @@ class DansebandSong:
             "lead_vocal": 5,
         }
 
+        # Humanization feel of every track (keys of humanize.FEELS), and the
+        # seed of its random timing. A seed of None keeps notes on the grid.
+        self.feels = {
+            "steel_guitar": "steel_guitar",
+            "accordion": "accordion",
+            "bass": "bass",
+            "rhythm_guitar": "rhythm_guitar",
+            "drums": "drums",
+            "lead_vocal": "vocal",
+        }
+        self.humanize_seed = 0
+
+        # Save with running status and without redundant controller events,
+        # and/or as a single-track format-0 file
+        self.compact = False
+        self.single_track = False
+
+        # Path every render is saved to, None saves each render to a new
+        # timestamped file in the generated directory
+        self.output_path = None
+
+        # BackgroundWriter that saves renders off the rendering thread
+        # (None writes each file before generate_song returns). The song
+        # does not close it, whoever set it does.
+        self.writer = None
+
+        # ShardedLayout to save renders into (unless output_path is set),
+        # and the spec the song was made from, recorded in its manifest
+        self.layout = None
+        self.spec = None
+
+        # Where generate_song writes its render metrics (a .prom file gets
+        # the Prometheus text format, anything else JSON lines), and the
+        # metrics of the last render
+        self.metrics_path = None
+        self.metrics = None
+
+        # Where generate_song logs its allocation profile (tracemalloc peak
+        # and retained memory per section and track), and the profile of the
+        # last render. Profiled renders never use worker processes.
+        self.memory_profile_path = None
+        self.profile = None
+
+        # Rendered sections (before dynamics and humanization) by everything
+        # they were rendered from, so generating the song again only
+        # re-renders sections whose inputs changed, and the labels of the
+        # sections the last serial render had to render
+        self.section_cache = {}
+        self.rendered_sections = []
+
+    def __getstate__(self):
+        """
+        What a worker process gets of the song: the render inputs, without
+        the writer, layout, metrics, profile, cached sections or MIDI file
+        (which workers never use and which may not pickle)
+        """
+        state = self.__dict__.copy()
+        for name in ("writer", "layout", "metrics", "profile", "midi_file"):
+            state[name] = None
+        state["section_cache"] = {}
+        return state
+
     @staticmethod
     def get_initial_volume(track):
         volumes = {
@@ -89,19 +178,253 @@ class DansebandSong:
         """Set custom song structure"""
         self.structure.update(structure_dict)
 
-    def generate_song(self, progressions, arrangement="default"):
-        """Generate full song with given chord progressions"""
-        # Initialize MIDI file
-        self.midi_file = MIDIFile(
-            len(self.tracks), adjust_origin=False, deinterleave=False
+    def generate_song(
+        self,
+        progressions,
+        arrangement="default",
+        workers=None,
+        budget=None,
+        target=None,
+    ):
+        """
+        Generate full song with given chord progressions
+
+        Args:
+            progressions: Dict of chord lists, "base" plus optional section overrides
+            arrangement: Arrangement style (only "default" exists)
+            workers: Render each track in its own worker process and merge the
+                tracks at the end (None renders everything serially)
+            budget: RenderBudget checked before rendering. Curve density is
+                lowered until the song fits, or BudgetExceededError is raised.
+            target: bytes, "-" or a file object to send the file to instead of
+                saving it (see save_midi_file)
+
+        Returns:
+            The saved file's path, or what save_midi_file returns for target
+
+        Raises:
+            PlanError: When the structure and progressions do not make a song,
+                before anything is rendered
+        """
+        bars, _, labels = compile_plan(self._sections(progressions))
+        sections = list(
+            zip(labels, np.bincount(bars["section"], minlength=len(labels)).tolist())
         )
-        self._setup_tracks()
+        metrics = None
+        if self.metrics_path:
+            metrics = RenderMetrics(self.name, sum(length for _, length in sections))
+            metrics.watch_cache("bass_styles", compile_style)
+        profile = None
+        if self.memory_profile_path:
+            profile = AllocationProfile(self.memory_profile_path)
+            profile.start()
+        self.profile = profile
+
+        try:
+            with timed(metrics, "plan"):
+                if budget is not None:
+                    self.curve_density = budget.fit(
+                        lambda density: self.estimate(progressions, density)
+                    )
+                envelope = song_envelope(sections)
+
+            if workers or metrics or profile:
+                # Tracks never read each other's notes, so every track can render
+                # the whole song independently (and be measured on its own)
+                if workers and not profile:
+                    rendered = render_blocks_parallel(
+                        partial(self._render_timed_track, progressions),
+                        list(self.tracks),
+                        workers,
+                    )
+                else:
+                    rendered = [
+                        self._render_timed_track(progressions, name)
+                        for name in self.tracks
+                    ]
+                blocks = []
+                for name, (block, seconds, curves) in zip(self.tracks, rendered):
+                    if metrics:
+                        metrics.add_stage("render", seconds, name)
+                        metrics.add_stage("curves", curves, name)
+                        metrics.count_events(block, name)
+                    blocks.append(block)
+            else:
+                blocks = [self._render_sections(progressions)]
 
-        # Generate sections based on progressions
+            # Initialize MIDI file
+            self.midi_file = MIDIFile(
+                len(self.tracks), adjust_origin=False, deinterleave=False
+            )
+            self._setup_tracks()
+
+            # Section dynamics and humanization, then write the rendered sections
+            feels = {self.tracks[name]: feel for name, feel in self.feels.items()}
+            with profiled(profile, "dynamics"):
+                for block in blocks:
+                    with timed(metrics, "dynamics"):
+                        block = apply_dynamics(block, envelope)
+                    if self.humanize_seed is not None:
+                        with timed(metrics, "humanize"):
+                            block = humanize(
+                                block, self.tempo, feels, self.humanize_seed
+                            )
+                    write_events(self.midi_file, block)
+
+            # Save MIDI file
+            with profiled(profile, "save"):
+                saved = save_midi_file(
+                    self.midi_file,
+                    self.name,
+                    self.compact,
+                    self.single_track,
+                    metrics,
+                    self.output_path,
+                    self.writer,
+                    self.layout,
+                    self.spec,
+                    target,
+                )
+            self.metrics = metrics
+            if metrics:
+                metrics.write(self.metrics_path)
+        finally:
+            if profile:
+                profile.stop()
+        if profile:
+            print(profile.report(), file=sys.stderr if target == "-" else sys.stdout)
+        return saved
+
+    def _render_track(self, progressions, track_name):
+        """Render the whole song for a single track into an event block"""
+        return self._render_tracks(progressions, {track_name})
+
+    def _render_timed_track(self, progressions, track_name):
+        """
+        Render a single track, also returning the seconds it took apart from
+        its curves, and the seconds its curves took
+        """
+        started = perf_counter()
+        curves = curve_seconds()
+        block = self._render_track(progressions, track_name)
+        curves = curve_seconds() - curves
+        return block, perf_counter() - started - curves, curves
+
+    def _render_tracks(self, progressions, active_tracks=None):
+        """Render the whole song for some (None for all) tracks into an event block"""
+        self.midi_file = EventRecorder()
+        self.active_tracks = active_tracks
         self._generate_default_arrangement(progressions)
+        return self.midi_file.events()
+
+    def estimate(self, progressions, curve_density=None):
+        """
+        Count the events and bytes a song will produce without rendering it
+
+        Args:
+            progressions: Same progressions that would be passed to generate_song
+            curve_density: Curve density to estimate for (defaults to the song's)
+
+        Returns:
+            Counter: notes, controller_events, pitch_wheel_events, events, bars
+            and bytes (approximate size of the written file)
+        """
+        if curve_density is None:
+            curve_density = self.curve_density
+
+        totals = Counter()
+
+        # Track setup and the vocal/steel guitar controls
+        totals["controller_events"] += 2 * len(self.tracks) + 4 + 3
+        totals["program_changes"] += len(self.tracks)
+        totals["pitch_wheel_events"] += 2
+
+        bars, chords, _ = compile_plan(self._sections(progressions))
+        rows = zip(
+            bars["section_type"].tolist(),
+            bars["bar_in_section"].tolist(),
+            bars["chord"].tolist(),
+        )
+        for bar, (section_type, bar_in_section, chord) in enumerate(rows):
+            totals += self._estimate_bar(
+                SECTION_TYPES[section_type],
+                bar,
+                bar_in_section,
+                chords[chord],
+                curve_density,
+            )
 
-        # Save MIDI file
-        save_midi_file(self.midi_file, self.name)
+        totals["bars"] = len(bars)
+        totals["events"] = (
+            2 * totals["notes"]
+            + totals["controller_events"]
+            + totals["pitch_wheel_events"]
+            + totals["program_changes"]
+        )
+        totals["bytes"] = estimate_midi_bytes(totals, len(self.tracks))
+        return totals
+
+    def _estimate_bar(self, section_name, bar, bar_in_section, chord, curve_density):
+        """Event counts of one bar, mirroring the pattern generators"""
+        counts = Counter()
+
+        def curve(steps):
+            return len(self._curve_steps(steps, curve_density))
+
+        # Bass and rhythm guitar play in every bar
+        counts["notes"] += 8 + 4 * len(chord)
+        if section_name == "intro" and bar_in_section < 2:
+            return counts
+
+        # Drums: kick, snare and eight hi-hat/ride hits (+ crash in chorus)
+        counts["notes"] += 12
+        if section_name == "chorus" and bar % 2 == 0:
+            counts["notes"] += 1
+
+        if section_name == "intro":
+            return counts
+
+        # Vocal melody
+        if section_name == "verse":
+            counts["notes"] += 2
+            if bar % 2 == 0:
+                counts["pitch_wheel_events"] += curve(32) + 1 + curve(64)
+            else:
+                counts["controller_events"] += curve(32)
+                counts["pitch_wheel_events"] += curve(32)
+        elif section_name == "chorus":
+            if bar % 2 == 0:
+                counts["notes"] += 3
+                counts["pitch_wheel_events"] += curve(64) + curve(32) + 1
+                counts["controller_events"] += curve(32)
+            else:
+                counts["notes"] += 2
+                counts["pitch_wheel_events"] += curve(64) + curve(32)
+        elif section_name == "bridge":
+            counts["notes"] += 2
+            counts["controller_events"] += curve(32)
+            counts["pitch_wheel_events"] += curve(32)
+
+        # Steel guitar expression, swell, notes and vibrato
+        counts["controller_events"] += 1
+        if section_name == "verse":
+            counts["notes"] += 2
+            counts["controller_events"] += curve(32) + curve(64)
+        elif section_name == "chorus":
+            counts["notes"] += 4
+            counts["controller_events"] += 1 + curve(32) + curve(64)
+        elif section_name == "bridge":
+            counts["notes"] += 1
+            counts["controller_events"] += 1 + curve(64)
+
+        # Accordion bellows and two chord hits
+        counts["notes"] += 2 * len(chord)
+        counts["controller_events"] += curve(16)
+        return counts
+
+    def _plays(self, track_name):
+        """Check whether a track is part of the current render"""
+        return self.active_tracks is None or track_name in self.active_tracks
 
     def _setup_tracks(self):
         """Initialize all tracks with proper names and settings"""
@@ -121,139 +444,116 @@ class DansebandSong:
         self.setup_steel_guitar_controls(self.tracks["steel_guitar"])
 
     def _generate_default_arrangement(self, progressions):
-        """Generate standard danseband arrangement"""
-        # Intro
-        self._add_section("intro", progressions["base"], length=self.structure["intro"])
-
-        # First Verse & Chorus
-        self._add_section(
-            "verse",
-            progressions.get("verse", progressions["base"]),
-            length=self.structure["verse"],
-            section_type="first",
-        )
-        self._add_section(
-            "chorus",
-            progressions.get("chorus", progressions["base"]),
-            length=self.structure["chorus"],
-            section_type="first",
-        )
-
-        # Second Verse & Chorus
-        self._add_section(
-            "verse",
-            progressions.get("verse", progressions["base"]),
-            length=self.structure["verse"],
-            section_type="second",
-        )
-        self._add_section(
-            "chorus",
-            progressions.get("chorus", progressions["base"]),
-            length=self.structure["chorus"],
-            section_type="second",
-        )
-
-        # Bridge
-        self._add_section(
-            "bridge",
-            progressions.get("bridge", progressions["base"]),
-            length=self.structure["bridge"],
-        )
-
-        # Final Chorus & Outro
-        self._add_section(
-            "chorus",
-            progressions.get("chorus", progressions["base"]),
-            length=self.structure["chorus"],
-            section_type="final",
-        )
-        self._add_section("outro", progressions["base"], length=self.structure["outro"])
-
-    def _add_section(self, section_name, chords, length, section_type=None):
-        """Add a section to the song"""
-        if section_name == "intro":
-            self._create_intro_section(self.current_bar, chords, length)
-        elif section_name == "verse":
-            self._create_verse_section(
-                self.current_bar, chords * (length // len(chords)), section_type
+        """Generate standard danseband arrangement, bar by bar from the song's plan"""
+        bars, chords, labels = compile_plan(self._sections(progressions))
+        tracks = ",".join(sorted(self.active_tracks)) if self.active_tracks else "all"
+        for label, start, end in section_spans(bars, labels):
+            with profiled(self.profile, label, tracks):
+                self._add_section(bars, chords, label, start, end)
+
+    def _render_sections(self, progressions):
+        """
+        Render the whole song into an event block, section by section, reusing
+        the cached sections whose inputs did not change.
+
+        A section is rendered from its label, its bars, the chord of every
+        bar and the chord after it (which for the last bar is in the next
+        section) and the curve density, so editing one section's chords also
+        re-renders the section before it. Dynamics and humanization span
+        sections and run over the spliced song afterwards.
+        """
+        bars, chords, labels = compile_plan(self._sections(progressions))
+        cache = {}
+        blocks = []
+        self.rendered_sections = []
+        for label, start, end in section_spans(bars, labels):
+            rows = bars[start:end]
+            key = (
+                label,
+                start,
+                end,
+                self.curve_density,
+                tuple(chords[chord] for chord in rows["chord"].tolist()),
+                tuple(chords[chord] for chord in rows["next_chord"].tolist()),
             )
-        elif section_name == "chorus":
-            self._create_chorus_section(
-                self.current_bar, chords * (length // len(chords)), section_type
-            )
-        elif section_name == "bridge":
-            self._create_bridge_section(
-                self.current_bar, chords * (length // len(chords))
-            )
-        elif section_name == "outro":
-            self._create_outro_section(self.current_bar, chords, length)
-
-        self.current_bar += length
-
-    def _create_intro_section(self, start_bar, chords, length):
-        """Create intro section"""
-        for bar in range(length):
-            chord_idx = bar % len(chords)
-            # Just bass and guitar for first 2 bars
-            if bar < 2:
-                self._create_bass_pattern(2, [chords[chord_idx]], bar + start_bar)
-                self._create_rhythm_guitar(3, [chords[chord_idx]], bar + start_bar)
-            else:
-                # Add full arrangement for latter half
-                self._create_full_bar_arrangement(
-                    [chords[chord_idx]], bar + start_bar, "intro"
-                )
-
-    def _create_verse_section(self, start_bar, chords, verse_type):
-        """Create verse section"""
-        for bar in range(len(chords)):
-            self._create_full_bar_arrangement(
-                [chords[bar]], bar + start_bar, f"verse_{verse_type}"
-            )
-
-    def _create_chorus_section(self, start_bar, chords, chorus_type):
-        """Create chorus section"""
-        for bar in range(len(chords)):
-            self._create_full_bar_arrangement(
-                [chords[bar]], bar + start_bar, f"chorus_{chorus_type}", intensity=1.2
-            )
-
-    def _create_bridge_section(self, start_bar, chords):
-        """Create bridge section"""
-        for bar in range(len(chords)):
-            self._create_full_bar_arrangement(
-                [chords[bar]], bar + start_bar, "bridge", intensity=1.1
-            )
-
-    def _create_outro_section(self, start_bar, chords, length):
-        """Create outro section"""
-        for bar in range(length):
-            chord_idx = bar % len(chords)
-            self._create_full_bar_arrangement(
-                [chords[chord_idx]], bar + start_bar, "outro", intensity=0.9
-            )
-
-    def _create_full_bar_arrangement(self, chords, bar, section_type, intensity=1.0):
-        """Creates a full bar arrangement with all instruments"""
-        # Adjust velocities based on section type and intensity
-        velocity_mult = intensity
-        if section_type.startswith("chorus"):
-            velocity_mult *= 1.1
-        elif section_type == "bridge":
-            velocity_mult *= 1.05
-        elif section_type == "outro":
-            velocity_mult *= max(0.9, 1.0 - (bar * 0.05))  # Gradual fadeout
+            block = self.section_cache.get(key)
+            if block is None:
+                self.midi_file = EventRecorder()
+                self.active_tracks = None
+                self._add_section(bars, chords, label, start, end)
+                block = self.midi_file.events()
+                self.rendered_sections.append(label)
+            cache[key] = block
+            blocks.append(block)
+
+        # Sections that are no longer in the song are dropped
+        self.section_cache = cache
+        return np.concatenate(blocks)
+
+    def _sections(self, progressions):
+        """Standard danseband section order as (name, chords, length, type)"""
+        base = progressions["base"]
+        verse = progressions.get("verse", base)
+        chorus = progressions.get("chorus", base)
+        bridge = progressions.get("bridge", base)
+
+        return [
+            # Intro
+            ("intro", base, self.structure["intro"], None),
+            # First Verse & Chorus
+            ("verse", verse, self.structure["verse"], "first"),
+            ("chorus", chorus, self.structure["chorus"], "first"),
+            # Second Verse & Chorus
+            ("verse", verse, self.structure["verse"], "second"),
+            ("chorus", chorus, self.structure["chorus"], "second"),
+            # Bridge
+            ("bridge", bridge, self.structure["bridge"], None),
+            # Final Chorus & Outro
+            ("chorus", chorus, self.structure["chorus"], "final"),
+            ("outro", base, self.structure["outro"], None),
+        ]
+
+    def _add_section(self, bars, chords, label, start, end):
+        """Add the bars start..end of the song's plan to the song"""
+        for bar in range(start, end):
+            self._add_bar(bar, bars[bar], chords, label)
+
+        # Drums render over the whole section at once, except for the first
+        # 2 bars of the intro
+        if self._plays("drums"):
+            rows = bars[start:end]
+            intro = rows["section_type"] == SECTION_TYPES.index("intro")
+            playing = ~(intro & (rows["bar_in_section"] < 2))
+            self._create_drum_section(4, np.arange(start, end)[playing], label)
+
+    def _add_bar(self, bar, row, chords, label):
+        """Add one bar (a row of the song's plan) to the song"""
+        chord = [chords[row["chord"]]]
+        if SECTION_TYPES[row["section_type"]] == "intro" and row["bar_in_section"] < 2:
+            # Just bass and guitar for the first 2 bars of the intro
+            if self._plays("bass"):
+                self._create_bass_pattern(2, chord, bar)
+            if self._plays("rhythm_guitar"):
+                self._create_rhythm_guitar(3, chord, bar)
+        else:
+            self._create_full_bar_arrangement(chord, bar, label)
 
-        # Create patterns for each instrument
-        self._create_bass_pattern(2, chords, bar, velocity_mult)
-        self._create_rhythm_guitar(3, chords, bar, velocity_mult)
-        self._create_drum_pattern(4, bar, section_type, velocity_mult)
+    def _create_full_bar_arrangement(self, chords, bar, section_type):
+        """Creates a full bar arrangement with all instruments but the drums"""
+        # Create patterns for each instrument (section dynamics come later)
+        if self._plays("bass"):
+            self._create_bass_pattern(2, chords, bar)
+        if self._plays("rhythm_guitar"):
+            self._create_rhythm_guitar(3, chords, bar)
 
         # Add section-specific arrangements
         if section_type != "intro":
-            self._create_vocal_melody(5, chords, bar, section_type)
-            self._create_steel_guitar(0, chords, bar, section_type)
-            self._create_accordion(1, chords, bar, velocity_mult)
+            if self._plays("lead_vocal"):
+                self._create_vocal_melody(5, chords, bar, section_type)
+            if self._plays("steel_guitar"):
+                self._create_steel_guitar(0, chords, bar, section_type)
+            if self._plays("accordion"):
+                self._create_accordion(1, chords, bar)
 
     def _create_vocal_melody(self, track, chords, bar, section_type):
         """Enhanced vocal melody with section-specific variations"""
@@ -291,10 +591,11 @@ class DansebandSong:
         self.midi_file.addNote(track, 0, note, start_time, duration, 90)
 
         steps = 32
-        for i in range(steps):
-            time = start_time + (i * 0.1 / steps)
-            value = int(8192 + (i / steps) * 2048)  # Gradual bend up
-            self.midi_file.addPitchWheelEvent(track, 0, time, value)
+        with curve_timer():
+            for i in self._curve_steps(steps):
+                time = start_time + (i * 0.1 / steps)
+                value = int(8192 + (i / steps) * 2048)  # Gradual bend up
+                self.midi_file.addPitchWheelEvent(track, 0, time, value)
 
         self.midi_file.addPitchWheelEvent(track, 0, start_time + 0.1, 8192)
 
@@ -303,20 +604,22 @@ class DansebandSong:
         self.midi_file.addNote(track, 0, note, start_time, duration, 95)
 
         steps = 64
-        for i in range(steps):
-            time = start_time + (i * duration / steps)
-            value = 8192 + int(math.sin(i * math.pi / 8) * 1024)
-            self.midi_file.addPitchWheelEvent(track, 0, time, value)
+        with curve_timer():
+            for i in self._curve_steps(steps):
+                time = start_time + (i * duration / steps)
+                value = 8192 + int(math.sin(i * math.pi / 8) * 1024)
+                self.midi_file.addPitchWheelEvent(track, 0, time, value)
 
     def _add_vocal_note_with_vibrato(self, track, start_time, note, duration):
         """Add note with emotional vibrato"""
         self.midi_file.addNote(track, 0, note, start_time, duration, 85)
 
         steps = 32
-        for i in range(steps):
-            time = start_time + (i * duration / steps)
-            value = 64 + int(math.sin(i * math.pi / 4) * 32)
-            self.midi_file.addControllerEvent(track, 0, time, 1, value)
+        with curve_timer():
+            for i in self._curve_steps(steps):
+                time = start_time + (i * duration / steps)
+                value = 64 + int(math.sin(i * math.pi / 4) * 32)
+                self.midi_file.addControllerEvent(track, 0, time, 1, value)
 
     def _add_vocal_note_with_fall(self, track, start_time, note, duration):
         """Add note with characteristic falling end"""
@@ -324,10 +627,11 @@ class DansebandSong:
 
         fall_start = start_time + duration - 0.2
         steps = 32
-        for i in range(steps):
-            time = fall_start + (i * 0.2 / steps)
-            value = 8192 - int((i / steps) * 2048)  # Gradual fall
-            self.midi_file.addPitchWheelEvent(track, 0, time, value)
+        with curve_timer():
+            for i in self._curve_steps(steps):
+                time = fall_start + (i * 0.2 / steps)
+                value = 8192 - int((i / steps) * 2048)  # Gradual fall
+                self.midi_file.addPitchWheelEvent(track, 0, time, value)
 
     def _create_steel_guitar(self, track, chords, bar, section_type):
         """Enhanced steel guitar part with section-specific variations"""
@@ -355,9 +659,12 @@ class DansebandSong:
         """Enhanced steel guitar phrase with section variations"""
         swell_intensity = 1.2 if section_type == "chorus" else 1.0
 
-        for i in range(0, 32):
-            volume = int((i / 31) * 127 * swell_intensity)
-            self.midi_file.addControllerEvent(track, 0, start_time + i / 32, 7, volume)
+        with curve_timer():
+            for i in self._curve_steps(32):
+                volume = int((i / 31) * 127 * swell_intensity)
+                self.midi_file.addControllerEvent(
+                    track, 0, start_time + i / 32, 7, volume
+                )
 
         if section_type == "chorus":
             # More active chorus pattern
@@ -382,10 +689,22 @@ class DansebandSong:
         vibrato_depth = 48 if section_type == "chorus" else 32
         steps = 64
 
-        for i in range(steps):
-            time = start_time + (i * 4 / steps)
-            value = 64 + int(math.sin(i * math.pi / 8) * vibrato_depth)
-            self.midi_file.addControllerEvent(track, 0, time, 1, value)
+        with curve_timer():
+            for i in self._curve_steps(steps):
+                time = start_time + (i * 4 / steps)
+                value = 64 + int(math.sin(i * math.pi / 8) * vibrato_depth)
+                self.midi_file.addControllerEvent(track, 0, time, 1, value)
+
+    def _curve_steps(self, steps, curve_density=None):
+        """Step positions of an expression curve, thinned out by curve density"""
+        if curve_density is None:
+            curve_density = self.curve_density
+
+        count = max(2, int(steps * curve_density))
+        if count >= steps:
+            return range(steps)
+        # Sample the same curve at fewer, evenly spread positions
+        return [i * steps / count for i in range(count)]
 
     def _generate_pitch_bend_curve(self, start_time, duration):
         """Generate smooth pitch bend curve for steel guitar"""
@@ -409,46 +728,23 @@ class DansebandSong:
             value = int(64 + 32 * math.sin(2 * math.pi * vibrato_freq * i / steps))
             self.midi_file.addControllerEvent(track, 0, time, 1, value)
 
-    def _create_bass_pattern(self, track, chords, bar, intensity=1.0):
-        """Enhanced bass pattern with intensity control"""
-        root = chords[0][0] - 24
-        third = chords[0][1] - 24
-        fifth = chords[0][2] - 24
-
-        velocities = {
-            0: int(100 * intensity),  # Root note
-            0.5: int(85 * intensity),  # Up movement
-            1: int(90 * intensity),  # Third
-            1.5: int(85 * intensity),  # Up to fifth
-            2: int(95 * intensity),  # Back to root
-            2.5: int(85 * intensity),  # Walking motion
-            3: int(85 * intensity),  # Walking notes
-            3.5: int(85 * intensity),  # Walking notes
-        }
-
-        # Create the pattern with exact timings
-        self.midi_file.addNote(track, 0, root, bar * 4, 0.5, velocities[0])
-        self.midi_file.addNote(track, 0, root + 7, bar * 4 + 0.5, 0.5, velocities[0.5])
-        self.midi_file.addNote(track, 0, third, bar * 4 + 1, 0.5, velocities[1])
-        self.midi_file.addNote(track, 0, fifth, bar * 4 + 1.5, 0.5, velocities[1.5])
-        self.midi_file.addNote(track, 0, root, bar * 4 + 2, 0.5, velocities[2])
-        self.midi_file.addNote(track, 0, root + 5, bar * 4 + 2.5, 0.5, velocities[2.5])
-
-        # Walking notes to next chord
-        self.midi_file.addNote(track, 0, root + 3, bar * 4 + 3, 0.5, velocities[3])
-        self.midi_file.addNote(track, 0, root + 5, bar * 4 + 3.5, 0.5, velocities[3.5])
+    def _create_bass_pattern(self, track, chords, bar):
+        """Enhanced bass pattern"""
+        events = render_bass(track, [bar], chords[:1], chords[:1], "danseband")
+        write_events(self.midi_file, events)
 
-    def _create_accordion(self, track, chords, bar, intensity=1.0):
+    def _create_accordion(self, track, chords, bar):
         """Enhanced accordion part with better expression"""
-        base_velocity = int(85 * intensity)
-        secondary_velocity = int(80 * intensity)
+        base_velocity = 85
+        secondary_velocity = 80
 
         # Add bellows effect with expression control
         steps = 16
-        for i in range(steps):
-            time = bar * 4 + (i / steps)
-            value = 100 + int(math.sin(i * math.pi / 8) * 20)
-            self.midi_file.addControllerEvent(track, 0, time, 11, value)
+        with curve_timer():
+            for i in self._curve_steps(steps):
+                time = bar * 4 + (i / steps)
+                value = 100 + int(math.sin(i * math.pi / 8) * 20)
+                self.midi_file.addControllerEvent(track, 0, time, 11, value)
 
         # Full chord on beat 1
         for note in chords[0]:
@@ -458,62 +754,41 @@ class DansebandSong:
         for note in chords[0]:
             self.midi_file.addNote(track, 0, note, bar * 4 + 2, 1.5, secondary_velocity)
 
-    def _create_rhythm_guitar(self, track, chords, bar, intensity=1.0):
-        """Enhanced rhythm guitar part with intensity control"""
-        base_velocity = int(75 * intensity)
-        accent_velocity = int(85 * intensity)
+    def _create_rhythm_guitar(self, track, chords, bar):
+        """Enhanced rhythm guitar part"""
+        base_velocity = 75
+        accent_velocity = 85
 
         for beat in range(4):
             for note in chords[0]:
                 velocity = accent_velocity if beat in [1, 3] else base_velocity
                 self.midi_file.addNote(track, 0, note, bar * 4 + beat, 1, velocity)
 
-    def _create_drum_pattern(self, track, bar, section_type, intensity=1.0):
-        """Enhanced drum pattern with section-specific variations"""
-        kick = 36
-        snare = 38
-        hihat = 42
-        crash = 49
-        ride = 51
-
-        # Base velocities adjusted for intensity
-        kick_vel = int(100 * intensity)
-        snare_vel = int(90 * intensity)
-        hihat_vel = int(70 * intensity)
-
-        # Basic pattern present in all sections
-        self.midi_file.addNote(track, 9, kick, bar * 4, 1, kick_vel)
-        self.midi_file.addNote(track, 9, kick, bar * 4 + 2, 1, kick_vel - 5)
-
-        self.midi_file.addNote(track, 9, snare, bar * 4 + 1, 1, snare_vel)
-        self.midi_file.addNote(track, 9, snare, bar * 4 + 3, 1, snare_vel)
-
+    def _create_drum_section(self, track, bars, section_type):
+        """Enhanced drum pattern with section-specific variations, for a run of bars"""
         # Section-specific hi-hat patterns
         if section_type.startswith("chorus"):
-            # More energetic hi-hat in chorus
-            for eighth in range(8):
-                vel = hihat_vel if eighth % 2 == 0 else hihat_vel - 10
-                self.midi_file.addNote(
-                    track, 9, hihat, bar * 4 + eighth * 0.5, 0.5, vel
-                )
-            # Add crash on first beat of some chorus bars
-            if bar % 2 == 0:
-                self.midi_file.addNote(track, 9, crash, bar * 4, 1, kick_vel)
-
+            # More energetic hi-hat in chorus, crash on first beat of some bars
+            cymbals = DANSEBAND_CHORUS_HIHAT
+            crash = bars % 2 == 0
         elif section_type == "bridge":
             # Ride cymbal in bridge
-            for eighth in range(8):
-                self.midi_file.addNote(
-                    track, 9, ride, bar * 4 + eighth * 0.5, 0.5, hihat_vel - 5
-                )
-
+            cymbals = DANSEBAND_RIDE
+            crash = False
         else:  # Verse and other sections
-            # Standard hi-hat pattern
-            for eighth in range(8):
-                vel = hihat_vel - (5 if eighth % 2 == 0 else 15)
-                self.midi_file.addNote(
-                    track, 9, hihat, bar * 4 + eighth * 0.5, 0.5, vel
-                )
+            cymbals = DANSEBAND_HIHAT
+            crash = False
+
+        events = render_drums(
+            track,
+            bars,
+            [
+                (DANSEBAND_BACKBEAT, True, 0),
+                (cymbals, True, 0),
+                (DOWNBEAT_CRASH, crash, 0),
+            ],
+        )
+        write_events(self.midi_file, events)
 
 
 # Example usage
@@ -3,7 +3,7 @@ from midiutil.MidiFile import MIDIFile
 from utils import save_midi_file
 
 
-def create_danseband_edm_template():
+def create_danseband_edm_template(target=None):
     # Create MIDI object with 6 tracks
     midi_file = MIDIFile(6)
 
@@ -43,7 +43,7 @@ def create_danseband_edm_template():
     # Atmospheric Pads (Track 5)
     create_atmosphere(midi_file, 5, chords)
 
-    save_midi_file(midi_file, "danseband_edm_template.mid")
+    return save_midi_file(midi_file, "danseband_edm_template.mid", target=target)
 
 
 def get_instrument(track):
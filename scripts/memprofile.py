@@ -0,0 +1,131 @@
+import json
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+
+def profiled(profile, section, instrument=""):
+    """Trace a scope into profile, or do nothing when there is none"""
+    return profile.scope(section, instrument) if profile else nullcontext()
+
+
+class AllocationProfile:
+    """
+    Peak and retained memory of every (section, instrument) of a render.
+
+    Scopes may nest. Each one reports the highest memory use above what was
+    allocated when it opened (peak) and what it left allocated when it
+    closed (retained). Every scope appends an "open" line to the log when it
+    is entered and a "close" line with its memory when it exits. A render
+    killed for running out of memory never gets to close its scopes, so the
+    open lines without a matching close show the section and instrument it
+    died in.
+    """
+
+    def __init__(self, log_path=None, top=10):
+        self.log_path = log_path
+        self.top = top
+        self.scopes = {}  # (section, instrument) -> peak, retained and calls
+        self.sites = []
+        self._stack = []  # [memory at open, highest peak inside] per open scope
+        self._tracing = False
+
+    def start(self):
+        """Start tracing allocations (unless something else already is)"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        tracemalloc.reset_peak()
+        if self.log_path:
+            open(self.log_path, "w").close()
+
+    def stop(self):
+        """Record the top allocation sites still holding memory and stop tracing"""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+        self.sites = [
+            {"site": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[: self.top]
+        ]
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        self._log({"top_sites": self.sites})
+
+    @contextmanager
+    def scope(self, section, instrument=""):
+        """Trace the memory of a block of work"""
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            # reset_peak below would lose the enclosing scope's peak so far
+            self._stack[-1][1] = max(self._stack[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._stack.append([current, current])
+        self._log({"section": section, "instrument": instrument, "event": "open"})
+
+        error = None
+        try:
+            yield
+        except BaseException as raised:
+            error = type(raised).__name__
+            raise
+        finally:
+            opened, inner_peak = self._stack.pop()
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, inner_peak)
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            self._record(section, instrument, peak - opened, current - opened, error)
+
+    def _record(self, section, instrument, peak, retained, error):
+        totals = self.scopes.setdefault(
+            (section, instrument), {"peak": 0, "retained": 0, "calls": 0}
+        )
+        totals["peak"] = max(totals["peak"], peak)
+        totals["retained"] += retained
+        totals["calls"] += 1
+
+        record = {
+            "section": section,
+            "instrument": instrument,
+            "event": "close",
+            "peak_bytes": peak,
+            "retained_bytes": retained,
+        }
+        if error:
+            record["error"] = error
+        self._log(record)
+
+    def _log(self, record):
+        if self.log_path:
+            with open(self.log_path, "a") as log_file:
+                log_file.write(json.dumps(record) + "\n")
+
+    def totals(self, by):
+        """Highest peak and total retained memory by "section" or "instrument" """
+        index = 0 if by == "section" else 1
+        totals = {}
+        for key, scope in self.scopes.items():
+            total = totals.setdefault(key[index], {"peak": 0, "retained": 0})
+            total["peak"] = max(total["peak"], scope["peak"])
+            total["retained"] += scope["retained"]
+        return totals
+
+    def report(self):
+        """A readable summary of the sections, instruments and top sites"""
+        lines = []
+        for by in ("section", "instrument"):
+            lines.append(f"{by:<24} {'peak KiB':>10} {'retained KiB':>13}")
+            for name, total in self.totals(by).items():
+                lines.append(
+                    f"{name or '-':<24} {total['peak'] / 1024:>10.1f} "
+                    f"{total['retained'] / 1024:>13.1f}"
+                )
+            lines.append("")
+        lines.append("Top allocation sites still holding memory:")
+        for site in self.sites:
+            lines.append(f"  {site['bytes'] / 1024:>8.1f} KiB  {site['site']}")
+        return "\n".join(lines)
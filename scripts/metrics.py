@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+from events import CONTROLLER, NOTE, PITCH_WHEEL, PROGRAM_CHANGE
+
+# Metric names in the Prometheus export start with this
+PREFIX = "dansband"
+
+EVENT_KINDS = {
+    NOTE: "note",
+    CONTROLLER: "controller",
+    PITCH_WHEEL: "pitch_wheel",
+    PROGRAM_CHANGE: "program_change",
+}
+
+
+def timed(metrics, name, instrument=""):
+    """Time a stage into metrics, or do nothing when there are none"""
+    return metrics.stage(name, instrument) if metrics else nullcontext()
+
+
+# Seconds this process spent generating controller and pitch-wheel curves.
+# Curves are written note by note in the middle of an instrument's render,
+# so they are timed where they are made and taken out of the render time.
+_curve_seconds = 0.0
+
+
+@contextmanager
+def curve_timer():
+    """Count a block that generates a curve into curve_seconds()"""
+    global _curve_seconds
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _curve_seconds += time.perf_counter() - started
+
+
+def curve_seconds():
+    """Seconds this process spent in curve_timer() blocks so far"""
+    return _curve_seconds
+
+
+class RenderMetrics:
+    """
+    Stage timings, event counts, output size and cache use of one render.
+
+    Stages are timed with stage(), and each instrument's render is a
+    "render" stage labelled with the instrument, so a slow style shows up
+    on its own. The curves generated in an instrument's render are a
+    separate "curves" stage with the same label (see curve_timer).
+    """
+
+    def __init__(self, song, bars):
+        self.song = song
+        self.bars = bars
+        self.stages = {}  # (stage, instrument) -> seconds
+        self.events = {}  # (instrument, kind) -> count
+        self.output_bytes = 0
+        self.caches = {}  # name -> (cached function, hits and misses at start)
+
+    @contextmanager
+    def stage(self, name, instrument=""):
+        """Time a block of work, adding up repeated stages"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            key = (name, instrument)
+            self.stages[key] = self.stages.get(key, 0.0) + time.perf_counter() - started
+
+    def add_stage(self, name, seconds, instrument=""):
+        """Record a stage timed elsewhere, e.g. in a worker process"""
+        key = (name, instrument)
+        self.stages[key] = self.stages.get(key, 0.0) + seconds
+
+    def count_events(self, events, instrument):
+        """Count an instrument's events (an EVENT_DTYPE block) by kind"""
+        kinds, counts = np.unique(events["kind"], return_counts=True)
+        for kind, count in zip(kinds.tolist(), counts.tolist()):
+            label = (instrument, EVENT_KINDS[kind])
+            self.events[label] = self.events.get(label, 0) + count
+
+    def watch_cache(self, name, cached_function):
+        """Report the hits and misses of an lru_cache from now on"""
+        info = cached_function.cache_info()
+        # Plain numbers, so the metrics can be pickled (CacheInfo cannot)
+        self.caches[name] = (cached_function, info.hits, info.misses)
+
+    def cache_stats(self):
+        """Hits and misses of every watched cache since it was watched"""
+        stats = {}
+        for name, (cached_function, hits, misses) in self.caches.items():
+            info = cached_function.cache_info()
+            stats[name] = {"hits": info.hits - hits, "misses": info.misses - misses}
+        return stats
+
+    def summary(self):
+        """Everything collected, as one JSON-friendly dict"""
+        total = sum(self.stages.values())
+        return {
+            "timestamp": time.time(),
+            "song": self.song,
+            "bars": self.bars,
+            "total_seconds": total,
+            "seconds_per_bar": total / self.bars if self.bars else 0.0,
+            "stages": [
+                {"stage": stage, "instrument": instrument, "seconds": seconds}
+                for (stage, instrument), seconds in self.stages.items()
+            ],
+            "events": [
+                {"instrument": instrument, "kind": kind, "count": count}
+                for (instrument, kind), count in self.events.items()
+            ],
+            "output_bytes": self.output_bytes,
+            "caches": self.cache_stats(),
+        }
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        summary = self.summary()
+        song = {"song": self.song}
+        metrics = [
+            (
+                "stage_seconds",
+                "Seconds spent in each render stage",
+                [({**song, **row}, row["seconds"]) for row in summary["stages"]],
+            ),
+            (
+                "render_seconds_per_bar",
+                "Render time of all stages divided by the song's bars",
+                [(song, summary["seconds_per_bar"])],
+            ),
+            ("bars", "Bars in the song", [(song, self.bars)]),
+            (
+                "events",
+                "Events rendered by instrument and kind",
+                [({**song, **row}, row["count"]) for row in summary["events"]],
+            ),
+            ("output_bytes", "Bytes written", [(song, self.output_bytes)]),
+            (
+                "cache_hits",
+                "Cache hits during the render",
+                [
+                    ({**song, "cache": name}, stats["hits"])
+                    for name, stats in summary["caches"].items()
+                ],
+            ),
+            (
+                "cache_misses",
+                "Cache misses during the render",
+                [
+                    ({**song, "cache": name}, stats["misses"])
+                    for name, stats in summary["caches"].items()
+                ],
+            ),
+        ]
+
+        lines = []
+        for name, description, samples in metrics:
+            lines.append(f"# HELP {PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{key}="{labels[key]}"'
+                    for key in ("song", "stage", "instrument", "kind", "cache")
+                    if key in labels
+                )
+                lines.append(f"{PREFIX}_{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Write the metrics, picking the format from the file name.
+
+        A .prom file is replaced with the Prometheus text format (for the
+        node exporter's textfile collector), anything else gets one JSON line
+        appended per render.
+        """
+        if path.endswith(".prom"):
+            # Replaced in one step, the collector must never scrape half a
+            # file (and ignores the .partial one). Unique per process and
+            # thread, so renders writing the same file never share one.
+            partial = f"{path}.{os.getpid()}.{threading.get_ident()}.partial"
+            with open(partial, "w") as metrics_file:
+                metrics_file.write(self.prometheus())
+            os.replace(partial, path)
+        else:
+            with open(path, "a") as metrics_file:
+                metrics_file.write(json.dumps(self.summary()) + "\n")
@@ -0,0 +1,183 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from events import CONTROLLER, EVENT_DTYPE, NOTE, PITCH_WHEEL, write_events
+
+# Scale steps for phrases written in degrees
+MODES = {
+    "major": (0, 2, 4, 5, 7, 9, 11),
+    "minor": (0, 2, 3, 5, 7, 8, 10),
+}
+
+
+def scoop(duration, depth):
+    """Pitch bend falling into the note over the first 0.1 beats"""
+    steps = 8
+    return [
+        (PITCH_WHEEL, i * 0.1 / steps, 0, 8192 + int((1.0 - i / steps) * depth))
+        for i in range(steps)
+    ]
+
+
+def vibrato(duration, depth, cycles=None, delay=0.0):
+    """
+    Mod wheel vibrato over the note, 32 steps per beat.
+
+    With cycles the note gets that many periods whatever its length,
+    otherwise one period lasts 8 steps (a quarter beat).
+    """
+    steps = int(duration * 32)
+    rows = []
+    for i in range(steps):
+        if cycles:
+            phase = 2 * math.pi * cycles * i / steps
+        else:
+            phase = i * math.pi / 4
+        time = delay + (i * duration / steps)
+        rows.append((CONTROLLER, time, 1, 64 + int(math.sin(phase) * depth)))
+    return rows
+
+
+# Expression tags a phrase note can carry. Each renders the controller and
+# pitch wheel rows of one note as (kind, beats from note start, data1, data2).
+EXPRESSIONS = {
+    # Slight scoop and quick vibrato on held notes (himmelen)
+    "scoop": lambda duration: scoop(duration, 512),
+    "vibrato": lambda duration: vibrato(duration, 20),
+    # Deeper scoop and slower, emotional vibrato (hav_full_v3)
+    "deep_scoop": lambda duration: scoop(duration, 1024),
+    "slow_vibrato": lambda duration: vibrato(duration, 25, cycles=5.5, delay=0.1),
+}
+
+HELD = ("scoop", "vibrato")
+OLE_IVARS = ("deep_scoop", "slow_vibrato")
+
+# Phrase library. Notes are (pitch, beat, duration, syllable, expression
+# tags) with beats counted from where the phrase is placed. Phrases with a
+# "key" of (tonic, mode) give pitches as scale degrees counted from 0, so 7
+# is the octave and -1 the leading tone below, the others as MIDI notes.
+PHRASES = {
+    # Jag trodde änglarna fans (himmelen), in G major
+    "angels_verse_1": {
+        "key": (67, "major"),
+        "notes": [
+            (0, -0.5, 0.5, "jag", ()),  # Pickup
+            (2, 0.0, 0.5, "trod", ()),
+            (2, 0.5, 0.5, "de", ()),
+            (2, 1.0, 0.5, "äng", ()),
+            (1, 1.5, 0.5, "lar", ()),
+            (0, 2.0, 0.5, "na", ()),
+            (1, 2.5, 0.5, "fans", ()),
+        ],
+    },
+    "angels_verse_2": {
+        "key": (67, "major"),
+        "notes": [
+            (2, 0.0, 0.5, "ba", ()),
+            (3, 0.5, 0.5, "ra", ()),
+            (4, 1.0, 1.0, "ba", HELD),
+            (2, 2.0, 0.5, "ra", ()),
+            (1, 2.5, 0.5, "i", ()),
+            (0, 3.0, 1.0, "him-me-len", HELD),
+        ],
+    },
+    "angels_chorus": {
+        "key": (67, "major"),
+        "notes": [
+            (4, 0.0, 0.5, "nu", ()),
+            (3, 0.5, 0.5, "har", ()),
+            (2, 1.0, 0.5, "jag", ()),
+            (1, 1.5, 0.5, "en", ()),
+            (0, 2.0, 1.0, "äng", HELD),
+            (1, 3.0, 1.0, "el", HELD),
+        ],
+    },
+    # Ole Ivars verse and chorus lines (hav_full_v3)
+    "ole_ivars_verse": {
+        "notes": [
+            (74, 0, 1, None, OLE_IVARS),
+            (72, 1, 1, None, OLE_IVARS),
+            (71, 2, 1, None, OLE_IVARS),
+            (69, 3, 1, None, OLE_IVARS),
+            (67, 4, 2, None, OLE_IVARS),
+            (69, 6, 2, None, OLE_IVARS),
+        ],
+    },
+    "ole_ivars_chorus": {
+        "notes": [
+            (74, 0, 1, None, OLE_IVARS),
+            (76, 1, 1, None, OLE_IVARS),
+            (77, 2, 2, None, OLE_IVARS),
+            (76, 4, 1, None, OLE_IVARS),
+            (74, 5, 1, None, OLE_IVARS),
+            (72, 6, 2, None, OLE_IVARS),
+        ],
+    },
+}
+
+
+def degree_pitch(degree, tonic, mode):
+    """MIDI note of a scale degree (0 is the tonic)"""
+    octave, step = divmod(degree, 7)
+    return tonic + octave * 12 + MODES[mode][step]
+
+
+def compile_phrase(phrase, velocity=100):
+    """
+    Compile a phrase into an event block relative to its placement.
+
+    Args:
+        phrase: Phrase spec in the PHRASES format
+        velocity: Velocity of every note
+
+    Returns:
+        numpy.ndarray: Events (EVENT_DTYPE) on track 0, channel 0, with every
+            note followed by its expression rows
+    """
+    key = phrase.get("key")
+    rows = []
+    for pitch, beat, duration, _syllable, tags in phrase["notes"]:
+        if key:
+            pitch = degree_pitch(pitch, *key)
+        rows.append((NOTE, 0, 0, beat, duration, pitch, velocity))
+        for tag in tags:
+            for kind, time, data1, data2 in EXPRESSIONS[tag](duration):
+                rows.append((kind, 0, 0, beat + time, 0, data1, data2))
+    return np.array(rows, dtype=EVENT_DTYPE)
+
+
+@lru_cache(maxsize=None)
+def compiled_phrase(name, velocity=100):
+    """Compiled block of a library phrase, built on first use"""
+    return compile_phrase(PHRASES[name], velocity)
+
+
+def render_phrase(track, name, beats, transpose=0, velocity=100):
+    """
+    Place a library phrase at any number of positions in one copy.
+
+    Args:
+        track: Track the phrase is written to
+        name: Key of PHRASES
+        beats: Absolute beat of every placement
+        transpose: Semitones added to every note
+        velocity: Velocity of every note
+
+    Returns:
+        numpy.ndarray: Events (EVENT_DTYPE) ordered by placement
+    """
+    block = compiled_phrase(name, velocity)
+    beats = np.asarray(beats, dtype=np.float64)
+
+    events = np.tile(block, len(beats))
+    events["track"] = track
+    events["time"] += np.repeat(beats, len(block))
+    events["data1"][events["kind"] == NOTE] += transpose
+    return events
+
+
+def place_phrase(midi_file, track, name, beat, transpose=0, velocity=100):
+    """Write a library phrase starting at an absolute beat"""
+    write_events(midi_file, render_phrase(track, name, [beat], transpose, velocity))
@@ -0,0 +1,125 @@
+import numpy as np
+
+from bass import BASS_HIGH, BASS_LOW, OCTAVES_DOWN
+from dynamics import song_envelope
+
+SECTION_TYPES = ("intro", "verse", "chorus", "bridge", "outro")
+
+# Sections that play their progression a whole number of times. The others
+# cycle through theirs for as many bars as they last.
+WHOLE_PROGRESSION = ("verse", "chorus", "bridge")
+
+# One row per bar of a compiled song
+BAR_DTYPE = np.dtype(
+    [
+        ("chord", np.int16),  # Index into the plan's chord table
+        ("next_chord", np.int16),  # Chord of the following bar (the last repeats)
+        ("section", np.int16),  # Index into the plan's section labels
+        ("section_type", np.int8),  # Index into SECTION_TYPES
+        ("intensity", np.float64),  # Dynamics level on the downbeat
+        ("bar_in_section", np.int16),
+        ("bar_in_phrase", np.int16),  # Position in the section's progression
+    ]
+)
+
+
+class PlanError(ValueError):
+    """Raised when a song spec cannot be compiled into a plan"""
+
+
+def section_label(section_name, section_type):
+    """Label of a section, e.g. "verse_first" ("bridge" when it has no type)"""
+    return f"{section_name}_{section_type}" if section_type else section_name
+
+
+def spec_problems(sections):
+    """Describe everything wrong with a song spec, without building anything"""
+    if not sum(length for _, _, length, _ in sections if isinstance(length, int)):
+        return ["the song has no bars"]
+
+    problems = []
+    for index, (section_name, chords, length, section_type) in enumerate(sections):
+        where = f"section {index} ({section_label(section_name, section_type)})"
+        if section_name not in SECTION_TYPES:
+            problems.append(f"{where}: unknown section type {section_name!r}")
+        if not isinstance(length, int) or length < 0:
+            problems.append(f"{where}: length {length!r} is not a bar count")
+            continue
+        if not chords:
+            problems.append(f"{where}: empty progression")
+            continue
+        if section_name in WHOLE_PROGRESSION and length % len(chords):
+            problems.append(
+                f"{where}: {length} bars do not fit a whole number of "
+                f"{len(chords)}-chord progressions"
+            )
+
+        for chord in chords:
+            if len(chord) < 3 or not all(
+                isinstance(note, int) and 0 <= note <= 127 for note in chord
+            ):
+                problems.append(f"{where}: {chord!r} is not a triad of MIDI notes")
+            elif not BASS_LOW <= chord[0] - OCTAVES_DOWN <= BASS_HIGH:
+                problems.append(
+                    f"{where}: root {chord[0]} is outside the bass range "
+                    f"{BASS_LOW + OCTAVES_DOWN}-{BASS_HIGH + OCTAVES_DOWN}"
+                )
+    return problems
+
+
+def compile_plan(sections, beats_per_bar=4):
+    """
+    Compile a song spec into a flat schedule with one row per bar.
+
+    The spec is checked as a whole before any row is built, so a malformed
+    song fails here instead of part way through a render.
+
+    Args:
+        sections: (section_name, chords, length, section_type) of every
+            section in order, section_type telling repeats apart ("first",
+            "final") or None
+        beats_per_bar: Length of a bar in beats
+
+    Returns:
+        tuple: (bars, chords, labels) with the bars (BAR_DTYPE), the chord
+            table the bars index into and the label of every section
+
+    Raises:
+        PlanError: Listing every problem of the spec
+    """
+    problems = spec_problems(sections)
+    if problems:
+        raise PlanError("Invalid song spec: " + "; ".join(problems))
+
+    chord_ids = {}
+    blocks = []
+    labels = []
+    for index, (section_name, progression, length, section_type) in enumerate(sections):
+        ids = [
+            chord_ids.setdefault(tuple(chord), len(chord_ids)) for chord in progression
+        ]
+        block = np.zeros(length, dtype=BAR_DTYPE)
+        block["bar_in_section"] = np.arange(length)
+        block["bar_in_phrase"] = block["bar_in_section"] % len(ids)
+        block["chord"] = np.asarray(ids)[block["bar_in_phrase"]]
+        block["section"] = index
+        block["section_type"] = SECTION_TYPES.index(section_name)
+        blocks.append(block)
+        labels.append(section_label(section_name, section_type))
+    chords = list(chord_ids)
+
+    bars = np.concatenate(blocks)
+    bars["next_chord"] = np.append(bars["chord"][1:], bars["chord"][-1])
+    envelope = song_envelope(
+        [(label, len(block)) for label, block in zip(labels, blocks)],
+        beats_per_bar=beats_per_bar,
+    )
+    bars["intensity"] = envelope[::beats_per_bar]
+    return bars, chords, labels
+
+
+def section_spans(bars, labels):
+    """(label, first bar, end bar) of every section of a compiled plan"""
+    ends = np.searchsorted(bars["section"], np.arange(len(labels)), side="right")
+    starts = np.concatenate([[0], ends[:-1]])
+    return list(zip(labels, starts.tolist(), ends.tolist()))
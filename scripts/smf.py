@@ -0,0 +1,322 @@
+import heapq
+import struct
+
+import numpy as np
+
+from events import (
+    CONTROLLER,
+    DRUM_CHANNEL,
+    EVENT_DTYPE,
+    NOTE,
+    PITCH_WHEEL,
+    PROGRAM_CHANGE,
+)
+
+# Data bytes following each channel message status
+DATA_BYTES = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+CONTROL_CHANGE = 0xB0
+PROGRAM = 0xC0
+PITCH_BEND = 0xE0
+META = 0xFF
+
+# Tempo of files without a tempo event
+DEFAULT_TEMPO = 120
+
+# Meta messages the format-0 merge looks at
+END_OF_TRACK = b"\xff\x2f\x00"
+TRACK_NAME = b"\xff\x03"
+TEMPO = b"\xff\x51"
+INSTRUMENT_NAME = b"\xff\x04"
+
+
+def read_vlq(data, pos):
+    """Read a variable-length quantity, returning (value, next position)"""
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, pos
+
+
+def write_vlq(value):
+    """Encode a variable-length quantity"""
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def read_smf(data):
+    """
+    Parse a Standard MIDI File.
+
+    Args:
+        data: The file contents
+
+    Returns:
+        tuple: (format, division, tracks) where every track is a list of
+            (absolute tick, message) with the status byte always present
+            in channel messages, and meta/sysex messages kept as written
+    """
+    if data[:4] != b"MThd":
+        raise ValueError("Not a standard MIDI file")
+    header_length = struct.unpack(">I", data[4:8])[0]
+    file_format, num_tracks, division = struct.unpack(">HHH", data[8:14])
+
+    pos = 8 + header_length
+    tracks = []
+    for _ in range(num_tracks):
+        chunk, length = struct.unpack(">4sI", data[pos : pos + 8])
+        if chunk != b"MTrk":
+            raise ValueError(f"Expected a track chunk, found {chunk!r}")
+        pos += 8
+        end = pos + length
+
+        events = []
+        tick = 0
+        status = None
+        while pos < end:
+            delta, pos = read_vlq(data, pos)
+            tick += delta
+            start = pos
+            byte = data[pos]
+            if byte == META:
+                length, pos = read_vlq(data, pos + 2)
+                pos += length
+            elif byte in (0xF0, 0xF7):
+                length, pos = read_vlq(data, pos + 1)
+                pos += length
+            else:
+                if byte & 0x80:
+                    status = byte
+                    pos += 1
+                elif status is None:
+                    raise ValueError("Running status without a status byte")
+                size = DATA_BYTES[status & 0xF0]
+                events.append((tick, bytes([status]) + data[pos : pos + size]))
+                pos += size
+                continue
+            events.append((tick, data[start:pos]))
+
+        tracks.append(events)
+        pos = end
+    return file_format, division, tracks
+
+
+def encode_track(events, running_status=True):
+    """
+    Serialize one track's (absolute tick, message) list into an MTrk chunk.
+
+    With running_status the status byte is left out when it repeats.
+    Meta and sysex messages cancel running status, as the SMF spec asks.
+    """
+    out = bytearray()
+    tick = 0
+    status = None
+    for event_tick, message in events:
+        out += write_vlq(event_tick - tick)
+        tick = event_tick
+        if message[0] >= 0xF0:
+            out += message
+            status = None
+        elif running_status and message[0] == status and message[1] < 0x80:
+            out += message[1:]
+        else:
+            out += message
+            status = message[0]
+    return b"MTrk" + struct.pack(">I", len(out)) + out
+
+
+def write_smf(file_format, division, tracks, running_status=True):
+    """Serialize tracks from read_smf back into file contents"""
+    header = b"MThd" + struct.pack(">IHHH", 6, file_format, len(tracks), division)
+    return header + b"".join(encode_track(t, running_status) for t in tracks)
+
+
+def compact_events(events):
+    """
+    Drop redundant events from a track and make running status go further.
+
+    Controller and pitch bend messages that are overwritten at the same
+    tick, before any other message, never take effect and are dropped.
+    Note-offs become zero-velocity note-ons, so notes starting and ending
+    share one status byte.
+
+    Returns:
+        tuple: (compacted events, number of dropped events)
+    """
+    kept = []
+    superseded = set()
+    tick = None
+    for event_tick, message in reversed(events):
+        kind = message[0] & 0xF0
+        if event_tick != tick or kind not in (CONTROL_CHANGE, PITCH_BEND):
+            superseded.clear()
+        tick = event_tick
+
+        if kind in (CONTROL_CHANGE, PITCH_BEND):
+            key = message[:2] if kind == CONTROL_CHANGE else message[:1]
+            if key in superseded:
+                continue
+            superseded.add(key)
+        elif kind == NOTE_OFF:
+            message = bytes([NOTE_ON | message[0] & 0x0F, message[1], 0])
+        kept.append((event_tick, message))
+
+    kept.reverse()
+    return kept, len(events) - len(kept)
+
+
+def compact_midi(data):
+    """
+    Re-serialize MIDI file contents with running status and without
+    redundant same-tick events.
+
+    Returns:
+        tuple: (compacted contents, savings) where savings holds
+            original_bytes, compacted_bytes, saved_bytes and dropped_events
+    """
+    file_format, division, tracks = read_smf(data)
+    dropped = 0
+    compacted_tracks = []
+    for events in tracks:
+        events, count = compact_events(events)
+        compacted_tracks.append(events)
+        dropped += count
+
+    compacted = write_smf(file_format, division, compacted_tracks)
+    return compacted, {
+        "original_bytes": len(data),
+        "compacted_bytes": len(compacted),
+        "saved_bytes": len(data) - len(compacted),
+        "dropped_events": dropped,
+    }
+
+
+def merge_tracks(tracks):
+    """
+    Merge the tracks of a multi-track file into one format-0 track.
+
+    The tracks are already sorted by tick, so they are merged with a k-way
+    heap merge that keeps the file's order for events on the same tick.
+    Every (track, channel) pair gets its own channel, in order of first
+    use, while drums stay on channel 9. Tempo events that do not change
+    the tempo (every track sets it up) are dropped, other meta events
+    repeated at the same tick are kept once, track names become
+    instrument names and a single end-of-track closes the merge.
+
+    Returns:
+        list: The merged (absolute tick, message) events
+    """
+    channels = {}
+    free = [channel for channel in range(16) if channel != DRUM_CHANNEL]
+
+    def remap(track, message):
+        channel = message[0] & 0x0F
+        if channel == DRUM_CHANNEL:
+            return message
+        if (track, channel) not in channels:
+            if not free:
+                raise ValueError("More than 15 melodic channels in use")
+            channels[track, channel] = free.pop(0)
+        return bytes([message[0] & 0xF0 | channels[track, channel]]) + message[1:]
+
+    streams = [
+        [(tick, track, message) for tick, message in events]
+        for track, events in enumerate(tracks)
+    ]
+    merged = []
+    seen_meta = set()
+    tempo = None
+    last_tick = 0
+    for tick, track, message in heapq.merge(*streams, key=lambda event: event[0]):
+        last_tick = tick
+        if message[0] < 0xF0:
+            merged.append((tick, remap(track, message)))
+            continue
+        if message[:2] == END_OF_TRACK[:2]:
+            continue
+        if message[:2] == TRACK_NAME:
+            message = INSTRUMENT_NAME + message[2:]
+        if message[:2] == TEMPO:
+            # Only tempo changes are kept, whichever track they came from
+            if message == tempo:
+                continue
+            tempo = message
+        elif (tick, message) in seen_meta:
+            continue
+        seen_meta.add((tick, message))
+        merged.append((tick, message))
+
+    merged.append((last_tick, END_OF_TRACK))
+    return merged
+
+
+def to_format0(data):
+    """Convert MIDI file contents to a single-track format-0 file"""
+    _, division, tracks = read_smf(data)
+    return write_smf(0, division, [merge_tracks(tracks)])
+
+
+def load_midi(source):
+    """
+    Read a MIDI file (or MIDI file contents, e.g. from a SongArchive) back
+    into an event block.
+
+    Tracks keep their number in the file, so in MIDIUtil's format-1 files
+    the tempo track is 0 and the generators' tracks start at 1. Pitch wheel
+    values come back as they were passed to addPitchWheelEvent (MIDIUtil
+    adds 8192 when writing), so the generators' 8192 is the wheel at rest.
+
+    Args:
+        source: Path of the MIDI file, or its contents as bytes
+
+    Returns:
+        tuple: (events, tempo) with the events (EVENT_DTYPE) in beats and
+            ordered like the file, and the first tempo in BPM
+    """
+    if isinstance(source, (bytes, bytearray)):
+        data = source
+    else:
+        with open(source, "rb") as midi_file:
+            data = midi_file.read()
+    _, division, tracks = read_smf(data)
+
+    rows = []
+    tempo = None
+    for track, events in enumerate(tracks):
+        sounding = {}
+        for tick, message in events:
+            time = tick / division
+            status = message[0] & 0xF0
+            channel = message[0] & 0x0F
+            if message[:2] == TEMPO and tempo is None:
+                tempo = 60_000_000 / int.from_bytes(message[3:6], "big")
+            elif status in (NOTE_ON, NOTE_OFF):
+                # A note ends at its note-off or when its key is struck
+                # again, MIDIUtil drops the note-off of overlapping notes
+                row = sounding.pop((channel, message[1]), None)
+                if row:
+                    row[4] = time - row[3]
+                if status == NOTE_ON and message[2]:
+                    # The duration is filled in when the note ends
+                    row = [NOTE, track, channel, time, 0.0, message[1], message[2]]
+                    sounding[channel, message[1]] = row
+                    rows.append(row)
+            elif status == CONTROL_CHANGE:
+                rows.append([CONTROLLER, track, channel, time, 0.0, *message[1:]])
+            elif status == PITCH_BEND:
+                value = (message[2] << 7 | message[1]) - 8192
+                rows.append([PITCH_WHEEL, track, channel, time, 0.0, 0, value])
+            elif status == PROGRAM:
+                rows.append([PROGRAM_CHANGE, track, channel, time, 0.0, message[1], 0])
+
+    events = np.array([tuple(row) for row in rows], dtype=EVENT_DTYPE)
+    return events, tempo or DEFAULT_TEMPO
@@ -0,0 +1,146 @@
+import json
+import os
+
+from library import DansebandSong
+from plan import SECTION_TYPES
+from utils import spec_hash
+
+# Keys of a song spec. Only progressions (with a "base" progression) is
+# required, the rest default to DansebandSong's settings.
+SPEC_KEYS = (
+    "name",
+    "tempo",
+    "structure",
+    "progressions",
+    "humanize_seed",
+    "compact",
+    "single_track",
+)
+
+# File name of a song whose spec has no name
+DEFAULT_NAME = "danseband_song.mid"
+
+# Slowest tempo a MIDI file can store (a 24-bit number of microseconds per beat)
+MIN_TEMPO = 4
+
+
+class SpecError(ValueError):
+    """Raised when a song spec file cannot be read"""
+
+
+def read_spec(path):
+    """
+    Read a song spec from a JSON file, e.g.
+
+        {
+            "name": "my_song.mid",
+            "tempo": 116,
+            "structure": {"verse": 8, "chorus": 8},
+            "progressions": {
+                "base": [[61, 65, 68], [58, 61, 65], [66, 70, 73], [68, 72, 75]],
+                "bridge": [[56, 60, 63], [61, 65, 68]]
+            }
+        }
+
+    Whether the chords and structure make a song is checked when the song
+    is compiled (see plan.compile_plan).
+
+    Returns:
+        dict: The spec
+
+    Raises:
+        SpecError: When the file is not a JSON object with known keys,
+            values of the right types, sections with whole numbers of bars
+            and progressions (lists of chords) including "base"
+    """
+    try:
+        with open(path) as spec_file:
+            spec = json.load(spec_file)
+    except json.JSONDecodeError as error:
+        raise SpecError(f"{path}: {error}") from error
+
+    if not isinstance(spec, dict):
+        raise SpecError(f"{path}: a song spec is a JSON object")
+    unknown = sorted(set(spec) - set(SPEC_KEYS))
+    if unknown:
+        raise SpecError(f"{path}: unknown keys {', '.join(unknown)}")
+    name = spec.get("name", DEFAULT_NAME)
+    # Songs are saved under their name in the generated directory
+    if (
+        not isinstance(name, str)
+        or name in ("", ".", "..")
+        or os.path.basename(name) != name
+    ):
+        raise SpecError(f"{path}: name must be a file name without a directory")
+    tempo = spec.get("tempo", MIN_TEMPO)
+    if (
+        not isinstance(tempo, (int, float))
+        or isinstance(tempo, bool)
+        or tempo < MIN_TEMPO
+    ):
+        raise SpecError(
+            f"{path}: tempo must be a number of beats per minute of at least {MIN_TEMPO}"
+        )
+    seed = spec.get("humanize_seed")
+    if seed is not None and not _is_int(seed):
+        raise SpecError(f"{path}: humanize_seed must be a whole number or null")
+    for key in ("compact", "single_track"):
+        if not isinstance(spec.get(key, False), bool):
+            raise SpecError(f"{path}: {key} must be true or false")
+
+    structure = spec.get("structure", {})
+    if not isinstance(structure, dict):
+        raise SpecError(f"{path}: structure maps sections to their bars")
+    unknown = sorted(set(structure) - set(SECTION_TYPES))
+    if unknown:
+        raise SpecError(f"{path}: unknown sections {', '.join(unknown)}")
+    for name, length in structure.items():
+        if not _is_int(length) or length < 0:
+            raise SpecError(f"{path}: section {name} needs a whole number of bars")
+
+    progressions = spec.get("progressions")
+    if not isinstance(progressions, dict) or "base" not in progressions:
+        raise SpecError(f"{path}: progressions need a base progression")
+    for name, chords in progressions.items():
+        if not isinstance(chords, list) or not all(
+            isinstance(chord, list) and all(_is_int(note) for note in chord)
+            for chord in chords
+        ):
+            raise SpecError(
+                f"{path}: progression {name} is not a list of chords (lists of notes)"
+            )
+    return spec
+
+
+def _is_int(value):
+    # JSON true and false load as bools, which are ints to Python
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def song_from_spec(spec, previous=None):
+    """
+    Set up a song from a spec.
+
+    Args:
+        spec: Spec from read_spec
+        previous: Song rendered from an earlier version of the spec, whose
+            rendered sections are reused where they did not change
+
+    Returns:
+        tuple: (song, progressions) ready for song.generate_song(progressions)
+    """
+    song = DansebandSong(spec.get("name", DEFAULT_NAME))
+    song.tempo = spec.get("tempo", song.tempo)
+    song.set_structure(spec.get("structure", {}))
+    song.humanize_seed = spec.get("humanize_seed", song.humanize_seed)
+    song.compact = spec.get("compact", song.compact)
+    song.single_track = spec.get("single_track", song.single_track)
+    song.spec = spec
+    if previous is not None:
+        song.section_cache = previous.section_cache
+
+    progressions = {
+        name: [tuple(chord) for chord in chords]
+        for name, chords in spec["progressions"].items()
+    }
+    return song, progressions
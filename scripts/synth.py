@@ -0,0 +1,733 @@
+import os
+import struct
+import sys
+import time
+from functools import lru_cache
+from itertools import islice
+from multiprocessing import Pipe, Process, shared_memory
+
+import numpy as np
+
+from events import CONTROLLER, DRUM_CHANNEL, NOTE, PITCH_WHEEL, PROGRAM_CHANGE
+from smf import load_midi
+
+SAMPLE_RATE = 44100
+
+# Samples in one cycle of a voice's wavetable
+TABLE_SIZE = 2048
+
+# Controllers the synth follows
+MODULATION = 1
+VOLUME = 7
+PAN = 10
+EXPRESSION = 11
+
+# Controller values before a channel sets them
+CONTROLLER_DEFAULTS = {MODULATION: 0, VOLUME: 100, PAN: 64, EXPRESSION: 127}
+
+# The generators write 8192 as the wheel at rest, a full bend is 2 semitones
+PITCH_CENTRE = 8192
+BEND_RANGE = 2
+
+# Mod wheel vibrato, rate in Hz and depth in semitones with CC1 at 127
+VIBRATO_RATE = 5.5
+VIBRATO_DEPTH = 0.5
+
+# Headroom for every track playing together
+MASTER_GAIN = 0.25
+
+# Samples rendered at a time, audio memory stays at a block plus the notes
+# sounding in it whatever the length of the song
+BLOCK_FRAMES = 8192
+
+# Frames of every track render_mixdown holds at once (about 6 seconds), a
+# whole number of blocks
+WINDOW_FRAMES = 32 * BLOCK_FRAMES
+
+# One row per note of a render plan, positions in samples
+NOTE_DTYPE = np.dtype(
+    [
+        ("start", np.int64),
+        ("held", np.int64),  # Until the note is released
+        ("end", np.int64),  # After the release or drum decay
+        ("pitch", np.int16),
+        ("velocity", np.int16),
+        ("channel", np.int32),  # Index into the plan's channels
+    ]
+)
+
+# Additive voices: harmonic amplitudes of the wavetable and an ADSR envelope
+# in seconds (sustain is a level). Voices with a detune play a second
+# oscillator that many cents sharp, like the musette reeds of an accordion.
+VOICES = {
+    "piano": {
+        "harmonics": (1, 0.5, 0.3, 0.2, 0.1, 0.05),
+        "attack": 0.005,
+        "decay": 1.5,
+        "sustain": 0.0,
+        "release": 0.2,
+    },
+    "accordion": {
+        "harmonics": (1, 0.8, 0.6, 0.5, 0.4, 0.3, 0.2, 0.15),
+        "attack": 0.03,
+        "decay": 0.1,
+        "sustain": 0.85,
+        "release": 0.08,
+        "detune": 12,
+    },
+    "guitar": {
+        "harmonics": (1, 0.6, 0.45, 0.3, 0.2, 0.15, 0.1, 0.05),
+        "attack": 0.003,
+        "decay": 0.8,
+        "sustain": 0.0,
+        "release": 0.1,
+    },
+    "bass": {
+        "harmonics": (1, 0.5, 0.25, 0.12, 0.06),
+        "attack": 0.005,
+        "decay": 0.6,
+        "sustain": 0.4,
+        "release": 0.08,
+    },
+    "voice": {
+        "harmonics": (1, 0.35, 0.15, 0.08, 0.04),
+        "attack": 0.08,
+        "decay": 0.2,
+        "sustain": 0.8,
+        "release": 0.2,
+    },
+    "reed": {
+        "harmonics": (1, 0.9, 0.7, 0.55, 0.45, 0.35, 0.25, 0.2, 0.15, 0.1),
+        "attack": 0.04,
+        "decay": 0.1,
+        "sustain": 0.8,
+        "release": 0.1,
+    },
+    "lead": {
+        "harmonics": tuple(1 / k for k in range(1, 13)),
+        "attack": 0.01,
+        "decay": 0.2,
+        "sustain": 0.7,
+        "release": 0.15,
+    },
+    "pad": {
+        "harmonics": (1, 0.2, 0.1, 0.05),
+        "attack": 0.3,
+        "decay": 0.5,
+        "sustain": 0.8,
+        "release": 0.6,
+        "detune": 8,
+    },
+}
+
+# Voice of every General MIDI family (program // 8), so the accordions (21,
+# 22) play the organ family's voice and the saxes (64-67) the reeds
+FAMILY_VOICES = {
+    0: "piano",
+    1: "piano",
+    2: "accordion",
+    3: "guitar",
+    4: "bass",
+    5: "pad",
+    6: "voice",
+    7: "reed",
+    8: "reed",
+    9: "reed",
+    10: "lead",
+    11: "pad",
+}
+
+# Drum sounds by General MIDI note: a sine sweeping from one frequency down
+# to another, noise mixed in (high-passed for cymbals) and a decay time
+DRUMS = {
+    35: {"sweep": (120, 40), "noise": 0.0, "decay": 0.3, "bright": False},
+    36: {"sweep": (150, 45), "noise": 0.05, "decay": 0.25, "bright": False},
+    37: {"sweep": (800, 700), "noise": 0.5, "decay": 0.03, "bright": True},
+    38: {"sweep": (220, 180), "noise": 0.6, "decay": 0.15, "bright": False},
+    39: {"sweep": (0, 0), "noise": 1.0, "decay": 0.1, "bright": False},
+    40: {"sweep": (250, 200), "noise": 0.7, "decay": 0.12, "bright": True},
+    42: {"sweep": (0, 0), "noise": 1.0, "decay": 0.05, "bright": True},
+    44: {"sweep": (0, 0), "noise": 1.0, "decay": 0.04, "bright": True},
+    45: {"sweep": (110, 80), "noise": 0.1, "decay": 0.3, "bright": False},
+    46: {"sweep": (0, 0), "noise": 1.0, "decay": 0.3, "bright": True},
+    47: {"sweep": (150, 110), "noise": 0.1, "decay": 0.25, "bright": False},
+    48: {"sweep": (180, 140), "noise": 0.1, "decay": 0.22, "bright": False},
+    49: {"sweep": (0, 0), "noise": 1.0, "decay": 1.2, "bright": True},
+    50: {"sweep": (210, 160), "noise": 0.1, "decay": 0.2, "bright": False},
+    51: {"sweep": (3000, 3000), "noise": 0.6, "decay": 0.8, "bright": True},
+    57: {"sweep": (0, 0), "noise": 1.0, "decay": 1.0, "bright": True},
+}
+DEFAULT_DRUM = {"sweep": (0, 0), "noise": 1.0, "decay": 0.1, "bright": False}
+
+
+def program_voice(program):
+    """Voice for a General MIDI program"""
+    return FAMILY_VOICES.get(program // 8, "piano")
+
+
+@lru_cache(maxsize=None)
+def wavetable(voice):
+    """
+    One cycle of a voice, with the first sample repeated at the end so
+    lookups can interpolate past the last sample without wrapping.
+    """
+    phase = 2 * np.pi * np.arange(TABLE_SIZE + 1) / TABLE_SIZE
+    table = sum(
+        amplitude * np.sin(harmonic * phase)
+        for harmonic, amplitude in enumerate(VOICES[voice]["harmonics"], start=1)
+    )
+    return table / np.abs(table).max()
+
+
+@lru_cache(maxsize=None)
+def drum_hit(note, sample_rate=SAMPLE_RATE):
+    """The sound of one drum note at full velocity"""
+    spec = DRUMS.get(note, DEFAULT_DRUM)
+    t = np.arange(int(spec["decay"] * 5 * sample_rate)) / sample_rate
+    sound = np.zeros(len(t))
+
+    start, end = spec["sweep"]
+    if start:
+        # The sweep settles on the lower pitch within ~50ms
+        frequency = end + (start - end) * np.exp(-t / 0.05)
+        phase = 2 * np.pi * np.cumsum(frequency) / sample_rate
+        sound += (1 - spec["noise"]) * np.sin(phase)
+    if spec["noise"]:
+        noise = np.random.default_rng(note).uniform(-1, 1, len(t))
+        if spec["bright"]:
+            noise = np.diff(noise, prepend=0) / 2
+        sound += spec["noise"] * noise
+    return sound * np.exp(-t / spec["decay"])
+
+
+def control_curves(events, seconds_per_beat, sample_rate):
+    """
+    Step curves of the controllers and pitch wheel of one channel.
+
+    Returns:
+        dict: (sample positions, values) per controller number, plus
+            "pitch" for the wheel, each starting with the default value
+    """
+    order = np.argsort(events["time"], kind="stable")
+    events = events[order]
+    positions = np.rint(events["time"] * seconds_per_beat * sample_rate)
+
+    def curve(rows, default):
+        return (
+            np.concatenate([[-1], positions[rows]]),
+            np.concatenate([[default], events["data2"][rows]]),
+        )
+
+    controllers = events["kind"] == CONTROLLER
+    curves = {
+        number: curve(controllers & (events["data1"] == number), default)
+        for number, default in CONTROLLER_DEFAULTS.items()
+    }
+    curves["pitch"] = curve(events["kind"] == PITCH_WHEEL, PITCH_CENTRE)
+    return curves
+
+
+def curve_values(curve, start, length):
+    """
+    Values of a step curve over length samples from start, as a scalar
+    when it does not move in that span.
+    """
+    positions, values = curve
+    first, last = np.searchsorted(positions, [start, start + length - 1], "right") - 1
+    if first == last:
+        return values[first]
+    index = np.searchsorted(positions, np.arange(start, start + length), "right") - 1
+    return values[index]
+
+
+def oscillator(table, phase):
+    """Look up a wavetable at phases in cycles, interpolating between samples"""
+    position = (phase % 1.0) * TABLE_SIZE
+    index = position.astype(np.int64)
+    fraction = position - index
+    return table[index] * (1 - fraction) + table[index + 1] * fraction
+
+
+def envelope(voice, held, offset, length, sample_rate):
+    """ADSR levels of length samples from offset into a note held for held"""
+    spec = VOICES[voice]
+    t = np.arange(offset, offset + length) / sample_rate
+    points = [0, spec["attack"], spec["attack"] + spec["decay"]]
+    levels = [0, 1, spec["sustain"]]
+    level = np.interp(t, points, levels)
+
+    end = held / sample_rate
+    released = t >= end
+    level[released] = np.interp(end, points, levels) * np.maximum(
+        1 - (t[released] - end) / spec["release"], 0
+    )
+    return level
+
+
+def render_note(voice, pitch, start, held, curves, sample_rate, offset, length, phase):
+    """
+    Render part of a pitched note, following the pitch wheel and mod wheel.
+
+    Args:
+        voice: Key of VOICES
+        pitch: MIDI note
+        start: First sample of the note
+        held: Samples until the note is released
+        curves: The channel's control_curves
+        sample_rate: Samples per second
+        offset: First sample of the part, counted from the note start
+        length: Samples in the part
+        phase: Oscillator phase (in cycles) the part starts at
+
+    Returns:
+        tuple: (samples at full level, oscillator phase after the part)
+    """
+    spec = VOICES[voice]
+    first = start + offset
+
+    bend = curve_values(curves["pitch"], first, length) - PITCH_CENTRE
+    semitones = pitch - 69 + bend / 8192 * BEND_RANGE
+    depth = curve_values(curves[MODULATION], first, length)
+    if np.any(depth):
+        lfo = np.sin(
+            2 * np.pi * VIBRATO_RATE * np.arange(first, first + length) / sample_rate
+        )
+        semitones = semitones + depth / 127 * VIBRATO_DEPTH * lfo
+
+    step = 440 * 2 ** (semitones / 12) / sample_rate
+    if np.ndim(step):
+        phases = phase + np.concatenate([[0], np.cumsum(step[:-1])])
+        next_phase = phases[-1] + step[-1]
+    else:
+        phases = phase + np.arange(length) * step
+        next_phase = phase + length * step
+
+    table = wavetable(voice)
+    sound = oscillator(table, phases)
+    if spec.get("detune"):
+        sound = (sound + oscillator(table, phases * 2 ** (spec["detune"] / 1200))) / 2
+    return sound * envelope(voice, held, offset, length, sample_rate), next_phase
+
+
+def plan_audio(events, tempo, sample_rate=SAMPLE_RATE):
+    """
+    Work out what a render plays, without rendering any audio.
+
+    Args:
+        events: Event block (EVENT_DTYPE), e.g. from render_block or load_midi
+        tempo: Tempo in BPM
+        sample_rate: Samples per second
+
+    Returns:
+        tuple: (channels, notes, frames) with a (voice, control_curves) per
+            (track, channel), voice None on the drum channel, the notes
+            (NOTE_DTYPE) ordered by start and the length of the render
+    """
+    seconds_per_beat = 60 / tempo
+    channels = []
+    blocks = []
+    keys = np.unique(events["track"].astype(np.int64) * 16 + events["channel"])
+    for index, (track, channel) in enumerate(zip(*np.divmod(keys, 16))):
+        block = events[(events["track"] == track) & (events["channel"] == channel)]
+        curves = control_curves(block, seconds_per_beat, sample_rate)
+        programs = block["data1"][block["kind"] == PROGRAM_CHANGE]
+        voice = program_voice(programs[0] if len(programs) else 0)
+        if channel == DRUM_CHANNEL:
+            voice = None
+        channels.append((voice, curves))
+
+        block = block[block["kind"] == NOTE]
+        notes = np.zeros(len(block), dtype=NOTE_DTYPE)
+        notes["start"] = np.rint(block["time"] * seconds_per_beat * sample_rate)
+        notes["held"] = np.maximum(
+            np.rint(block["duration"] * seconds_per_beat * sample_rate), 1
+        )
+        notes["pitch"] = block["data1"]
+        notes["velocity"] = block["data2"]
+        notes["channel"] = index
+        if voice is None:
+            tails = [len(drum_hit(pitch, sample_rate)) for pitch in block["data1"]]
+            notes["end"] = notes["start"] + tails
+        else:
+            release = int(VOICES[voice]["release"] * sample_rate)
+            notes["end"] = notes["start"] + notes["held"] + release
+        blocks.append(notes)
+
+    notes = np.concatenate(blocks) if blocks else np.zeros(0, dtype=NOTE_DTYPE)
+    notes = notes[np.argsort(notes["start"], kind="stable")]
+    frames = int(notes["end"].max()) if len(notes) else 0
+    return channels, notes, frames
+
+
+def volume_gain(value):
+    """Gain of a volume or expression value, the usual squared (40 log) law"""
+    return (value / 127) ** 2
+
+
+def pan_gains(pan):
+    """Constant-power (left, right) gains of a CC10 pan position"""
+    angle = pan / 127 * np.pi / 2
+    return np.cos(angle), np.sin(angle)
+
+
+def stream_audio(plan, sample_rate=SAMPLE_RATE, block_frames=BLOCK_FRAMES, dry=False):
+    """
+    Render a plan block by block.
+
+    Only the notes sounding in a block are rendered into it, and notes
+    ringing on into the next block keep their oscillator phase, so the
+    blocks join up into the same audio as one long render.
+
+    Every (track, channel) plays the voice of its program (drums on channel
+    9), follows its volume (CC7), expression (CC11), mod wheel (CC1) and
+    pitch wheel curves, and is panned by CC10.
+
+    Args:
+        plan: The result of plan_audio
+        sample_rate: Samples per second
+        block_frames: Frames in every block but the last
+        dry: Leave out volume (CC7) and pan (CC10) and render mono, for
+            stems that get placed in a mix afterwards
+
+    Yields:
+        numpy.ndarray: float32 samples, shape (frames, 2) or (frames,) dry
+    """
+    channels, notes, frames = plan
+    columns = [notes[name].tolist() for name in NOTE_DTYPE.names]
+    starts, helds, ends, pitches, velocities, indices = columns
+
+    sounding = []  # [note, oscillator phase]
+    upcoming = 0
+    for block_start in range(0, frames, block_frames):
+        block_end = min(block_start + block_frames, frames)
+        out = np.zeros((block_end - block_start, *(() if dry else (2,))), np.float32)
+        while upcoming < len(starts) and starts[upcoming] < block_end:
+            sounding.append([upcoming, 0.0])
+            upcoming += 1
+
+        for entry in sounding:
+            note, phase = entry
+            start = starts[note]
+            voice, curves = channels[indices[note]]
+            offset = max(block_start - start, 0)
+            length = min(ends[note], block_end) - start - offset
+            if voice is None:
+                sound = drum_hit(pitches[note], sample_rate)[offset : offset + length]
+            else:
+                sound, entry[1] = render_note(
+                    voice,
+                    pitches[note],
+                    start,
+                    helds[note],
+                    curves,
+                    sample_rate,
+                    offset,
+                    length,
+                    phase,
+                )
+
+            first = start + offset
+            gain = (
+                velocities[note]
+                / 127
+                * volume_gain(curve_values(curves[EXPRESSION], first, length))
+            )
+            first -= block_start
+            if dry:
+                out[first : first + length] += sound * gain
+                continue
+
+            gain = gain * volume_gain(
+                curve_values(curves[VOLUME], start + offset, length)
+            )
+            left, right = pan_gains(curve_values(curves[PAN], start, 1))
+            out[first : first + length, 0] += sound * gain * left
+            out[first : first + length, 1] += sound * gain * right
+
+        sounding = [entry for entry in sounding if ends[entry[0]] > block_end]
+        yield out * MASTER_GAIN
+
+
+def render_audio(events, tempo, sample_rate=SAMPLE_RATE):
+    """
+    Render an event block to stereo audio in one array.
+
+    Returns:
+        numpy.ndarray: float32 samples, shape (frames, 2)
+    """
+    plan = plan_audio(events, tempo, sample_rate)
+    blocks = list(stream_audio(plan, sample_rate))
+    return np.concatenate(blocks) if blocks else np.zeros((0, 2), dtype=np.float32)
+
+
+def wav_header(frames, sample_rate=SAMPLE_RATE):
+    """Header of a 16-bit stereo WAV file with frames of audio"""
+    data_bytes = frames * 4
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_bytes,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        2,  # Channels
+        sample_rate,
+        sample_rate * 4,  # Bytes per second
+        4,  # Bytes per frame
+        16,  # Bits per sample
+        b"data",
+        data_bytes,
+    )
+
+
+def wav_samples(block):
+    """16-bit samples of a float audio block, clipped at full scale"""
+    return np.rint(np.clip(block, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def write_wav(target, blocks, frames, sample_rate=SAMPLE_RATE):
+    """
+    Write stereo float audio as a 16-bit WAV file, clipping at full scale.
+
+    The header is written up front from the frame count and every block is
+    written as it arrives, so the target can be a pipe to an encoder that
+    starts working while the song is still rendering.
+
+    Args:
+        target: Path or binary file object
+        blocks: Iterable of float audio blocks, shape (frames, 2)
+        frames: Total frames in the blocks
+        sample_rate: Samples per second
+    """
+    wav_file = open(target, "wb") if isinstance(target, str) else target
+    try:
+        wav_file.write(wav_header(frames, sample_rate))
+        for block in blocks:
+            wav_file.write(wav_samples(block))
+    finally:
+        if wav_file is not target:
+            wav_file.close()
+
+
+def render_stems(connection, name, count, tasks, tempo, sample_rate):
+    """
+    Render tracks dry into their rows of a shared window buffer, one window
+    at a time.
+
+    Every message on connection asks for the next window. The worker fills
+    its rows (with silence after a track ends) and answers None, or the
+    exception that stopped it. It stops at a None message.
+
+    Args:
+        connection: This worker's end of a pipe to render_mixdown
+        name: Name of the shared (count, WINDOW_FRAMES) float32 buffer
+        count: Rows in the buffer
+        tasks: (row, track events) of every track this worker renders
+        tempo: Tempo in BPM
+        sample_rate: Samples per second
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    window = np.ndarray((count, WINDOW_FRAMES), dtype=np.float32, buffer=memory.buf)
+    streams = None
+    try:
+        while True:
+            try:
+                if connection.recv() is None:
+                    break
+            except EOFError:
+                break
+            if streams is None:
+                # Planned on the first request, so a failure is its answer
+                plans = [plan_audio(events, tempo, sample_rate) for _, events in tasks]
+                streams = [
+                    (row, stream_audio(plan, sample_rate, dry=True))
+                    for (row, _), plan in zip(tasks, plans)
+                ]
+            for row, stream in streams:
+                window[row] = 0
+                position = 0
+                # Windows start on block boundaries, so a window is a whole
+                # number of the stream's blocks
+                for block in islice(stream, WINDOW_FRAMES // BLOCK_FRAMES):
+                    window[row, position : position + len(block)] = block
+                    position += len(block)
+            connection.send(None)
+    except Exception as error:
+        connection.send(error)
+    finally:
+        # The buffer can only be closed once no array points into it
+        del window
+        memory.close()
+
+
+def mix_blocks(stems, weights, block_frames=BLOCK_FRAMES):
+    """Mix mono stems (stems, frames) into stereo blocks with (stems, 2) weights"""
+    for block_start in range(0, stems.shape[1], block_frames):
+        yield stems[:, block_start : block_start + block_frames].T @ weights
+
+
+def render_mixdown(
+    events,
+    tempo,
+    volumes,
+    pans,
+    wav_path,
+    stem_paths=None,
+    workers=None,
+    sample_rate=SAMPLE_RATE,
+):
+    """
+    Render the tracks in worker processes and mix them down.
+
+    The workers render their tracks dry straight into a shared buffer of
+    WINDOW_FRAMES per track, so no audio is pickled back and memory does
+    not grow with the song. Every window is mixed and written before the
+    workers render the next one into the same buffer. The mix places every
+    stem with the volume and pan tables instead of the tracks' CC7 and CC10.
+
+    Args:
+        events: Event block (EVENT_DTYPE) of the whole song, with the
+            program changes that pick every track's voice
+        tempo: Tempo in BPM
+        volumes: CC7-style volume (0-127) of every track number
+        pans: CC10-style pan position (0-127, 64 is centre) of every track
+        wav_path: Where the stereo mix is written
+        stem_paths: Where every track's stem is written (a path per track
+            number, placed like in the mix), None skips the stems
+        workers: Maximum number of worker processes (None uses every core),
+            each rendering one or more whole tracks
+        sample_rate: Samples per second
+
+    Returns:
+        int: Frames in the mix
+    """
+    tracks = np.unique(events["track"][events["kind"] == NOTE]).tolist()
+    frames = plan_audio(events, tempo, sample_rate)[2]
+    weights = np.array(
+        [
+            np.multiply(pan_gains(pans[track]), volume_gain(volumes[track]))
+            for track in tracks
+        ],
+        dtype=np.float32,
+    ).reshape(len(tracks), 2)
+    outputs = [(wav_path, slice(None))] + [
+        (stem_paths[track], slice(row, row + 1))
+        for row, track in enumerate(tracks)
+        if stem_paths and track in stem_paths
+    ]
+
+    memory = shared_memory.SharedMemory(
+        create=True, size=max(len(tracks) * WINDOW_FRAMES * 4, 1)
+    )
+    connections = []
+    processes = []
+    wav_files = []
+    window = None
+    try:
+        count = min(workers or os.cpu_count(), len(tracks))
+        for worker in range(count):
+            connection, worker_connection = Pipe()
+            tasks = [
+                (row, events[events["track"] == track])
+                for row, track in enumerate(tracks)
+                if row % count == worker
+            ]
+            process = Process(
+                target=render_stems,
+                args=(
+                    worker_connection,
+                    memory.name,
+                    len(tracks),
+                    tasks,
+                    tempo,
+                    sample_rate,
+                ),
+            )
+            process.start()
+            worker_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        for path, rows in outputs:
+            wav_files.append((open(path, "wb"), rows))
+            wav_files[-1][0].write(wav_header(frames, sample_rate))
+
+        window = np.ndarray(
+            (len(tracks), WINDOW_FRAMES), dtype=np.float32, buffer=memory.buf
+        )
+        for window_start in range(0, frames, WINDOW_FRAMES):
+            length = min(WINDOW_FRAMES, frames - window_start)
+            for connection in connections:
+                connection.send(window_start)
+            for connection in connections:
+                error = connection.recv()
+                if error is not None:
+                    raise error
+            for wav_file, rows in wav_files:
+                for block in mix_blocks(window[rows, :length], weights[rows]):
+                    wav_file.write(wav_samples(block))
+    finally:
+        for wav_file, _ in wav_files:
+            wav_file.close()
+        # Forked workers share each other's pipes, so closing them is not
+        # enough to stop the workers
+        for connection in connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass  # The worker is gone already
+            connection.close()
+        for process in processes:
+            process.join()
+        # The buffer can only be closed once no array points into it
+        del window
+        memory.close()
+        memory.unlink()
+    return frames
+
+
+def render_midi(path, wav_path=None, sample_rate=SAMPLE_RATE):
+    """
+    Render a MIDI file to a WAV file, streaming it block by block.
+
+    Args:
+        path: The MIDI file ("-" reads it from standard input)
+        wav_path: Where to write (defaults to next to the MIDI file, "-" is
+            standard output)
+        sample_rate: Samples per second
+
+    Returns:
+        tuple: (path of the WAV file, frames written)
+    """
+    if path == "-":
+        wav_path = wav_path or "-"
+        path = sys.stdin.buffer.read()
+    wav_path = wav_path or os.path.splitext(path)[0] + ".wav"
+    events, tempo = load_midi(path)
+    plan = plan_audio(events, tempo, sample_rate)
+    target = sys.stdout.buffer if wav_path == "-" else wav_path
+    write_wav(target, stream_audio(plan, sample_rate), plan[2], sample_rate)
+    return wav_path, plan[2]
+
+
+if __name__ == "__main__":
+    # synth.py song.mid [...] writes a WAV next to every file, while
+    # synth.py song.mid - streams one song to standard output (and
+    # synth.py - - reads it from standard input)
+    arguments = sys.argv[1:]
+    if arguments[-1:] == ["-"]:
+        renders = [(arguments[0], "-")]
+    else:
+        renders = [(midi_path, None) for midi_path in arguments]
+
+    for midi_path, wav_path in renders:
+        started = time.perf_counter()
+        wav_path, frames = render_midi(midi_path, wav_path)
+        elapsed = time.perf_counter() - started
+        seconds = frames / SAMPLE_RATE
+        print(
+            f"{wav_path}: {seconds:.1f}s of audio in {elapsed:.1f}s "
+            f"({seconds / elapsed:.1f}x real time)",
+            file=sys.stderr,
+        )
@@ -1,6 +1,21 @@
+import atexit
+import hashlib
+import io
+import json
 import os
+import queue
 import random
+import sys
+import threading
 import time
+from functools import partial
+
+from metrics import timed
+from smf import compact_midi, to_format0
+
+# When this environment variable names a directory, save_midi_file writes
+# there under the plain file name (the build runner collects outputs so)
+BUILD_DIR_VARIABLE = "DANSBAND_BUILD_DIR"
 
 
 def get_unique_timestamp():
@@ -8,6 +23,11 @@ def get_unique_timestamp():
     return f"{int(time.time())}_{random.randint(1000, 9999)}"
 
 
+def spec_hash(spec):
+    """Hash of a song spec that does not depend on its key order or formatting"""
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
 def get_generated_path(filename):
     """
     Get the absolute path to the generated directory and ensure it exists.
@@ -35,19 +55,185 @@ def get_generated_path(filename):
     return os.path.join(generated_dir, filename)
 
 
+def write_atomic(path, data):
+    """
+    Write a file through a temporary file in the same directory, renamed
+    over path once complete, so readers (and a crash) never see half a file.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    # Unique per process and thread, created with the usual permissions
+    temporary = os.path.join(
+        directory, f".{name}.{os.getpid()}.{threading.get_ident()}.partial"
+    )
+    descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        with os.fdopen(descriptor, "wb") as temporary_file:
+            temporary_file.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+
+
+class BackgroundWriter:
+    """
+    Writes files (atomically) on a background thread, so rendering goes on
+    while earlier renders are written.
+
+    At most max_pending files wait to be written; write() blocks when the
+    queue is full, which keeps memory bounded when the disk falls behind.
+    The first failed write is raised from the next write() or close().
+
+    Whoever creates the writer owns it and should close() it (or use it as
+    a context manager) once the last file is queued. A writer still open
+    when the interpreter exits is closed then, so queued files are written
+    before the process ends.
+    """
+
+    def __init__(self, max_pending=16):
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            path, data, written = item
+            try:
+                write_atomic(path, data)
+                if written is not None:
+                    written(path)
+            except Exception as error:
+                self._error = self._error or error
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def write(self, path, data, written=None):
+        """
+        Queue a file to be written. written(path) is called on the writer's
+        thread once the file is in place, and not at all when the write fails.
+
+        Raises:
+            ValueError: When the writer is closed
+        """
+        if self._closed:
+            raise ValueError("writer is closed")
+        self._raise_error()
+        self._queue.put((path, data, written))
+
+    def close(self):
+        """Wait until every queued file is written, and refuse any more"""
+        self._closed = True
+        atexit.unregister(self.close)
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+
 # Example usage in each script:
-def save_midi_file(midi_file, base_filename):
+def save_midi_file(
+    midi_file,
+    base_filename,
+    compact=False,
+    single_track=False,
+    metrics=None,
+    filepath=None,
+    writer=None,
+    layout=None,
+    spec=None,
+    target=None,
+):
     """
-    Save a MIDI file with a unique timestamp in the generated directory.
+    Save a MIDI file with a unique timestamp in the generated directory
+    (or under its plain name in the directory named by BUILD_DIR_VARIABLE).
+
+    The file is encoded in memory and written through a temporary file, so
+    a crash never leaves a half-written file behind.
 
     Args:
         midi_file: The MIDIFile object to save
         base_filename: The base name for the file (without timestamp)
+        compact: Write with running status and without redundant same-tick
+            controller events, and print how many bytes that saved
+        single_track: Merge every track into one format-0 track, for players
+            that load those faster
+        metrics: RenderMetrics that get the encode and write timings and the
+            size of the file
+        filepath: Save to this path instead, replacing what is there
+        writer: BackgroundWriter to hand the file to instead of writing it
+            before returning
+        layout: ShardedLayout (layout.py) that names and places the file
+            and records it in its manifest once it is written, instead of
+            the generated directory
+        spec: Spec the file was rendered from, for the layout
+        target: Send the file somewhere other than a path: bytes returns its
+            contents, "-" writes it to standard output and a binary file
+            object gets it written into it
+
+    Returns:
+        The path the file was saved to, its contents for target=bytes or
+        None when it went to standard output or a file object
     """
-    timestamp = get_unique_timestamp()
-    filename = f"{timestamp}_{base_filename}"
-    filepath = get_generated_path(filename)
+    if target is not None:
+        filepath = None
+    elif filepath is None and layout is not None:
+        filepath = layout.new_path(base_filename, spec)
+    elif filepath is None and os.environ.get(BUILD_DIR_VARIABLE):
+        filepath = os.path.join(os.environ[BUILD_DIR_VARIABLE], base_filename)
+    elif filepath is None:
+        filepath = get_generated_path(f"{get_unique_timestamp()}_{base_filename}")
+    filename = os.path.basename(filepath) if filepath else base_filename
+
+    with timed(metrics, "encode"):
+        buffer = io.BytesIO()
+        midi_file.writeFile(buffer)
+        data = buffer.getvalue()
+        if single_track:
+            data = to_format0(data)
+        if compact:
+            data, savings = compact_midi(data)
+    if compact:
+        print(
+            f"{filename}: {savings['original_bytes']} -> "
+            f"{savings['compacted_bytes']} bytes "
+            f"({savings['saved_bytes'] / savings['original_bytes']:.1%} smaller, "
+            f"{savings['dropped_events']} redundant events dropped)",
+            # Keep standard output for the file when it is streamed there
+            file=sys.stderr if target == "-" else sys.stdout,
+        )
 
-    with open(filepath, "wb") as output_file:
-        midi_file.writeFile(output_file)
-    return filepath
+    with timed(metrics, "write"):
+        if target == "-":
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+        elif target is not None and target is not bytes:
+            target.write(data)
+        elif target is None and writer is not None:
+            # The manifest only points at files that are written
+            record = None
+            if layout is not None:
+                record = partial(layout.record, spec=spec)
+            writer.write(filepath, data, record)
+        elif target is None:
+            write_atomic(filepath, data)
+            if layout is not None:
+                layout.record(filepath, spec)
+    if metrics:
+        metrics.output_bytes += len(data)
+    return data if target is bytes else filepath